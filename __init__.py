@@ -44,6 +44,468 @@ def _execution_mode(ctx, inputs):
         )
 
 
+def _target_inputs(ctx, inputs):
+    has_view = ctx.view != ctx.dataset.view()
+    has_selected = bool(ctx.selected)
+    default_target = "DATASET"
+    if has_view or has_selected:
+        target_choices = types.RadioGroup()
+        target_choices.add_choice(
+            "DATASET",
+            label="Entire dataset",
+            description="Run on the entire dataset",
+        )
+
+        if has_view:
+            target_choices.add_choice(
+                "CURRENT_VIEW",
+                label="Current view",
+                description="Run on the current view",
+            )
+            default_target = "CURRENT_VIEW"
+
+        if has_selected:
+            target_choices.add_choice(
+                "SELECTED_SAMPLES",
+                label="Selected samples",
+                description="Run on the selected samples",
+            )
+            default_target = "SELECTED_SAMPLES"
+
+        inputs.enum(
+            "target",
+            target_choices.values(),
+            default=default_target,
+            label="Target",
+            description=(
+                "The samples on which to run. Hashing, grouping, saved "
+                "views and deletions are confined to these samples"
+            ),
+            view=target_choices,
+        )
+
+
+def _get_target_view(ctx):
+    ## ``ctx.target_view()`` is not available in all supported versions
+    target = ctx.params.get("target", None)
+
+    if target == "SELECTED_SAMPLES":
+        return ctx.view.select(ctx.selected)
+
+    if target == "DATASET":
+        return ctx.dataset
+
+    return ctx.view
+
+
+def _parallelism_inputs(ctx, inputs):
+    inputs.int(
+        "num_workers",
+        label="Number of workers",
+        description=(
+            "The number of workers to use when reading and hashing files. "
+            "By default, all available cores are used"
+        ),
+    )
+    inputs.int(
+        "batch_size",
+        default=10000,
+        label="Batch size",
+        description="The number of hashes to write to the database at a time",
+    )
+    inputs.bool(
+        "use_processes",
+        default=False,
+        label="Use processes?",
+        description=(
+            "Whether to hash files in a process pool rather than a thread "
+            "pool. Processes are preferable when hashing is CPU-bound"
+        ),
+        view=types.CheckboxView(),
+    )
+
+
+def _sharding_inputs(ctx, inputs):
+    inputs.bool(
+        "sharded",
+        default=False,
+        label="Shard across processes?",
+        description=(
+            "If checked, the samples are split into ranges of IDs that are "
+            "processed in parallel by worker processes, and the results of "
+            "all shards are merged. Recommended for delegated runs on "
+            "multi-core machines. Incremental and staged hashing, the hash "
+            "cache and prefetching are not available in this mode"
+        ),
+        view=types.CheckboxView(),
+    )
+
+    if ctx.params.get("sharded", False):
+        inputs.int(
+            "num_shards",
+            label="Number of shards",
+            description=(
+                "The number of ID ranges to split the samples into. By "
+                "default, four shards are used per worker"
+            ),
+        )
+
+
+def _is_sharded(ctx):
+    ## runs on new samples only are never sharded
+    return ctx.params.get("sharded", False) and not ctx.params.get(
+        "new_samples_only", False
+    )
+
+
+def _get_unsharded_param(ctx, name, default=False):
+    ## options that sharded runs do not support are hidden from the form, but
+    ## values chosen before sharding was enabled remain in the params
+    if _is_sharded(ctx):
+        return False
+
+    return ctx.params.get(name, default)
+
+
+def _prefetch_inputs(ctx, inputs):
+    if _is_sharded(ctx):
+        return
+
+    inputs.bool(
+        "prefetch",
+        default=False,
+        label="Prefetch reads asynchronously?",
+        description=(
+            "If checked, many files are read concurrently and streamed into "
+            "the hasher as they arrive. Recommended for media on network "
+            "filesystems or HTTP(S) URLs, where each read waits on a "
+            "round-trip"
+        ),
+        view=types.CheckboxView(),
+    )
+
+    if ctx.params.get("prefetch", False):
+        inputs.int(
+            "max_in_flight",
+            label="Maximum reads in flight",
+            description=(
+                "The maximum number of files to read concurrently. By "
+                "default, 64 files are read at a time"
+            ),
+        )
+
+
+def _instrumentation_inputs(ctx, inputs):
+    inputs.bool(
+        "log_metrics",
+        default=False,
+        label="Log stage metrics?",
+        description=(
+            "If checked, the timing and I/O metrics of each stage are logged "
+            "as structured JSON records as the stage completes"
+        ),
+        view=types.CheckboxView(),
+    )
+    inputs.str(
+        "profile_path",
+        label="Profile output path",
+        description=(
+            "An optional path to which to write cProfile stats for the run"
+        ),
+    )
+
+
+def _stage_metrics_output(outputs):
+    outputs.obj(
+        "stages",
+        label="Stage metrics",
+        description="The timing, item counts and bytes read of each stage",
+        view=types.JSONView(),
+    )
+
+
+def _new_samples_input(ctx, inputs):
+    inputs.bool(
+        "new_samples_only",
+        default=False,
+        label="Only process new samples?",
+        description=(
+            "If checked, only samples that were added since the last run "
+            "are hashed and compared against the existing samples, and the "
+            "existing duplicate groups are updated in place"
+        ),
+        view=types.CheckboxView(),
+    )
+
+
+def _new_samples_output(ctx, header):
+    outputs = types.Object()
+    outputs.int("num_new_samples", label="Number of new samples")
+    outputs.int("num_new_dups", label="Number of new samples with duplicates")
+    _stage_metrics_output(outputs)
+    return types.Property(outputs, view=types.View(label=header))
+
+
+def _pagination_inputs(ctx, inputs):
+    inputs.int(
+        "page",
+        default=1,
+        label="Page",
+        description="The page of duplicate groups to display",
+    )
+    inputs.int(
+        "page_size",
+        default=100,
+        label="Groups per page",
+        description="The number of duplicate groups to display per page",
+    )
+
+
+def _deletion_inputs(ctx, inputs):
+    inputs.int(
+        "delete_batch_size",
+        default=10000,
+        label="Deletion batch size",
+        description=(
+            "The number of samples to delete at a time. If the operation is "
+            "interrupted, running it again resumes from the remaining samples"
+        ),
+    )
+    _execution_mode(ctx, inputs)
+
+
+def _deletion_progress(ctx):
+    def progress(num_deleted, num_total):
+        ctx.set_progress(
+            progress=num_deleted / max(num_total, 1),
+            label="Deleted %d of %d samples" % (num_deleted, num_total),
+        )
+
+    return progress
+
+
+def _keep_policy_input(ctx, inputs, default):
+    with add_sys_path(os.path.dirname(os.path.abspath(__file__))):
+        # pylint: disable=no-name-in-module,import-error
+        from dedup_utils import KEEP_POLICIES
+
+    keep_choices = types.Dropdown(label="Sample to keep")
+    for policy, description in KEEP_POLICIES.items():
+        keep_choices.add_choice(policy, label=description)
+
+    inputs.enum(
+        "keep",
+        keep_choices.values(),
+        default=default,
+        label="Sample to keep",
+        description="Which sample to keep from each group of duplicates",
+        view=keep_choices,
+    )
+
+
+def _filehash_method_input(ctx, inputs):
+    with add_sys_path(os.path.dirname(os.path.abspath(__file__))):
+        # pylint: disable=no-name-in-module,import-error
+        from file_hashes import (
+            FILEHASH_METHODS,
+            get_available_filehash_methods,
+        )
+
+    method_choices = types.Dropdown(label="Hash method")
+    for method in get_available_filehash_methods():
+        method_choices.add_choice(method, label=FILEHASH_METHODS[method])
+
+    inputs.enum(
+        "filehash_method",
+        method_choices.values(),
+        default="md5",
+        label="Hash method",
+        description=(
+            "The algorithm with which to hash files. Non-cryptographic "
+            "hashes are faster and are stored as compact integers. Changing "
+            "the method discards hashes computed with the previous method"
+        ),
+        view=method_choices,
+    )
+
+
+def _similarity_inputs(ctx, inputs, sim_keys):
+    sim_choices = types.Dropdown(label="Similarity Run")
+    for sim_key in sim_keys:
+        sim_choices.add_choice(sim_key, label=sim_key)
+    inputs.enum(
+        "sim_choices",
+        sim_choices.values(),
+        default=sim_choices.choices[0].value,
+        view=sim_choices,
+    )
+
+    method_choices = types.RadioGroup()
+    method_choices.add_choice("threshold", label="Threshold")
+    method_choices.add_choice("fraction", label="Fraction")
+    inputs.enum(
+        "method_choices",
+        method_choices.values(),
+        default=method_choices.choices[0].value,
+        label="Approximate Duplicate Selection Method",
+        view=method_choices,
+    )
+
+    if ctx.params.get("method_choices", False) == "fraction":
+        fraction_slider = types.SliderView(
+            label="Fraction of dataset to select",
+            description="Select the fraction of the dataset to mark as approximate duplicates",
+            componentsProps={"slider": {"min": 0, "max": 1, "step": 0.01}},
+        )
+        inputs.float("dup_fraction", default=0.1, view=fraction_slider)
+    else:
+        inputs.float(
+            "threshold_value",
+            default=0.5,
+            label="Distance Threshold",
+            description="Select the distance threshold for determining approximate duplicates",
+        )
+
+
+def _perceptual_hash_inputs(ctx, inputs, include_threshold=True):
+    phash_choices = types.Dropdown(label="Perceptual hash")
+    phash_choices.add_choice("phash", label="pHash (DCT)")
+    phash_choices.add_choice("dhash", label="dHash (gradient)")
+    phash_choices.add_choice("ahash", label="aHash (average)")
+    inputs.enum(
+        "phash_method",
+        phash_choices.values(),
+        default="phash",
+        label="Perceptual hash",
+        description="The 64-bit perceptual hash to compute for each image",
+        view=phash_choices,
+    )
+    if include_threshold:
+        inputs.int(
+            "hamming_threshold",
+            default=6,
+            label="Hamming Distance Threshold",
+            description=(
+                "The maximum number of differing bits between the hashes of "
+                "two images for them to be considered approximate duplicates"
+            ),
+        )
+
+    _parallelism_inputs(ctx, inputs)
+
+
+def _embedding_inputs(ctx, inputs, embedding_fields):
+    field_choices = types.DropdownView()
+    for field in embedding_fields:
+        field_choices.add_choice(field, label=field)
+
+    inputs.enum(
+        "embeddings_field",
+        field_choices.values(),
+        required=True,
+        label="Embeddings field",
+        description="The field containing the embedding of each image",
+        view=field_choices,
+    )
+
+    metric_choices = types.RadioGroup()
+    metric_choices.add_choice("cosine", label="Cosine")
+    metric_choices.add_choice("euclidean", label="Euclidean")
+    inputs.enum(
+        "metric",
+        metric_choices.values(),
+        default="cosine",
+        label="Distance metric",
+        view=metric_choices,
+    )
+    inputs.float(
+        "embedding_threshold",
+        default=0.1,
+        required=True,
+        label="Distance threshold",
+        description=(
+            "The maximum distance between the embeddings of two images for "
+            "them to be considered approximate duplicates"
+        ),
+    )
+
+    dtype_choices = types.Dropdown(label="Storage precision")
+    dtype_choices.add_choice("float32", label="float32")
+    dtype_choices.add_choice("float16", label="float16")
+    dtype_choices.add_choice("int8", label="int8")
+    inputs.enum(
+        "embedding_dtype",
+        dtype_choices.values(),
+        default="float32",
+        label="Storage precision",
+        description=(
+            "Embeddings are written to a temporary memory-mapped file with "
+            "this precision. Lower precisions use less disk and memory at a "
+            "small cost in accuracy"
+        ),
+        view=dtype_choices,
+    )
+    inputs.int(
+        "block_size",
+        default=4096,
+        label="Block size",
+        description=(
+            "The number of embeddings compared at a time. Memory usage grows "
+            "with the square of this value"
+        ),
+    )
+
+
+def _sweep_inputs(ctx, inputs, backend):
+    inputs.bool(
+        "sweep",
+        default=False,
+        label="Sweep thresholds?",
+        description=(
+            "If checked, the number of duplicates and groups is reported for "
+            "several values without modifying the dataset. The neighbor "
+            "pairs are cached, so running again with one of the values "
+            "reuses them"
+        ),
+        view=types.CheckboxView(),
+    )
+
+    if not ctx.params.get("sweep", False):
+        return
+
+    inputs.str(
+        "sweep_values",
+        required=True,
+        label="Values to sweep",
+        description=(
+            "A comma-separated list of thresholds, or of fractions when "
+            "selecting duplicates by fraction"
+        ),
+    )
+    ## Hamming distances are integers
+    if backend == "perceptual_hash":
+        max_threshold_input = inputs.int
+    else:
+        max_threshold_input = inputs.float
+
+    max_threshold_input(
+        "max_threshold",
+        label="Maximum threshold",
+        description=(
+            "The distance up to which neighbor pairs are computed and cached. "
+            "Required when sweeping fractions"
+        ),
+    )
+
+
+def get_embedding_fields(dataset):
+    """
+    Returns a list of the vector fields of the given dataset.
+    """
+    schema = dataset.get_field_schema(ftype=fo.VectorField)
+    return sorted(schema.keys())
+
+
 def get_similarity_runs(dataset):
     """
     Returns a list of similarity runs for the given dataset.
@@ -78,27 +540,156 @@ class FindExactDuplicates(foo.Operator):
             label="Find exact duplicates",
             description="Find exact duplicates in the dataset",
         )
+        _target_inputs(ctx, inputs)
+        _new_samples_input(ctx, inputs)
+
+        hash_choices = types.RadioGroup()
+        hash_choices.add_choice("filehash", label="File bytes")
+        hash_choices.add_choice("pixelhash", label="Decoded pixels")
+        inputs.enum(
+            "hash_field",
+            hash_choices.values(),
+            default="filehash",
+            label="What to hash",
+            description=(
+                "Hash the raw file bytes, or the decoded pixels so that "
+                "images that only differ in their metadata or in their "
+                "lossless encoding are also found"
+            ),
+            view=hash_choices,
+        )
+
+        if ctx.params.get("hash_field", "filehash") == "pixelhash":
+            inputs.int(
+                "pixel_size",
+                label="Downscaled size",
+                description=(
+                    "If provided, images are downscaled so that their "
+                    "largest side is at most this many pixels before "
+                    "hashing, which is much faster for JPEGs but no longer "
+                    "matches images across formats"
+                ),
+            )
+        elif not _is_sharded(ctx):
+            inputs.bool(
+                "incremental",
+                default=True,
+                label="Only hash new or changed files?",
+                description=(
+                    "If checked, only samples without a hash or whose file "
+                    "size or modification time changed since they were last "
+                    "hashed are hashed"
+                ),
+                view=types.CheckboxView(),
+            )
+            inputs.bool(
+                "staged",
+                default=False,
+                label="Only hash potential duplicates?",
+                description=(
+                    "If checked, files are first compared by size and then "
+                    "by a partial hash, and only files that still collide "
+                    "are fully hashed. Incremental mode and the hash cache "
+                    "do not apply in this mode, and media must be local "
+                    "rather than HTTP(S) URLs"
+                ),
+                view=types.CheckboxView(),
+            )
+            inputs.bool(
+                "use_cache",
+                default=False,
+                label="Use persistent hash cache?",
+                description=(
+                    "If checked, hashes of files that were already hashed "
+                    "on this machine, for any dataset, are reused from an "
+                    "on-disk cache rather than reading the files again"
+                ),
+                view=types.CheckboxView(),
+            )
+            _prefetch_inputs(ctx, inputs)
+        _filehash_method_input(ctx, inputs)
+        _parallelism_inputs(ctx, inputs)
+        if not ctx.params.get("new_samples_only", False):
+            _sharding_inputs(ctx, inputs)
+        _instrumentation_inputs(ctx, inputs)
         _execution_mode(ctx, inputs)
         return types.Property(inputs, view=form_view)
 
     def execute(self, ctx):
         with add_sys_path(os.path.dirname(os.path.abspath(__file__))):
             # pylint: disable=no-name-in-module,import-error
-            from exact_dups import find_exact_duplicates
+            from dedup_metrics import StageMetrics, profile
+            from exact_dups import (
+                add_new_exact_duplicates,
+                find_exact_duplicates,
+            )
+
+        sample_collection = _get_target_view(ctx)
+        metrics = StageMetrics(log=ctx.params.get("log_metrics", False))
+
+        if ctx.params.get("new_samples_only", False):
+            with profile(ctx.params.get("profile_path", None)):
+                response = add_new_exact_duplicates(
+                    sample_collection,
+                    num_workers=ctx.params.get("num_workers", None),
+                    batch_size=ctx.params.get("batch_size", None),
+                    use_processes=ctx.params.get("use_processes", False),
+                    use_cache=ctx.params.get("use_cache", False),
+                    method=ctx.params.get("filehash_method", "md5"),
+                    hash_field=ctx.params.get("hash_field", "filehash"),
+                    pixel_size=ctx.params.get("pixel_size", None),
+                    prefetch=ctx.params.get("prefetch", False),
+                    max_in_flight=ctx.params.get("max_in_flight", None),
+                    metrics=metrics,
+                )
 
-        sample_collection = ctx.dataset
+            ctx.ops.reload_dataset()
+            return response
+
+        with profile(ctx.params.get("profile_path", None)):
+            response = find_exact_duplicates(
+                sample_collection,
+                num_workers=ctx.params.get("num_workers", None),
+                batch_size=ctx.params.get("batch_size", None),
+                use_processes=ctx.params.get("use_processes", False),
+                incremental=_get_unsharded_param(ctx, "incremental", True),
+                use_cache=_get_unsharded_param(ctx, "use_cache"),
+                staged=_get_unsharded_param(ctx, "staged"),
+                sharded=_is_sharded(ctx),
+                num_shards=ctx.params.get("num_shards", None),
+                method=ctx.params.get("filehash_method", "md5"),
+                hash_field=ctx.params.get("hash_field", "filehash"),
+                pixel_size=ctx.params.get("pixel_size", None),
+                prefetch=_get_unsharded_param(ctx, "prefetch"),
+                max_in_flight=ctx.params.get("max_in_flight", None),
+                metrics=metrics,
+            )
 
-        response = find_exact_duplicates(sample_collection)
         ctx.ops.reload_dataset()
         return response
 
     def resolve_output(self, ctx):
+        if ctx.params.get("new_samples_only", False):
+            return _new_samples_output(ctx, "Exact Duplicate Results")
+
         outputs = types.Object()
         outputs.str(
             "num_images_with_exact_dups",
             label="Number of images with exact duplicates",
         )
         outputs.str("num_dups", label="Number of exact duplicates")
+        if _get_unsharded_param(ctx, "staged"):
+            outputs.int("bytes_read", label="Bytes read")
+            outputs.int(
+                "bytes_avoided_by_size",
+                label="Bytes not read thanks to file sizes",
+            )
+            outputs.int(
+                "bytes_avoided_by_partial_hash",
+                label="Bytes not read thanks to partial hashes",
+            )
+
+        _stage_metrics_output(outputs)
         header = "Exact Duplicate Results"
         return types.Property(outputs, view=types.View(label=header))
 
@@ -121,14 +712,20 @@ class DisplayExactDuplicates(foo.Operator):
             label="Display exact duplicates",
             description="Display exact duplicates in the dataset",
         )
+        _target_inputs(ctx, inputs)
+        _pagination_inputs(ctx, inputs)
         return types.Property(inputs, view=form_view)
 
     def execute(self, ctx):
         with add_sys_path(os.path.dirname(os.path.abspath(__file__))):
             # pylint: disable=no-name-in-module,import-error
-            from exact_dups import get_exact_duplicate_groups
+            from exact_dups import get_exact_duplicate_groups_page
 
-        view = get_exact_duplicate_groups(ctx.dataset)
+        view, _ = get_exact_duplicate_groups_page(
+            _get_target_view(ctx),
+            page=max(ctx.params.get("page", 1) - 1, 0),
+            page_size=ctx.params.get("page_size", 100),
+        )
         ctx.ops.set_view(view=view)
 
 
@@ -144,12 +741,17 @@ class RemoveAllExactDuplicates(foo.Operator):
         _config.icon = "/assets/delete.svg"
         return _config
 
+    def resolve_delegation(self, ctx):
+        return ctx.params.get("delegate", False)
+
     def resolve_input(self, ctx):
         inputs = types.Object()
         form_view = types.View(
             label="Remove all exact duplicates",
             description="Remove all exact duplicates from the dataset",
         )
+        _target_inputs(ctx, inputs)
+        _deletion_inputs(ctx, inputs)
         return types.Property(inputs, view=form_view)
 
     def execute(self, ctx):
@@ -157,7 +759,11 @@ class RemoveAllExactDuplicates(foo.Operator):
             # pylint: disable=no-name-in-module,import-error
             from exact_dups import remove_all_exact_duplicates
 
-        remove_all_exact_duplicates(ctx.dataset)
+        remove_all_exact_duplicates(
+            _get_target_view(ctx),
+            batch_size=ctx.params.get("delete_batch_size", None),
+            progress=_deletion_progress(ctx),
+        )
         ctx.ops.reload_dataset()
 
 
@@ -173,12 +779,18 @@ class DeduplicateExactDuplicates(foo.Operator):
         _config.icon = "/assets/representative.svg"
         return _config
 
+    def resolve_delegation(self, ctx):
+        return ctx.params.get("delegate", False)
+
     def resolve_input(self, ctx):
         inputs = types.Object()
         form_view = types.View(
             label="Deduplicate exact duplicates",
             description="Deduplicate exact duplicates in the dataset",
         )
+        _target_inputs(ctx, inputs)
+        _keep_policy_input(ctx, inputs, "first")
+        _deletion_inputs(ctx, inputs)
         return types.Property(inputs, view=form_view)
 
     def execute(self, ctx):
@@ -186,10 +798,255 @@ class DeduplicateExactDuplicates(foo.Operator):
             # pylint: disable=no-name-in-module,import-error
             from exact_dups import deduplicate_exact_duplicates
 
-        deduplicate_exact_duplicates(ctx.dataset)
+        keep = ctx.params.get("keep", "first")
+        deduplicate_exact_duplicates(
+            _get_target_view(ctx),
+            keep=keep,
+            batch_size=ctx.params.get("delete_batch_size", None),
+            progress=_deletion_progress(ctx),
+        )
         ctx.ops.reload_dataset()
 
 
+class PruneFilehashCache(foo.Operator):
+    @property
+    def config(self):
+        _config = foo.OperatorConfig(
+            name="prune_filehash_cache",
+            label="Dedup: Prune file hash cache",
+            description=(
+                "Remove stale entries from the persistent file hash cache"
+            ),
+            dynamic=True,
+        )
+        _config.icon = "/assets/delete.svg"
+        return _config
+
+    def resolve_delegation(self, ctx):
+        return ctx.params.get("delegate", False)
+
+    def resolve_input(self, ctx):
+        with add_sys_path(os.path.dirname(os.path.abspath(__file__))):
+            # pylint: disable=no-name-in-module,import-error
+            from hash_cache import DEFAULT_MAX_ENTRIES
+
+        inputs = types.Object()
+        form_view = types.View(
+            label="Prune file hash cache",
+            description=(
+                "Remove entries for files that were deleted or modified, and "
+                "evict the least recently used entries beyond the size limit"
+            ),
+        )
+        inputs.int(
+            "max_entries",
+            default=DEFAULT_MAX_ENTRIES,
+            label="Maximum number of entries",
+            description="The maximum number of entries to keep in the cache",
+        )
+        _execution_mode(ctx, inputs)
+        return types.Property(inputs, view=form_view)
+
+    def execute(self, ctx):
+        with add_sys_path(os.path.dirname(os.path.abspath(__file__))):
+            # pylint: disable=no-name-in-module,import-error
+            from hash_cache import FileHashCache
+
+        max_entries = ctx.params.get("max_entries", None)
+        with FileHashCache(max_entries=max_entries) as cache:
+            num_removed = cache.prune()
+            num_entries = len(cache)
+
+        return {"num_removed": num_removed, "num_entries": num_entries}
+
+    def resolve_output(self, ctx):
+        outputs = types.Object()
+        outputs.int("num_removed", label="Number of removed entries")
+        outputs.int("num_entries", label="Number of remaining entries")
+        header = "File Hash Cache"
+        return types.Property(outputs, view=types.View(label=header))
+
+
+class BuildReferenceHashIndex(foo.Operator):
+    @property
+    def config(self):
+        _config = foo.OperatorConfig(
+            name="build_reference_hash_index",
+            label="Dedup: Build reference hash index",
+            description=(
+                "Build a persistent hash index of the dataset that other "
+                "datasets can be checked against"
+            ),
+            dynamic=True,
+        )
+        _config.icon = "/assets/exact_dup.svg"
+        return _config
+
+    def resolve_delegation(self, ctx):
+        return ctx.params.get("delegate", False)
+
+    def resolve_input(self, ctx):
+        inputs = types.Object()
+        form_view = types.View(
+            label="Build reference hash index",
+            description=(
+                "Write the file hashes of the dataset to an on-disk index "
+                "that can be checked against without loading this dataset"
+            ),
+        )
+        _target_inputs(ctx, inputs)
+        inputs.str(
+            "index_dir",
+            required=True,
+            label="Index directory",
+            description="The directory in which to write the index",
+        )
+        _filehash_method_input(ctx, inputs)
+        inputs.bool(
+            "include_phashes",
+            default=False,
+            label="Include perceptual hashes?",
+            description=(
+                "If checked, perceptual hashes are also indexed so that "
+                "near-duplicates of the reference images can be detected"
+            ),
+            view=types.CheckboxView(),
+        )
+        if ctx.params.get("include_phashes", False):
+            inputs.int(
+                "phash_max_distance",
+                default=10,
+                label="Maximum Hamming distance",
+                description=(
+                    "The largest Hamming distance threshold that checks "
+                    "against the index can use without rebuilding its "
+                    "lookup tables"
+                ),
+            )
+            _perceptual_hash_inputs(ctx, inputs, include_threshold=False)
+        else:
+            _parallelism_inputs(ctx, inputs)
+
+        _execution_mode(ctx, inputs)
+        return types.Property(inputs, view=form_view)
+
+    def execute(self, ctx):
+        with add_sys_path(os.path.dirname(os.path.abspath(__file__))):
+            # pylint: disable=no-name-in-module,import-error
+            from reference_index import build_reference_index
+
+        if ctx.params.get("include_phashes", False):
+            phash_method = ctx.params.get("phash_method", "phash")
+        else:
+            phash_method = None
+
+        return build_reference_index(
+            _get_target_view(ctx),
+            ctx.params["index_dir"],
+            phash_method=phash_method,
+            num_workers=ctx.params.get("num_workers", None),
+            batch_size=ctx.params.get("batch_size", None),
+            use_processes=ctx.params.get("use_processes", False),
+            filehash_method=ctx.params.get("filehash_method", "md5"),
+            phash_max_distance=ctx.params.get("phash_max_distance", 10),
+        )
+
+    def resolve_output(self, ctx):
+        outputs = types.Object()
+        outputs.int("num_filehashes", label="Number of indexed file hashes")
+        header = "Reference Hash Index"
+        return types.Property(outputs, view=types.View(label=header))
+
+
+class CheckReferenceHashIndex(foo.Operator):
+    @property
+    def config(self):
+        _config = foo.OperatorConfig(
+            name="check_reference_hash_index",
+            label="Dedup: Check against reference hash index",
+            description=(
+                "Tag the samples that duplicate an image in a reference hash "
+                "index"
+            ),
+            dynamic=True,
+        )
+        _config.icon = "/assets/exact_dup.svg"
+        return _config
+
+    def resolve_delegation(self, ctx):
+        return ctx.params.get("delegate", False)
+
+    def resolve_input(self, ctx):
+        with add_sys_path(os.path.dirname(os.path.abspath(__file__))):
+            # pylint: disable=no-name-in-module,import-error
+            from reference_index import DEFAULT_REFERENCE_TAG
+
+        inputs = types.Object()
+        form_view = types.View(
+            label="Check against reference hash index",
+            description=(
+                "Tag the samples whose images are duplicates of an image in "
+                "a reference hash index"
+            ),
+        )
+        _target_inputs(ctx, inputs)
+        inputs.str(
+            "index_dir",
+            required=True,
+            label="Index directory",
+            description="The directory containing the reference index",
+        )
+        inputs.str(
+            "tag",
+            default=DEFAULT_REFERENCE_TAG,
+            label="Tag",
+            description="The tag to add to the matching samples",
+        )
+        inputs.int(
+            "hamming_threshold",
+            label="Hamming Distance Threshold",
+            description=(
+                "If provided and the index contains perceptual hashes, "
+                "samples whose perceptual hash differs from a reference hash "
+                "by at most this many bits are also tagged"
+            ),
+        )
+        _parallelism_inputs(ctx, inputs)
+        _execution_mode(ctx, inputs)
+        return types.Property(inputs, view=form_view)
+
+    def execute(self, ctx):
+        with add_sys_path(os.path.dirname(os.path.abspath(__file__))):
+            # pylint: disable=no-name-in-module,import-error
+            from reference_index import (
+                DEFAULT_REFERENCE_TAG,
+                check_against_reference_index,
+            )
+
+        response = check_against_reference_index(
+            _get_target_view(ctx),
+            ctx.params["index_dir"],
+            tag=ctx.params.get("tag", None) or DEFAULT_REFERENCE_TAG,
+            phash_threshold=ctx.params.get("hamming_threshold", None),
+            num_workers=ctx.params.get("num_workers", None),
+            batch_size=ctx.params.get("batch_size", None),
+            use_processes=ctx.params.get("use_processes", False),
+        )
+
+        ctx.ops.reload_dataset()
+        return response
+
+    def resolve_output(self, ctx):
+        outputs = types.Object()
+        outputs.int(
+            "num_exact_matches",
+            label="Number of exact duplicates of reference images",
+        )
+        outputs.int("num_matches", label="Number of tagged samples")
+        header = "Reference Hash Index Results"
+        return types.Property(outputs, view=types.View(label=header))
+
+
 class FindApproximateDuplicates(foo.Operator):
     @property
     def config(self):
@@ -211,9 +1068,51 @@ class FindApproximateDuplicates(foo.Operator):
             label="Find Approximate Duplicates",
             description="Find approximate duplicates in the dataset using embeddings",
         )
+        _target_inputs(ctx, inputs)
 
         sim_keys = get_similarity_runs(ctx.dataset)
-        if len(sim_keys) == 0:
+
+        backend_choices = types.RadioGroup()
+        backend_choices.add_choice("similarity", label="Similarity index")
+        backend_choices.add_choice("perceptual_hash", label="Perceptual hash")
+        backend_choices.add_choice("embeddings", label="Embeddings field")
+        inputs.enum(
+            "backend",
+            backend_choices.values(),
+            default="similarity" if sim_keys else "perceptual_hash",
+            label="Approximate Duplicate Backend",
+            description=(
+                "Use the embeddings of an existing similarity index, compare "
+                "perceptual hashes computed directly from the images, or "
+                "compare the embeddings stored in a field"
+            ),
+            view=backend_choices,
+        )
+
+        backend = ctx.params.get("backend", None)
+        if backend is None:
+            backend = "similarity" if sim_keys else "perceptual_hash"
+
+        if backend == "perceptual_hash":
+            _new_samples_input(ctx, inputs)
+            _perceptual_hash_inputs(ctx, inputs)
+            if not ctx.params.get("new_samples_only", False):
+                _sharding_inputs(ctx, inputs)
+            _prefetch_inputs(ctx, inputs)
+        elif backend == "embeddings":
+            embedding_fields = get_embedding_fields(ctx.dataset)
+            if embedding_fields:
+                _embedding_inputs(ctx, inputs, embedding_fields)
+                _sharding_inputs(ctx, inputs)
+            else:
+                inputs.str(
+                    "no_embeddings_warning",
+                    view=types.Warning(
+                        label="No Embeddings",
+                        description="You must store embeddings in a vector field of the dataset before you can find approximate duplicates from them. \n\nSee ```dataset.compute_embeddings()```",
+                    ),
+                )
+        elif len(sim_keys) == 0:
             inputs.str(
                 "no_similarity_run_warning",
                 view=types.Warning(
@@ -222,76 +1121,187 @@ class FindApproximateDuplicates(foo.Operator):
                 ),
             )
         else:
-            sim_choices = types.Dropdown(label="Similarity Run")
-            for sim_key in sim_keys:
-                sim_choices.add_choice(sim_key, label=sim_key)
-            inputs.enum(
-                "sim_choices",
-                sim_choices.values(),
-                default=sim_choices.choices[0].value,
-                view=sim_choices,
-            )
-
-            method_choices = types.RadioGroup()
-            method_choices.add_choice("threshold", label="Threshold")
-            method_choices.add_choice("fraction", label="Fraction")
-            inputs.enum(
-                "method_choices",
-                method_choices.values(),
-                default=method_choices.choices[0].value,
-                label="Approximate Duplicate Selection Method",
-                view=method_choices,
-            )
-
-            if ctx.params.get("method_choices", False) == "fraction":
-                fraction_slider = types.SliderView(
-                    label="Fraction of dataset to select",
-                    description="Select the fraction of the dataset to mark as approximate duplicates",
-                    componentsProps={
-                        "slider": {"min": 0, "max": 1, "step": 0.01}
-                    },
-                )
-                inputs.float("dup_fraction", default=0.1, view=fraction_slider)
-            else:
-                inputs.float(
-                    "threshold_value",
-                    default=0.5,
-                    label="Distance Threshold",
-                    description="Select the distance threshold for determining approximate duplicates",
-                )
-
+            _similarity_inputs(ctx, inputs, sim_keys)
+
+        if backend != "embeddings":
+            _sweep_inputs(ctx, inputs, backend)
+
+        inputs.float(
+            "max_group_diameter",
+            label="Maximum group diameter",
+            description=(
+                "Duplicates are grouped transitively. If provided, groups are "
+                "only merged while a bound of the distance between the "
+                "members of each group is within this value. The bound holds "
+                "for Euclidean, cosine and Hamming distances, but not for dot "
+                "products"
+            ),
+        )
+        _instrumentation_inputs(ctx, inputs)
         _execution_mode(ctx, inputs)
         return types.Property(inputs, view=form_view)
 
     def execute(self, ctx):
         with add_sys_path(os.path.dirname(os.path.abspath(__file__))):
             # pylint: disable=no-name-in-module,import-error
-            from approx_dups import find_approximate_duplicates
+            from dedup_metrics import StageMetrics, profile
+
+        metrics = StageMetrics(log=ctx.params.get("log_metrics", False))
+
+        with profile(ctx.params.get("profile_path", None)):
+            return self._find_duplicates(ctx, metrics)
 
-        sample_collection = ctx.dataset
-        method = ctx.params.get("method", "None provided")
+    def _find_duplicates(self, ctx, metrics):
+        with add_sys_path(os.path.dirname(os.path.abspath(__file__))):
+            # pylint: disable=no-name-in-module,import-error
+            from approx_dups import (
+                add_new_perceptual_duplicates,
+                find_approximate_duplicates,
+                find_embedding_duplicates,
+                find_perceptual_duplicates,
+            )
+
+        sample_collection = _get_target_view(ctx)
+
+        backend = ctx.params.get("backend", None)
+        if backend != "embeddings" and ctx.params.get("sweep", False):
+            return self._sweep(ctx)
+
+        max_diameter = ctx.params.get("max_group_diameter", None)
+
+        if backend == "perceptual_hash":
+            kwargs = dict(
+                method=ctx.params.get("phash_method", "phash"),
+                threshold=ctx.params.get("hamming_threshold", 6),
+                num_workers=ctx.params.get("num_workers", None),
+                batch_size=ctx.params.get("batch_size", None),
+                use_processes=ctx.params.get("use_processes", False),
+                prefetch=_get_unsharded_param(ctx, "prefetch"),
+                max_in_flight=ctx.params.get("max_in_flight", None),
+                metrics=metrics,
+            )
+            if ctx.params.get("new_samples_only", False):
+                return add_new_perceptual_duplicates(
+                    sample_collection, **kwargs
+                )
+
+            return find_perceptual_duplicates(
+                sample_collection,
+                max_diameter=max_diameter,
+                sharded=_is_sharded(ctx),
+                num_shards=ctx.params.get("num_shards", None),
+                **kwargs,
+            )
+
+        if backend == "embeddings":
+            return find_embedding_duplicates(
+                sample_collection,
+                ctx.params["embeddings_field"],
+                ctx.params.get("embedding_threshold", 0.1),
+                metric=ctx.params.get("metric", "cosine"),
+                dtype=ctx.params.get("embedding_dtype", "float32"),
+                block_size=ctx.params.get("block_size", None),
+                max_diameter=max_diameter,
+                sharded=ctx.params.get("sharded", False),
+                num_shards=ctx.params.get("num_shards", None),
+                metrics=metrics,
+            )
+
+        method = ctx.params.get("method_choices", "None provided")
         brain_key = ctx.params.get("sim_choices", None)
 
         if method == "fraction":
             fraction = ctx.params.get("dup_fraction", 0.1)
             response = find_approximate_duplicates(
-                sample_collection, brain_key, fraction=fraction
+                sample_collection,
+                brain_key,
+                fraction=fraction,
+                max_diameter=max_diameter,
+                metrics=metrics,
             )
         else:
             threshold = ctx.params.get("threshold_value", 0.5)
             response = find_approximate_duplicates(
-                sample_collection, brain_key, threshold=threshold
+                sample_collection,
+                brain_key,
+                threshold=threshold,
+                max_diameter=max_diameter,
+                metrics=metrics,
             )
 
         return response
 
+    def _sweep(self, ctx):
+        with add_sys_path(os.path.dirname(os.path.abspath(__file__))):
+            # pylint: disable=no-name-in-module,import-error
+            from approx_dups import (
+                sweep_approximate_duplicates,
+                sweep_perceptual_duplicates,
+            )
+
+        values = [
+            float(v)
+            for v in ctx.params["sweep_values"].split(",")
+            if v.strip()
+        ]
+        max_threshold = ctx.params.get("max_threshold", None)
+
+        if ctx.params.get("backend", None) == "perceptual_hash":
+            return sweep_perceptual_duplicates(
+                _get_target_view(ctx),
+                method=ctx.params.get("phash_method", "phash"),
+                thresholds=values,
+                max_threshold=max_threshold,
+                num_workers=ctx.params.get("num_workers", None),
+                batch_size=ctx.params.get("batch_size", None),
+                use_processes=ctx.params.get("use_processes", False),
+            )
+
+        brain_key = ctx.params.get("sim_choices", None)
+        if ctx.params.get("method_choices", None) == "fraction":
+            return sweep_approximate_duplicates(
+                _get_target_view(ctx),
+                brain_key,
+                fractions=values,
+                max_threshold=max_threshold,
+            )
+
+        return sweep_approximate_duplicates(
+            _get_target_view(ctx),
+            brain_key,
+            thresholds=values,
+            max_threshold=max_threshold,
+        )
+
     def resolve_output(self, ctx):
+        backend = ctx.params.get("backend", None)
+        if backend != "embeddings" and ctx.params.get("sweep", False):
+            outputs = types.Object()
+            outputs.float("max_threshold", label="Maximum threshold")
+            outputs.list(
+                "sweep",
+                types.Object(),
+                label="Sweep results",
+                description=(
+                    "The number of duplicates and groups at each threshold"
+                ),
+                view=types.JSONView(),
+            )
+            header = "Approximate Duplicate Sweep"
+            return types.Property(outputs, view=types.View(label=header))
+
+        if backend == "perceptual_hash" and ctx.params.get(
+            "new_samples_only", False
+        ):
+            return _new_samples_output(ctx, "Approximate Duplicate Results")
+
         outputs = types.Object()
         outputs.str(
             "num_images_with_approx_dups",
             label="Number of images with approximate duplicates",
         )
         outputs.str("num_dups", label="Number of approximate duplicates")
+        _stage_metrics_output(outputs)
         header = "Approximate Duplicate Results"
         return types.Property(outputs, view=types.View(label=header))
 
@@ -314,15 +1324,34 @@ class DisplayApproximateDuplicates(foo.Operator):
             label="Display approximate duplicates",
             description="Display approximate duplicates in the dataset",
         )
+
+        sort_choices = types.RadioGroup()
+        sort_choices.add_choice("size", label="Group size")
+        sort_choices.add_choice("max_distance", label="Maximum distance")
+        inputs.enum(
+            "sort_by",
+            sort_choices.values(),
+            default="size",
+            label="Order groups by",
+            description="Groups are shown in decreasing order of this value",
+            view=sort_choices,
+        )
+        _target_inputs(ctx, inputs)
+        _pagination_inputs(ctx, inputs)
         return types.Property(inputs, view=form_view)
 
     def execute(self, ctx):
         with add_sys_path(os.path.dirname(os.path.abspath(__file__))):
             # pylint: disable=no-name-in-module,import-error
-            from approx_dups import get_approximate_duplicate_groups
+            from approx_dups import get_approximate_duplicate_groups_page
 
-            view = get_approximate_duplicate_groups(ctx.dataset)
-            ctx.ops.set_view(view=view)
+        view, _ = get_approximate_duplicate_groups_page(
+            _get_target_view(ctx),
+            page=max(ctx.params.get("page", 1) - 1, 0),
+            page_size=ctx.params.get("page_size", 100),
+            sort_by=ctx.params.get("sort_by", "size"),
+        )
+        ctx.ops.set_view(view=view)
 
 
 class RemoveAllApproximateDuplicates(foo.Operator):
@@ -337,12 +1366,17 @@ class RemoveAllApproximateDuplicates(foo.Operator):
         _config.icon = "/assets/delete.svg"
         return _config
 
+    def resolve_delegation(self, ctx):
+        return ctx.params.get("delegate", False)
+
     def resolve_input(self, ctx):
         inputs = types.Object()
         form_view = types.View(
             label="Remove all approximate duplicates",
             description="Remove all approximate duplicates from the dataset",
         )
+        _target_inputs(ctx, inputs)
+        _deletion_inputs(ctx, inputs)
         return types.Property(inputs, view=form_view)
 
     def execute(self, ctx):
@@ -350,7 +1384,11 @@ class RemoveAllApproximateDuplicates(foo.Operator):
             # pylint: disable=no-name-in-module,import-error
             from approx_dups import remove_all_approximate_duplicates
 
-        remove_all_approximate_duplicates(ctx.dataset)
+        remove_all_approximate_duplicates(
+            _get_target_view(ctx),
+            batch_size=ctx.params.get("delete_batch_size", None),
+            progress=_deletion_progress(ctx),
+        )
         ctx.ops.reload_dataset()
 
 
@@ -366,12 +1404,18 @@ class DeduplicateApproximateDuplicates(foo.Operator):
         _config.icon = "/assets/representative.svg"
         return _config
 
+    def resolve_delegation(self, ctx):
+        return ctx.params.get("delegate", False)
+
     def resolve_input(self, ctx):
         inputs = types.Object()
         form_view = types.View(
             label="Deduplicate approximate duplicates",
             description="Deduplicate approximate duplicates in the dataset",
         )
+        _target_inputs(ctx, inputs)
+        _keep_policy_input(ctx, inputs, "filepath")
+        _deletion_inputs(ctx, inputs)
         return types.Property(inputs, view=form_view)
 
     def execute(self, ctx):
@@ -379,7 +1423,13 @@ class DeduplicateApproximateDuplicates(foo.Operator):
             # pylint: disable=no-name-in-module,import-error
             from approx_dups import deduplicate_approximate_duplicates
 
-        deduplicate_approximate_duplicates(ctx.dataset)
+        keep = ctx.params.get("keep", "filepath")
+        deduplicate_approximate_duplicates(
+            _get_target_view(ctx),
+            keep=keep,
+            batch_size=ctx.params.get("delete_batch_size", None),
+            progress=_deletion_progress(ctx),
+        )
         ctx.ops.reload_dataset()
 
 
@@ -388,6 +1438,9 @@ def register(plugin):
     plugin.register(DisplayExactDuplicates)
     plugin.register(RemoveAllExactDuplicates)
     plugin.register(DeduplicateExactDuplicates)
+    plugin.register(PruneFilehashCache)
+    plugin.register(BuildReferenceHashIndex)
+    plugin.register(CheckReferenceHashIndex)
     plugin.register(FindApproximateDuplicates)
     plugin.register(DisplayApproximateDuplicates)
     plugin.register(RemoveAllApproximateDuplicates)
@@ -1,5 +1,59 @@
+import hashlib
+import json
+import numbers
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
 import fiftyone as fo
-from fiftyone import ViewField as F
+
+from dedup_metrics import StageMetrics
+from dedup_utils import (
+    DEFAULT_BATCH_SIZE,
+    delete_samples,
+    is_whole_dataset,
+    iter_batches,
+    load_scoped_view,
+    replace_field_values,
+    select_duplicates,
+)
+from duplicate_edges import (
+    EMBEDDING_METRICS,
+    DuplicateEdges,
+    get_edges_path,
+    get_nearest_neighbor_distances,
+    iter_embedding_pairs,
+)
+from embedding_store import EmbeddingStore, build_embedding_store
+from hamming_index import HammingIndex, HammingIndexStore
+from hash_cache import get_default_cache_path
+from perceptual_hashes import compute_perceptual_hashes, to_unsigned_array
+from group_index import (
+    GROUP_INDEX_INFO_KEY,
+    build_group_index,
+    delete_group_index,
+    load_group_index,
+)
+from sharding import (
+    get_num_shards,
+    map_shards,
+    partition_ids,
+    partition_pair_rows,
+)
+from union_find import (
+    UnionFind,
+    get_component_ids,
+    get_component_max_distances,
+)
+
+GROUP_FIELD = "approx_dup_group_id"
+GROUP_INDEX_NAME = "approx"
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_PHASH_THRESHOLD = 6
+DEFAULT_NEIGHBORS_BATCH_SIZE = 1000
+DEFAULT_FRACTION_SEARCH_THRESHOLD = 0.1
 
 
 def get_filepath(sample):
@@ -8,97 +62,988 @@ def get_filepath(sample):
     )
 
 
-def gen_approx_duplicate_groups_view(dataset, index):
-    """
-    This function is used to generate the approximate duplicate groups view.
-    """
+def _get_groups(ids, union_find):
+    group_ids = get_component_ids(ids, union_find)
+    max_dists = get_component_max_distances(ids, union_find)
+    return group_ids, max_dists
 
-    dup_ids = index.duplicates_view().values("id")
-    view = dataset.select(dup_ids)
 
-    for rep_id, dups in index.neighbors_map.items():
-        ids = [rep_id] + [d[0] for d in dups]
-        subview = view.select(ids)
-        for sample in subview:
-            sample["approx_dup_group_id"] = rep_id
-            sample.save()
+def _get_group_settings(field):
+    ## the field's info also records the run key of the group index
+    info = dict(field.info or {})
+    info.pop(GROUP_INDEX_INFO_KEY, None)
+    return info
 
-    approx_dup_groups_view = view.group_by("approx_dup_group_id")
-    dataset.save_view(
-        "approx_dup_groups_view", approx_dup_groups_view, overwrite=True
-    )
 
+def _set_group_field_info(dataset, info):
+    ## records how the groups were found, so that they are only updated in
+    ## place with the same settings
+    field = dataset.get_field(GROUP_FIELD)
+    if _get_group_settings(field) != info:
+        field.info = info
+        field.save()
 
-def find_approximate_duplicates(
-    sample_collection, brain_key, threshold=None, fraction=None
+
+def get_approx_duplicates_info(sample_collection):
+    """
+    Returns a dict describing the backend and settings with which the
+    current approximate duplicate groups of the collection's dataset were
+    found, or None if they are unknown.
+    """
+    field = sample_collection._dataset.get_field(GROUP_FIELD)
+    if field is None:
+        return None
+
+    return _get_group_settings(field) or None
+
+
+def _save_approx_duplicate_views(
+    sample_collection, group_ids, metrics, info, max_dists=None
 ):
     dataset = sample_collection._dataset
 
-    index = dataset.load_brain_results(brain_key)
-    if threshold is not None:
-        index.find_duplicates(thresh=threshold)
-    else:
-        index.find_duplicates(fraction=fraction)
+    ### save the approximate duplicate groups and full duplicates views
+    with metrics.stage("labeling_and_saving_views") as record:
+        replace_field_values(
+            sample_collection, GROUP_FIELD, group_ids, fo.StringField
+        )
+        _set_group_field_info(dataset, info)
+        _save_approx_duplicate_query_views(sample_collection)
 
-    ### save the full duplicates view
-    approx_dup_view = index.duplicates_view()
-    dataset.save_view("approx_dup_view", approx_dup_view, overwrite=True)
-    approx_dup_view = dataset.load_saved_view("approx_dup_view")
+        if max_dists is not None:
+            max_dists = [max_dists[_id] for _id in group_ids.keys()]
 
-    ### save the approximate duplicate groups view
-    gen_approx_duplicate_groups_view(dataset, index)
+        build_group_index(
+            dataset,
+            GROUP_INDEX_NAME,
+            GROUP_FIELD,
+            group_ids.keys(),
+            group_ids.values(),
+            dists=max_dists,
+        )
+        record["num_items"] = len(group_ids)
 
     ### compute the number of images with duplicates
-    num_images_with_approx_dups = len(approx_dup_view)
-    num_approx_dup_groups = len(index.neighbors_map)
+    num_images_with_approx_dups = len(group_ids)
+    num_approx_dup_groups = len(set(group_ids.values()))
     num_dups = num_images_with_approx_dups - num_approx_dup_groups
 
     response = {
         "num_images_with_approx_dups": num_images_with_approx_dups,
         "num_dups": num_dups,
+        "stages": metrics.to_list(),
     }
 
     return response
 
 
+def find_approximate_duplicates(
+    sample_collection,
+    brain_key,
+    threshold=None,
+    fraction=None,
+    max_diameter=None,
+    metrics=None,
+):
+    """
+    Finds approximate duplicates from the embeddings of the similarity index
+    with the given ``brain_key``.
+
+    All pairs of samples within ``threshold`` of each other are found, and
+    groups are the connected components of these pairs. If ``fraction`` is
+    provided instead, the threshold is the smallest at which at least this
+    fraction of the samples are duplicates, as reported by
+    :func:`sweep_approximate_duplicates`. If ``max_diameter`` is provided,
+    components are only merged while a bound of the distance between the
+    members of each group is within ``max_diameter``, as described in
+    :class:`union_find.UnionFind`. The bound is only guaranteed for metrics
+    that satisfy the triangle inequality or for cosine distances, not for
+    dot products.
+
+    The pairs are found from the index's embeddings for the "cosine" and
+    "euclidean" metrics, and with the backend's own neighbor queries for
+    other metrics. For a ``fraction``, the pairs are only searched up to a
+    bound given by the distance of each sample to its nearest neighbor.
+
+    The pairs are cached, so that running again or sweeping thresholds up to
+    the largest threshold that was searched reuses them.
+    """
+    if metrics is None:
+        metrics = StageMetrics()
+
+    with metrics.stage("loading_index"):
+        index = _load_similarity_index(sample_collection, brain_key)
+
+    with metrics.stage("finding_duplicates") as record:
+        if threshold is not None:
+            edges = _get_similarity_edges(
+                sample_collection, brain_key, threshold, index=index
+            )
+        else:
+            edges, threshold = _get_fraction_edges(
+                sample_collection, brain_key, fraction, index
+            )
+
+        record["num_items"] = len(edges)
+
+    with metrics.stage("grouping") as record:
+        union_find = edges.union_find(
+            threshold,
+            max_diameter=max_diameter,
+            metric=index.config.metric,
+        )
+        group_ids, max_dists = _get_groups(edges.ids, union_find)
+        record["num_items"] = len(group_ids)
+
+    info = {
+        "backend": "similarity",
+        "brain_key": brain_key,
+        "threshold": threshold,
+    }
+    return _save_approx_duplicate_views(
+        sample_collection, group_ids, metrics, info, max_dists=max_dists
+    )
+
+
+def _load_similarity_index(sample_collection, brain_key):
+    index = sample_collection._dataset.load_brain_results(brain_key)
+    if not is_whole_dataset(sample_collection):
+        ## restricts the neighbor search to the samples in the collection
+        index.use_view(sample_collection)
+
+    return index
+
+
+def _similarity_edges_name(brain_key):
+    return "similarity-%s.npz" % brain_key
+
+
+def _perceptual_edges_name(method):
+    return "%s.npz" % method
+
+
+def _get_similarity_edges_key(dataset, brain_key):
+    ## pairs are only reused for the brain run from which they were computed,
+    ## which is identified by its timestamp and config
+    info = dataset.get_brain_info(brain_key)
+    run = {"timestamp": str(info.timestamp), "config": info.config.serialize()}
+    return hashlib.md5(
+        json.dumps(run, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def _get_perceptual_edges_key(hashes):
+    ## hashes that were recomputed invalidate the pairs even if the IDs match
+    return hashlib.md5(to_unsigned_array(hashes).tobytes()).hexdigest()
+
+
+def _uses_embedding_pairs(index):
+    ## other metrics, such as the dot products of vector database backends,
+    ## are searched with the backend's own neighbor queries
+    return index.config.metric in EMBEDDING_METRICS
+
+
+def _get_index_embeddings(index):
+    embeddings, ids, _ = index.get_embeddings(
+        sample_ids=index.current_sample_ids
+    )
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if index.config.method == "sklearn":
+        ## the sklearn backend measures distances between centered embeddings
+        embeddings = embeddings - embeddings.mean(axis=0, keepdims=True)
+
+    return embeddings, ids
+
+
+def _iter_backend_pairs(index, ids, max_threshold, batch_size=None):
+    if batch_size is None:
+        batch_size = DEFAULT_NEIGHBORS_BATCH_SIZE
+
+    inds = {_id: i for i, _id in enumerate(ids)}
+    for start in range(0, len(ids), batch_size):
+        query_ids = list(ids[start : start + batch_size])
+        neighbor_ids, _, dists = index._radius_neighbors(
+            query=query_ids, thresh=max_threshold, return_dists=True
+        )
+
+        inds1, inds2, pair_dists = [], [], []
+        for i, _ids, _dists in zip(
+            range(start, start + len(query_ids)), neighbor_ids, dists
+        ):
+            for _id, dist in zip(_ids, _dists):
+                ## each pair is returned from both of its samples
+                j = inds.get(_id, -1)
+                if j > i:
+                    inds1.append(i)
+                    inds2.append(j)
+                    pair_dists.append(dist)
+
+        yield np.array(inds1), np.array(inds2), np.array(pair_dists)
+
+
+def _get_similarity_edges(
+    sample_collection, brain_key, max_threshold, index=None
+):
+    dataset = sample_collection._dataset
+    if index is None:
+        index = _load_similarity_index(sample_collection, brain_key)
+
+    ids = list(index.current_sample_ids)
+    path = get_edges_path(dataset, _similarity_edges_name(brain_key))
+    key = _get_similarity_edges_key(dataset, brain_key)
+    edges = DuplicateEdges.load_if_valid(path, ids, max_threshold, key=key)
+    if edges is None:
+        if _uses_embedding_pairs(index):
+            embeddings, ids = _get_index_embeddings(index)
+            pairs = iter_embedding_pairs(
+                embeddings, max_threshold, metric=index.config.metric
+            )
+        else:
+            pairs = _iter_backend_pairs(index, ids, max_threshold)
+
+        edges = DuplicateEdges.from_pairs(ids, pairs, max_threshold, key=key)
+        edges.save(path)
+
+    return edges
+
+
+def _get_nearest_neighbor_distances(index):
+    if _uses_embedding_pairs(index):
+        embeddings, _ = _get_index_embeddings(index)
+        return get_nearest_neighbor_distances(
+            embeddings, metric=index.config.metric
+        )
+
+    ids = list(index.current_sample_ids)
+    nn_dists = np.full(len(ids), np.inf)
+    for start in range(0, len(ids), DEFAULT_NEIGHBORS_BATCH_SIZE):
+        query_ids = ids[start : start + DEFAULT_NEIGHBORS_BATCH_SIZE]
+        _, _, dists = index._kneighbors(
+            query=query_ids, k=2, return_dists=True
+        )
+
+        ## the nearest result of each query is the query itself
+        for i, _dists in enumerate(dists, start):
+            if len(_dists) > 1:
+                nn_dists[i] = _dists[1]
+
+    return nn_dists
+
+
+def _get_fraction_search_threshold(nn_dists, num_dups):
+    ## every group within a threshold has at least two members whose nearest
+    ## neighbors are within it, so ``num_dups`` duplicates are reached once
+    ## twice as many samples have a neighbor within the threshold
+    nn_dists = np.sort(nn_dists[np.isfinite(nn_dists)])
+    if len(nn_dists) == 0:
+        return DEFAULT_FRACTION_SEARCH_THRESHOLD
+
+    return nn_dists[min(2 * num_dups, len(nn_dists)) - 1]
+
+
+def _get_fraction_edges(sample_collection, brain_key, fraction, index):
+    num_samples = len(index.current_sample_ids)
+    num_pairs = num_samples * (num_samples - 1) // 2
+    num_keep = int(round(min(max(0, 1.0 - fraction), 1) * num_samples))
+    num_dups = num_samples - num_keep
+    if num_dups <= 0:
+        edges = _get_similarity_edges(
+            sample_collection, brain_key, 0, index=index
+        )
+        return edges, 0
+
+    ## the pairs are only searched up to the bound given by the nearest
+    ## neighbor distances. When more than half of the samples must be
+    ## duplicates, the bound may fall short, and the pairs are then searched
+    ## up to increasing thresholds
+    max_threshold = _get_fraction_search_threshold(
+        _get_nearest_neighbor_distances(index), num_dups
+    )
+    while True:
+        edges = _get_similarity_edges(
+            sample_collection, brain_key, max_threshold, index=index
+        )
+        threshold = edges.sweep(fractions=[fraction])[0]["threshold"]
+        if threshold is not None:
+            return edges, threshold
+
+        if len(edges) >= num_pairs:
+            return edges, max_threshold
+
+        max_threshold = max(
+            2 * max_threshold, DEFAULT_FRACTION_SEARCH_THRESHOLD
+        )
+
+
+def _get_perceptual_edges(sample_collection, method, max_threshold):
+    dataset = sample_collection._dataset
+    ids, hashes = sample_collection.exists(method).values(["id", method])
+
+    path = get_edges_path(dataset, _perceptual_edges_name(method))
+    key = _get_perceptual_edges_key(hashes)
+    edges = DuplicateEdges.load_if_valid(path, ids, max_threshold, key=key)
+    if edges is None:
+        index = HammingIndex(to_unsigned_array(hashes), max_threshold)
+        edges = DuplicateEdges.from_pairs(
+            ids, index.iter_pairs(), max_threshold, key=key
+        )
+        edges.save(path)
+
+    return edges
+
+
+def _get_max_threshold(thresholds, max_threshold):
+    if max_threshold is None:
+        if not thresholds:
+            raise ValueError(
+                "A maximum threshold is required when sweeping fractions"
+            )
+
+        max_threshold = max(thresholds)
+
+    return max(list(thresholds or []) + [max_threshold])
+
+
+def _to_hamming_distance(value):
+    if value is None or isinstance(value, numbers.Integral):
+        return value
+
+    if not float(value).is_integer():
+        raise ValueError(
+            "Hamming distances must be integers, but found %s" % value
+        )
+
+    return int(value)
+
+
+def sweep_approximate_duplicates(
+    sample_collection,
+    brain_key,
+    thresholds=None,
+    fractions=None,
+    max_threshold=None,
+):
+    """
+    Reports the number of duplicates and groups at each of the given distance
+    thresholds, and the threshold that achieves each of the given fractions of
+    duplicates, without modifying the dataset.
+
+    The neighbor pairs up to ``max_threshold`` are computed once and cached, so that sweeping again or running
+    :func:`find_approximate_duplicates` with a threshold up to
+    ``max_threshold`` reuses them.
+    """
+    max_threshold = _get_max_threshold(thresholds, max_threshold)
+    edges = _get_similarity_edges(sample_collection, brain_key, max_threshold)
+    return {
+        "max_threshold": max_threshold,
+        "sweep": edges.sweep(thresholds=thresholds, fractions=fractions),
+    }
+
+
+def sweep_perceptual_duplicates(
+    sample_collection,
+    method="phash",
+    thresholds=None,
+    fractions=None,
+    max_threshold=None,
+    num_workers=None,
+    batch_size=None,
+    use_processes=False,
+):
+    """
+    Reports the number of duplicates and groups at each of the given Hamming
+    distance thresholds, and the threshold that achieves each of the given
+    fractions of duplicates, without modifying the duplicate groups.
+
+    The hash pairs up to ``max_threshold`` are computed once and cached, so
+    that sweeping again or running :func:`find_perceptual_duplicates` with a
+    threshold up to ``max_threshold`` reuses them.
+
+    Hamming distances are integers, so non-integer thresholds raise a
+    ``ValueError``.
+    """
+    if thresholds is not None:
+        thresholds = [_to_hamming_distance(t) for t in thresholds]
+
+    max_threshold = _get_max_threshold(
+        thresholds, _to_hamming_distance(max_threshold)
+    )
+    compute_perceptual_hashes(
+        sample_collection,
+        method=method,
+        num_workers=num_workers,
+        batch_size=batch_size,
+        use_processes=use_processes,
+    )
+    edges = _get_perceptual_edges(sample_collection, method, max_threshold)
+    return {
+        "max_threshold": max_threshold,
+        "sweep": edges.sweep(thresholds=thresholds, fractions=fractions),
+    }
+
+
+def find_perceptual_duplicates(
+    sample_collection,
+    method="phash",
+    threshold=DEFAULT_PHASH_THRESHOLD,
+    num_workers=None,
+    batch_size=None,
+    use_processes=False,
+    max_diameter=None,
+    sharded=False,
+    num_shards=None,
+    prefetch=False,
+    max_in_flight=None,
+    metrics=None,
+):
+    """
+    Finds approximate duplicates by computing a perceptual hash of each image
+    and grouping images whose hashes are within ``threshold`` bits of each
+    other, without requiring a similarity index.
+
+    Groups are the connected components of these pairs. If ``max_diameter``
+    is provided, components are only merged while the hashes in each group
+    are guaranteed to be within ``max_diameter`` bits of each other.
+
+    If ``sharded`` is True, hashing and the neighbor search are performed in
+    shards of contiguous ID ranges by worker processes, which share a single
+    memory-mapped hash index, and the pairs found by each shard are merged
+    into a single union-find.
+    """
+    threshold = _to_hamming_distance(threshold)
+
+    if metrics is None:
+        metrics = StageMetrics()
+
+    dataset = sample_collection._dataset
+
+    with metrics.stage("hashing") as record:
+        record["num_items"] = compute_perceptual_hashes(
+            sample_collection,
+            method=method,
+            num_workers=num_workers,
+            batch_size=batch_size,
+            use_processes=use_processes,
+            sharded=sharded,
+            num_shards=num_shards,
+            prefetch=prefetch,
+            max_in_flight=max_in_flight,
+        )
+
+    with metrics.stage("pair_search") as record:
+        hashed_view = sample_collection.exists(method)
+        ids, hashes = hashed_view.values(["id", method])
+
+        ## reuse the pairs of a previous sweep when they cover the threshold
+        edges = DuplicateEdges.load_if_valid(
+            get_edges_path(dataset, _perceptual_edges_name(method)),
+            ids,
+            threshold,
+            key=_get_perceptual_edges_key(hashes),
+        )
+        if edges is not None:
+            union_find = edges.union_find(threshold, max_diameter=max_diameter)
+            record["num_items"] = len(edges)
+        elif sharded:
+            shard_pairs = _iter_perceptual_shard_pairs(
+                ids, hashes, threshold, num_shards, num_workers
+            )
+            union_find = _union_pairs(
+                len(ids), shard_pairs, max_diameter, record
+            )
+        else:
+            index = HammingIndex(to_unsigned_array(hashes), threshold)
+            union_find = _union_pairs(
+                len(ids), index.iter_pairs(), max_diameter, record
+            )
+
+    with metrics.stage("grouping") as record:
+        group_ids, max_dists = _get_groups(ids, union_find)
+        record["num_items"] = len(group_ids)
+
+    ## the persistent index of new-sample queries covers the hashes that
+    ## existed when it was last updated, which this run may have changed
+    delete_perceptual_index(dataset, method)
+
+    info = {
+        "backend": "perceptual_hash",
+        "method": method,
+        "threshold": threshold,
+    }
+    return _save_approx_duplicate_views(
+        sample_collection, group_ids, metrics, info, max_dists=max_dists
+    )
+
+
+_WORKER_INDEXES = {}
+
+
+def _get_worker_hamming_index(path):
+    ## each worker maps the saved index once and reuses it for every shard
+    ## that it searches. The arrays are memory-mapped, so all workers share
+    ## the same pages
+    if path not in _WORKER_INDEXES:
+        _WORKER_INDEXES.clear()
+        _WORKER_INDEXES[path] = HammingIndex.load(path, mmap=True)
+
+    return _WORKER_INDEXES[path]
+
+
+def _search_perceptual_shard(args):
+    path, inds = args
+    index = _get_worker_hamming_index(path)
+    return index.find_shard_pairs(inds)
+
+
+def _iter_perceptual_shard_pairs(
+    ids, hashes, max_distance, num_shards, num_workers
+):
+    num_shards = get_num_shards(num_shards, num_workers=num_workers)
+    shards = partition_ids(ids, num_shards)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "index")
+        HammingIndex(to_unsigned_array(hashes), max_distance).save(path)
+        tasks = [(path, inds) for inds in shards]
+        yield from map_shards(
+            _search_perceptual_shard, tasks, num_workers=num_workers
+        )
+
+
+def _search_embedding_shard(args):
+    path, start, end, max_distance, kwargs = args
+    store = EmbeddingStore(path)
+    return list(store.iter_pairs(max_distance, start=start, end=end, **kwargs))
+
+
+def _iter_embedding_shard_pairs(
+    store, max_distance, num_shards, num_workers, kwargs
+):
+    num_shards = get_num_shards(num_shards, num_workers=num_workers)
+    tasks = [
+        (store.path, start, end, max_distance, kwargs)
+        for start, end in partition_pair_rows(len(store), num_shards)
+    ]
+    for pairs in map_shards(
+        _search_embedding_shard, tasks, num_workers=num_workers
+    ):
+        yield from pairs
+
+
+def _union_pairs(num_nodes, pairs, max_diameter, record, metric=None):
+    union_find = UnionFind(num_nodes, max_diameter=max_diameter, metric=metric)
+    record["num_items"] = 0
+
+    if max_diameter is None:
+        ## components do not depend on the order in which pairs are merged,
+        ## so they are merged as they are found and are never all in memory
+        for inds1, inds2, dists in pairs:
+            union_find.union_pairs(inds1, inds2, dists=dists)
+            record["num_items"] += len(inds1)
+
+        return union_find
+
+    ## but the diameter constraint does, so pairs are merged in the
+    ## canonical ``(dist, i, j)`` order of :class:`DuplicateEdges`, which
+    ## does not depend on how they were found
+    pairs = list(pairs)
+    if not pairs:
+        return union_find
+
+    inds1, inds2, dists = (np.concatenate(a) for a in zip(*pairs))
+    order = np.lexsort((inds2, inds1, dists))
+    union_find.union_pairs(inds1[order], inds2[order], dists=dists[order])
+    record["num_items"] = len(order)
+
+    return union_find
+
+
+def find_embedding_duplicates(
+    sample_collection,
+    embeddings_field,
+    threshold,
+    metric="cosine",
+    dtype="float32",
+    center=False,
+    block_size=None,
+    batch_size=None,
+    max_diameter=None,
+    sharded=False,
+    num_shards=None,
+    num_workers=None,
+    metrics=None,
+):
+    """
+    Finds approximate duplicates directly from the embeddings stored in a
+    field of the collection, without requiring a similarity index.
+
+    The embeddings are written to a temporary memory-mapped file, optionally
+    quantized to ``float16`` or ``int8``, and compared one block of
+    ``block_size`` embeddings at a time, so memory usage does not grow with
+    the size of the collection.
+
+    If ``sharded`` is True, the rows of the file are split into contiguous ID
+    ranges with equal numbers of pairs, which are searched by worker
+    processes that each map the file.
+    """
+    if metrics is None:
+        metrics = StageMetrics()
+
+    with metrics.stage("loading_embeddings") as record:
+        ids, store = build_embedding_store(
+            sample_collection,
+            embeddings_field,
+            dtype=dtype,
+            batch_size=batch_size,
+        )
+        record["num_items"] = len(ids)
+
+    kwargs = dict(metric=metric, center=center, batch_size=block_size)
+
+    try:
+        with metrics.stage("pair_search") as record:
+            if sharded:
+                shard_pairs = _iter_embedding_shard_pairs(
+                    store, threshold, num_shards, num_workers, kwargs
+                )
+                union_find = _union_pairs(
+                    len(ids), shard_pairs, max_diameter, record, metric=metric
+                )
+            else:
+                union_find = _union_pairs(
+                    len(ids),
+                    store.iter_pairs(threshold, **kwargs),
+                    max_diameter,
+                    record,
+                    metric=metric,
+                )
+    finally:
+        store.delete()
+
+    with metrics.stage("grouping") as record:
+        group_ids, max_dists = _get_groups(ids, union_find)
+        record["num_items"] = len(group_ids)
+
+    info = {
+        "backend": "embeddings",
+        "embeddings_field": embeddings_field,
+        "metric": metric,
+        "threshold": threshold,
+    }
+    return _save_approx_duplicate_views(
+        sample_collection, group_ids, metrics, info, max_dists=max_dists
+    )
+
+
+def _save_approx_duplicate_query_views(sample_collection):
+    dataset = sample_collection._dataset
+    view = sample_collection.exists(GROUP_FIELD)
+    dataset.save_view(
+        "approx_dup_groups_view", view.group_by(GROUP_FIELD), overwrite=True
+    )
+    dataset.save_view(
+        "approx_dup_view", view.sort_by(GROUP_FIELD), overwrite=True
+    )
+
+
+def get_perceptual_index_path(dataset, method):
+    """
+    Returns the directory of the persistent index of the ``method``
+    perceptual hashes of the dataset that is used to add new samples to the
+    duplicate groups.
+    """
+    return os.path.join(
+        os.path.dirname(get_default_cache_path()),
+        "hamming",
+        str(dataset._doc.id),
+        method,
+    )
+
+
+def delete_perceptual_index(dataset, method):
+    """
+    Deletes the persistent index of the ``method`` perceptual hashes of the
+    dataset, if any.
+    """
+    shutil.rmtree(
+        get_perceptual_index_path(dataset, method), ignore_errors=True
+    )
+
+
+def _load_perceptual_index(dataset, method, threshold):
+    path = get_perceptual_index_path(dataset, method)
+    hashed_view = dataset.exists(method)
+
+    ## the index must contain exactly the hashed samples, which is checked
+    ## via their count so that it does not require reading them
+    if os.path.isfile(os.path.join(path, "metadata.json")):
+        store = HammingIndexStore(path)
+        if store.max_distance >= threshold and len(store) == len(hashed_view):
+            return store
+
+    ids, hashes = hashed_view.values(["id", method])
+    return HammingIndexStore.create(
+        path, threshold, ids=ids, hashes=to_unsigned_array(hashes)
+    )
+
+
+def _validate_perceptual_groups(sample_collection, method, threshold):
+    info = get_approx_duplicates_info(sample_collection)
+    expected = {
+        "backend": "perceptual_hash",
+        "method": method,
+        "threshold": threshold,
+    }
+    if sample_collection._dataset.has_sample_field(GROUP_FIELD) and (
+        info != expected
+    ):
+        raise ValueError(
+            "The existing approximate duplicate groups were found with %s, "
+            "so they cannot be updated with %s. Find all approximate "
+            "duplicates with these settings first" % (info, expected)
+        )
+
+    return expected
+
+
+def add_new_perceptual_duplicates(
+    sample_collection,
+    method="phash",
+    threshold=DEFAULT_PHASH_THRESHOLD,
+    num_workers=None,
+    batch_size=None,
+    use_processes=False,
+    prefetch=False,
+    max_in_flight=None,
+    metrics=None,
+):
+    """
+    Updates the perceptual duplicate groups of the collection in place after
+    new samples have been added to it.
+
+    Only samples without a perceptual hash are hashed. Each new sample joins
+    the group of its nearest grouped neighbor, or forms a new group with its
+    nearest neighbor if none of its neighbors is grouped yet.
+    Existing groups are never merged or relabeled, so only new samples and
+    their neighbors are written to the database.
+
+    The hashes of the existing samples are searched via a persistent
+    :class:`hamming_index.HammingIndexStore` to which the new hashes are
+    added, so the cost of an update scales with the number of new samples.
+    The existing groups must have been found with the same ``method`` and
+    ``threshold``.
+    """
+    threshold = _to_hamming_distance(threshold)
+
+    if metrics is None:
+        metrics = StageMetrics()
+
+    if batch_size is None:
+        batch_size = DEFAULT_BATCH_SIZE
+
+    dataset = sample_collection._dataset
+    info = _validate_perceptual_groups(sample_collection, method, threshold)
+
+    schema = sample_collection.get_field_schema()
+    if method in schema:
+        new_ids = sample_collection.exists(method, False).values("id")
+    else:
+        new_ids = sample_collection.values("id")
+
+    if GROUP_FIELD not in schema:
+        dataset.add_sample_field(GROUP_FIELD, fo.StringField)
+
+    _set_group_field_info(dataset, info)
+
+    with metrics.stage("loading_index") as record:
+        store = None
+        if method in schema:
+            store = _load_perceptual_index(dataset, method, threshold)
+            record["num_items"] = len(store)
+
+    with metrics.stage("hashing") as record:
+        record["num_items"] = compute_perceptual_hashes(
+            sample_collection,
+            method=method,
+            num_workers=num_workers,
+            batch_size=batch_size,
+            use_processes=use_processes,
+            prefetch=prefetch,
+            max_in_flight=max_in_flight,
+        )
+
+    with metrics.stage("pair_search") as record:
+        ## only the hashes of the new samples are loaded
+        new_hashes = []
+        for batch_ids in iter_batches(new_ids, batch_size):
+            new_hashes.extend(
+                dataset.select(batch_ids, ordered=True).values(method)
+            )
+
+        new_hashes = to_unsigned_array(new_hashes)
+
+        neighbors = {}
+        if store is not None and len(new_ids) > 0:
+            query_inds, old_ids, dists = store.query(new_hashes)
+            for i, j, d in zip(
+                query_inds.tolist(), old_ids.tolist(), dists.tolist()
+            ):
+                neighbors.setdefault(i, []).append((d, j))
+
+        if len(new_ids) > 1:
+            index = HammingIndex(new_hashes, threshold)
+            inds1, inds2, dists = index.find_pairs()
+            for i, j, d in zip(inds2.tolist(), inds1.tolist(), dists.tolist()):
+                neighbors.setdefault(i, []).append((d, new_ids[j]))
+
+        record["num_items"] = sum(len(n) for n in neighbors.values())
+
+    with metrics.stage("grouping") as record:
+        ## only the groups of the existing neighbors are loaded, and
+        ## neighbors outside of the collection are ignored
+        new_id_set = set(new_ids)
+        old_ids = sorted(
+            set(j for n in neighbors.values() for _, j in n) - new_id_set
+        )
+        group_ids = dict.fromkeys(new_ids)
+        for batch_ids in iter_batches(old_ids, batch_size):
+            view = sample_collection.select(batch_ids)
+            group_ids.update(zip(*view.values(["id", GROUP_FIELD])))
+
+        updates = {}
+        for i in sorted(neighbors.keys()):
+            candidates = [(d, j) for d, j in neighbors[i] if j in group_ids]
+            if not candidates:
+                continue
+
+            d, j = min(
+                candidates, key=lambda dj: (group_ids[dj[1]] is None, dj)
+            )
+            if group_ids[j] is None:
+                group_ids[j] = min(new_ids[i], j)
+                updates[j] = group_ids[j]
+
+            group_ids[new_ids[i]] = group_ids[j]
+            updates[new_ids[i]] = group_ids[j]
+
+        record["num_items"] = len(updates)
+
+    with metrics.stage("labeling_and_saving_views"):
+        for batch in iter_batches(updates.items(), batch_size):
+            sample_collection.set_values(
+                GROUP_FIELD, dict(batch), key_field="id"
+            )
+
+        _save_approx_duplicate_query_views(sample_collection)
+        delete_group_index(dataset, GROUP_INDEX_NAME, field=GROUP_FIELD)
+
+        if store is None:
+            _load_perceptual_index(dataset, method, threshold)
+        else:
+            store.add(new_ids, new_hashes)
+
+    return {
+        "num_new_samples": len(new_ids),
+        "num_new_dups": sum(1 for _id in new_ids if _id in updates),
+        "stages": metrics.to_list(),
+    }
+
+
 def get_approximate_duplicate_groups(sample_collection):
+    return load_scoped_view(sample_collection, "approx_dup_groups_view")
+
+
+def get_approximate_duplicate_groups_page(
+    sample_collection, page=0, page_size=DEFAULT_PAGE_SIZE, sort_by="size"
+):
+    """
+    Returns a view containing the approximate duplicate groups on the given
+    zero-based page, ordered by ``sort_by``, along with the number of pages.
+
+    Groups are served from the group index written when the duplicates were
+    found, so the cost of a page does not depend on the number of groups.
+    When the collection is a view, only its members of the groups are shown,
+    and groups with fewer than two members in the view are omitted.
+    """
     dataset = sample_collection._dataset
-    approx_dup_view = dataset.load_saved_view("approx_dup_groups_view")
-    return approx_dup_view
+    index = load_group_index(
+        dataset.load_saved_view("approx_dup_view"),
+        GROUP_INDEX_NAME,
+        GROUP_FIELD,
+    )
+    if not is_whole_dataset(sample_collection):
+        view = load_scoped_view(sample_collection, "approx_dup_view")
+        index = index.restrict(view.values("id"))
+
+    _, ids = index.get_page(page, page_size, sort_by=sort_by)
+    view = dataset.select(ids, ordered=True).group_by(GROUP_FIELD)
+    return view, index.num_pages(page_size)
+
 
+def remove_all_approximate_duplicates(
+    sample_collection, batch_size=None, progress=None
+):
+    """
+    Deletes every sample of the collection that has an approximate duplicate.
 
-def remove_all_approximate_duplicates(sample_collection):
+    Only samples in the collection are deleted. The saved views are kept when
+    the collection is a view, so that the duplicates outside of it can still
+    be removed later.
+    """
     dataset = sample_collection._dataset
 
     if "approx_dup_view" not in dataset.list_saved_views():
         raise ValueError("Approximate duplicates have not been computed yet.")
 
-    approx_dup_view = dataset.load_saved_view("approx_dup_view")
-    dataset.delete_samples(approx_dup_view.values("id"))
+    approx_dup_view = load_scoped_view(sample_collection, "approx_dup_view")
+    delete_samples(
+        dataset,
+        approx_dup_view.values("id"),
+        batch_size=batch_size,
+        progress=progress,
+    )
+
+    _delete_approx_duplicate_views(sample_collection)
 
-    ## remove the saved views
-    dataset.delete_saved_view("approx_dup_view")
-    dataset.delete_saved_view("approx_dup_groups_view")
 
+def deduplicate_approximate_duplicates(
+    sample_collection, keep="filepath", batch_size=None, progress=None
+):
+    """
+    Deletes all but one sample of each group of approximate duplicates in the
+    collection, chosen according to the ``keep`` policy.
 
-def deduplicate_approximate_duplicates(sample_collection):
+    Groups are restricted to the samples in the collection, so a sample is
+    kept from each group even if it has duplicates outside of it.
+    """
     dataset = sample_collection._dataset
 
     if "approx_dup_view" not in dataset.list_saved_views():
         raise ValueError("Approximate duplicates have not been computed yet.")
 
-    approx_dup_view = dataset.load_saved_view("approx_dup_view")
+    approx_dup_view = load_scoped_view(sample_collection, "approx_dup_view")
+
+    keep_ids, remove_ids = select_duplicates(
+        approx_dup_view, GROUP_FIELD, keep=keep
+    )
+    delete_samples(
+        dataset, remove_ids, batch_size=batch_size, progress=progress
+    )
 
-    remove_sample_ids = []
-    for group_id in approx_dup_view.distinct("approx_dup_group_id"):
-        group_view = approx_dup_view.match(
-            F("approx_dup_group_id") == group_id
+    ## the kept samples no longer have duplicates
+    for batch_ids in iter_batches(keep_ids, DEFAULT_BATCH_SIZE):
+        dataset.set_values(
+            GROUP_FIELD, {_id: None for _id in batch_ids}, key_field="id"
         )
-        group_view = group_view.sort_by("filepath")
-        remove_sample_ids.extend(group_view.values("id")[1:])
 
-    dataset.delete_samples(remove_sample_ids)
+    _delete_approx_duplicate_views(sample_collection)
+
+
+def _delete_approx_duplicate_views(sample_collection):
+    dataset = sample_collection._dataset
 
     ## remove the saved views
-    dataset.delete_saved_view("approx_dup_view")
-    dataset.delete_saved_view("approx_dup_groups_view")
+    if is_whole_dataset(sample_collection):
+        dataset.delete_saved_view("approx_dup_view")
+        dataset.delete_saved_view("approx_dup_groups_view")
+
+    delete_group_index(dataset, GROUP_INDEX_NAME, field=GROUP_FIELD)
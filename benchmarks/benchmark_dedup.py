@@ -0,0 +1,490 @@
+"""
+Benchmarks the exact and approximate deduplication stages of the plugin on
+synthetic image datasets.
+
+Usage::
+
+    # run the benchmarks and write a JSON report
+    python benchmarks/benchmark_dedup.py run \\
+        --num-samples 10000 --dup-rate 0.2 --report report.json
+
+    # compare two reports, e.g. before and after a plugin upgrade
+    python benchmarks/benchmark_dedup.py compare old.json new.json
+
+Each stage runs in a fresh process, so its peak RSS is not inflated by the
+dataset generation or by the stages that ran before it.
+
+| Copyright 2017-2023, Voxel51, Inc.
+| `voxel51.com <https://voxel51.com/>`_
+|
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+import numpy as np
+from PIL import Image
+import psutil
+from pymongo import monitoring
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class _CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+## must be registered before FiftyOne connects to the database
+_COMMAND_COUNTER = _CommandCounter()
+monitoring.register(_COMMAND_COUNTER)
+
+import fiftyone as fo  # pylint: disable=wrong-import-position
+import fiftyone.brain as fob  # pylint: disable=wrong-import-position
+
+sys.path.insert(0, PLUGIN_DIR)
+
+# pylint: disable=import-error,wrong-import-position
+from approx_dups import (
+    deduplicate_approximate_duplicates,
+    find_approximate_duplicates,
+    find_perceptual_duplicates,
+)
+from exact_dups import deduplicate_exact_duplicates, find_exact_duplicates
+
+_STAGE_FUNCTIONS = {
+    fcn.__name__: fcn
+    for fcn in (
+        deduplicate_approximate_duplicates,
+        deduplicate_exact_duplicates,
+        find_approximate_duplicates,
+        find_exact_duplicates,
+        find_perceptual_duplicates,
+    )
+}
+
+
+def _sample_group_sizes(num_groups, dist, rng):
+    name, _, param = dist.partition(":")
+    if name == "fixed":
+        return np.full(num_groups, int(param or 2))
+
+    if name == "uniform":
+        return rng.integers(2, int(param or 5) + 1, size=num_groups)
+
+    if name == "geometric":
+        return 1 + rng.geometric(float(param or 0.5), size=num_groups)
+
+    raise ValueError("Unsupported group size distribution '%s'" % dist)
+
+
+def _make_image(rng, image_size):
+    ## blocky noise compresses like a natural image and hashes distinctly
+    width, height = image_size
+    blocks = rng.integers(0, 256, size=(height // 8, width // 8, 3))
+    pixels = np.kron(blocks, np.ones((8, 8, 1))).astype(np.uint8)
+    return Image.fromarray(pixels)
+
+
+def generate_dataset(
+    images_dir,
+    num_samples,
+    dup_rate,
+    group_size_dist="geometric:0.5",
+    exact_fraction=0.5,
+    image_size=(256, 256),
+    quality=90,
+    seed=51,
+):
+    """
+    Writes a synthetic image dataset in which roughly ``dup_rate`` of the
+    samples are duplicates of another sample, and returns a FiftyOne dataset
+    containing them along with synthetic embeddings.
+
+    Duplicates are exact file copies with probability ``exact_fraction``, and
+    otherwise slightly brightened re-encodings of their original.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(images_dir, exist_ok=True)
+
+    num_dups = int(num_samples * dup_rate)
+    group_sizes = []
+    while sum(s - 1 for s in group_sizes) < num_dups:
+        group_sizes.extend(_sample_group_sizes(64, group_size_dist, rng))
+
+    filepaths, embeddings = [], []
+    num_written = num_dups_written = 0
+    for size in group_sizes:
+        if num_written >= num_samples:
+            break
+
+        image = _make_image(rng, image_size)
+        embedding = rng.normal(size=64)
+        base_path = os.path.join(images_dir, "%08d.jpg" % num_written)
+        image.save(base_path, quality=quality)
+        filepaths.append(base_path)
+        embeddings.append(embedding)
+        num_written += 1
+
+        for _ in range(size - 1):
+            if num_dups_written >= num_dups or num_written >= num_samples:
+                break
+
+            filepath = os.path.join(images_dir, "%08d.jpg" % num_written)
+            if rng.random() < exact_fraction:
+                shutil.copyfile(base_path, filepath)
+            else:
+                pixels = np.asarray(image, dtype=np.int16) + 8
+                Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(
+                    filepath, quality=quality - 10
+                )
+
+            filepaths.append(filepath)
+            embeddings.append(embedding + rng.normal(scale=0.01, size=64))
+            num_written += 1
+            num_dups_written += 1
+
+    while num_written < num_samples:
+        filepath = os.path.join(images_dir, "%08d.jpg" % num_written)
+        _make_image(rng, image_size).save(filepath, quality=quality)
+        filepaths.append(filepath)
+        embeddings.append(rng.normal(size=64))
+        num_written += 1
+
+    dataset = fo.Dataset()
+    dataset.add_samples([fo.Sample(filepath=f) for f in filepaths])
+
+    return dataset, np.array(embeddings)
+
+
+def _get_bytes_read(process):
+    return process.io_counters().read_chars
+
+
+class _RSSSampler(threading.Thread):
+    def __init__(self, process, interval=0.01):
+        super().__init__(daemon=True)
+        self.process = process
+        self.interval = interval
+        self.peak_rss = process.memory_info().rss
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self._sample()
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        self._sample()
+        return self.peak_rss
+
+    def _sample(self):
+        self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+
+
+def measure(name, fcn, *args, **kwargs):
+    """
+    Runs ``fcn(*args, **kwargs)`` and returns a dict of measurements.
+
+    The peak RSS is sampled while the stage runs, since the peak reported by
+    ``getrusage()`` covers the whole life of the process, including its
+    parent on Linux.
+    """
+    process = psutil.Process()
+    baseline_rss = process.memory_info().rss
+    bytes_read = _get_bytes_read(process)
+    num_commands = _COMMAND_COUNTER.count
+
+    sampler = _RSSSampler(process)
+    sampler.start()
+    start = time.perf_counter()
+    try:
+        result = fcn(*args, **kwargs)
+    finally:
+        wall_time = time.perf_counter() - start
+        peak_rss = sampler.stop()
+
+    metrics = {
+        "stage": name,
+        "wall_time": wall_time,
+        "peak_rss_bytes": peak_rss,
+        "baseline_rss_bytes": baseline_rss,
+        "bytes_read": _get_bytes_read(process) - bytes_read,
+        "db_round_trips": _COMMAND_COUNTER.count - num_commands,
+    }
+    if isinstance(result, dict):
+        metrics["result"] = result
+
+    print(
+        "%-36s %9.3fs %12d bytes read %8d round trips"
+        % (
+            name,
+            wall_time,
+            metrics["bytes_read"],
+            metrics["db_round_trips"],
+        )
+    )
+
+    return metrics
+
+
+def _measure_stage(conn, name, dataset_name, fcn_name, args, kwargs):
+    try:
+        dataset = fo.load_dataset(dataset_name)
+        fcn = _STAGE_FUNCTIONS[fcn_name]
+        conn.send((measure(name, fcn, dataset, *args, **kwargs), None))
+    except Exception:
+        conn.send((None, traceback.format_exc()))
+    finally:
+        conn.close()
+
+
+def measure_stage(name, dataset, fcn, *args, **kwargs):
+    """
+    Runs ``fcn(dataset, *args, **kwargs)`` in a fresh process and returns a
+    dict of measurements.
+
+    The process is spawned rather than forked, so the memory retained by the
+    dataset generation and by earlier stages is not counted in its RSS.
+    """
+    context = multiprocessing.get_context("spawn")
+    parent_conn, child_conn = context.Pipe(duplex=False)
+    process = context.Process(
+        target=_measure_stage,
+        args=(child_conn, name, dataset.name, fcn.__name__, args, kwargs),
+    )
+    process.start()
+    child_conn.close()
+
+    try:
+        metrics, error = parent_conn.recv()
+    except EOFError:
+        metrics, error = None, "the process exited unexpectedly"
+    finally:
+        process.join()
+
+    if error is not None:
+        raise RuntimeError("Stage '%s' failed: %s" % (name, error))
+
+    return metrics
+
+
+def run_benchmarks(args):
+    images_dir = args.images_dir or tempfile.mkdtemp(prefix="dedup-bench-")
+
+    start = time.perf_counter()
+    dataset, embeddings = generate_dataset(
+        images_dir,
+        args.num_samples,
+        args.dup_rate,
+        group_size_dist=args.group_size_dist,
+        exact_fraction=args.exact_fraction,
+        image_size=(args.image_size, args.image_size),
+        quality=args.quality,
+        seed=args.seed,
+    )
+    generation_time = time.perf_counter() - start
+
+    ## the stages load the dataset by name in their own processes
+    dataset.persistent = True
+
+    stages = []
+    kwargs = dict(num_workers=args.num_workers)
+
+    try:
+        stages.append(
+            measure_stage(
+                "find_exact_duplicates",
+                find_exact_duplicates,
+                dataset,
+                **kwargs,
+            )
+        )
+        stages.append(
+            measure_stage(
+                "find_exact_duplicates[incremental]",
+                find_exact_duplicates,
+                dataset,
+                incremental=True,
+                **kwargs,
+            )
+        )
+        stages.append(
+            measure_stage(
+                "find_exact_duplicates[staged]",
+                find_exact_duplicates,
+                dataset,
+                staged=True,
+                **kwargs,
+            )
+        )
+        stages.append(
+            measure_stage(
+                "find_perceptual_duplicates",
+                find_perceptual_duplicates,
+                dataset,
+                threshold=args.hamming_threshold,
+                **kwargs,
+            )
+        )
+
+        fob.compute_similarity(
+            dataset,
+            embeddings=embeddings,
+            brain_key="benchmark_sim",
+            backend="sklearn",
+        )
+        stages.append(
+            measure_stage(
+                "find_approximate_duplicates",
+                find_approximate_duplicates,
+                dataset,
+                "benchmark_sim",
+                threshold=args.distance_threshold,
+            )
+        )
+
+        ## approximate dedup runs first since it does not depend on the
+        ## exact duplicates view, which remains valid afterwards
+        stages.append(
+            measure_stage(
+                "deduplicate_approximate_duplicates",
+                deduplicate_approximate_duplicates,
+                dataset,
+            )
+        )
+        stages.append(
+            measure_stage(
+                "deduplicate_exact_duplicates",
+                deduplicate_exact_duplicates,
+                dataset,
+            )
+        )
+    finally:
+        dataset.delete()
+        if args.images_dir is None:
+            shutil.rmtree(images_dir, ignore_errors=True)
+
+    return {
+        "config": vars(args),
+        "environment": {
+            "python": platform.python_version(),
+            "fiftyone": fo.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "generation_time": generation_time,
+        "stages": stages,
+    }
+
+
+def compare_reports(old_report, new_report):
+    old_stages = {s["stage"]: s for s in old_report["stages"]}
+    keys = ("wall_time", "peak_rss_bytes", "bytes_read", "db_round_trips")
+
+    print(
+        "%-36s %-16s %14s %14s %8s"
+        % ("stage", "metric", "old", "new", "ratio")
+    )
+    for stage in new_report["stages"]:
+        old = old_stages.get(stage["stage"], None)
+        if old is None:
+            continue
+
+        for key in keys:
+            ratio = stage[key] / old[key] if old[key] else float("nan")
+            print(
+                "%-36s %-16s %14.3f %14.3f %8.2f"
+                % (stage["stage"], key, old[key], stage[key], ratio)
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--num-samples", type=int, default=1000)
+    run_parser.add_argument(
+        "--dup-rate",
+        type=float,
+        default=0.2,
+        help="the fraction of samples that are duplicates of another sample",
+    )
+    run_parser.add_argument(
+        "--group-size-dist",
+        default="geometric:0.5",
+        help=(
+            "the distribution of duplicate group sizes: 'fixed:K', "
+            "'uniform:MAX' or 'geometric:P'"
+        ),
+    )
+    run_parser.add_argument(
+        "--exact-fraction",
+        type=float,
+        default=0.5,
+        help="the fraction of duplicates that are exact file copies",
+    )
+    run_parser.add_argument(
+        "--image-size",
+        type=int,
+        default=256,
+        help="the width and height of the images, which controls file sizes",
+    )
+    run_parser.add_argument("--quality", type=int, default=90)
+    run_parser.add_argument("--seed", type=int, default=51)
+    run_parser.add_argument("--num-workers", type=int, default=None)
+    run_parser.add_argument("--hamming-threshold", type=int, default=6)
+    run_parser.add_argument("--distance-threshold", type=float, default=0.5)
+    run_parser.add_argument(
+        "--images-dir",
+        default=None,
+        help="a directory in which to keep the generated images",
+    )
+    run_parser.add_argument("--report", default="dedup_benchmark.json")
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="compare two benchmark reports"
+    )
+    compare_parser.add_argument("old_report")
+    compare_parser.add_argument("new_report")
+
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        with open(args.old_report) as f:
+            old_report = json.load(f)
+
+        with open(args.new_report) as f:
+            new_report = json.load(f)
+
+        compare_reports(old_report, new_report)
+        return
+
+    report = run_benchmarks(args)
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=4)
+
+    print("Report written to '%s'" % args.report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+from contextlib import contextmanager
+import cProfile
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class StageMetrics(object):
+    """
+    Records the wall time, number of items and bytes read of each stage of a
+    deduplication run.
+
+    Args:
+        log (False): whether to log each stage's metrics as a JSON record when
+            it completes
+    """
+
+    def __init__(self, log=False):
+        self.log = log
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name, num_items=None, bytes_read=None):
+        """
+        Context manager that times the enclosed code as the given stage.
+
+        Yields the stage's record, whose ``num_items`` and ``bytes_read`` can
+        be set from within the block when they are not known upfront.
+        """
+        record = {
+            "stage": name,
+            "num_items": num_items,
+            "bytes_read": bytes_read,
+        }
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            wall_time = time.perf_counter() - start
+            record["wall_time"] = wall_time
+            if wall_time > 0:
+                if record["num_items"] is not None:
+                    record["items_per_sec"] = record["num_items"] / wall_time
+
+                if record["bytes_read"] is not None:
+                    record["bytes_per_sec"] = record["bytes_read"] / wall_time
+
+            self.stages.append(record)
+            if self.log:
+                logger.info(json.dumps(record))
+
+    def to_list(self):
+        """
+        Returns the recorded stages as a list of dicts.
+        """
+        return [dict(record) for record in self.stages]
+
+
+@contextmanager
+def profile(filepath=None):
+    """
+    Context manager that profiles the enclosed code with ``cProfile`` and
+    dumps the stats to ``filepath``, if one is provided.
+    """
+    if not filepath:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(filepath)
@@ -0,0 +1,235 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import contextlib
+import itertools
+import multiprocessing
+import os
+
+import fiftyone as fo
+import fiftyone.core.utils as fou
+
+DEFAULT_BATCH_SIZE = 10000
+
+
+def get_filepath(sample):
+    return (
+        sample.local_path if hasattr(sample, "local_path") else sample.filepath
+    )
+
+
+def get_ids_and_filepaths(sample_collection):
+    """
+    Returns the IDs and local filepaths of the samples in the collection.
+    """
+    ids = sample_collection.values("id")
+    if hasattr(sample_collection, "get_local_paths"):
+        filepaths = sample_collection.get_local_paths()
+    else:
+        filepaths = sample_collection.values("filepath")
+
+    return ids, filepaths
+
+
+def is_whole_dataset(sample_collection):
+    """
+    Returns whether the collection contains every sample of its dataset.
+    """
+    return isinstance(sample_collection, fo.Dataset) or not (
+        sample_collection._stages
+    )
+
+
+def load_scoped_view(sample_collection, name):
+    """
+    Loads the saved view with the given name from the collection's dataset,
+    restricted to the samples in the collection.
+
+    The saved view's stages are appended to the collection rather than
+    intersecting their sample IDs, so the restriction is performed by the
+    database.
+    """
+    view = sample_collection._dataset.load_saved_view(name)
+    if is_whole_dataset(sample_collection):
+        return view
+
+    for stage in view._stages:
+        sample_collection = sample_collection.add_stage(stage)
+
+    return sample_collection
+
+
+def iter_batches(iterable, batch_size):
+    """
+    Yields lists of at most ``batch_size`` items from the iterable.
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+
+        yield batch
+
+
+@contextlib.contextmanager
+def spawn_process_pool(num_workers):
+    """
+    Yields a process pool of ``num_workers`` workers.
+
+    Workers are spawned rather than forked, so that they do not inherit the
+    database connections and threads of the parent process. Functions that
+    are submitted to the pool must therefore be picklable by reference from
+    a module in this directory.
+    """
+    context = multiprocessing.get_context("spawn")
+
+    ## spawned workers import functions by name, so they need this
+    ## directory on their path
+    with fou.add_sys_path(os.path.dirname(os.path.abspath(__file__))):
+        with ProcessPoolExecutor(
+            max_workers=num_workers, mp_context=context
+        ) as executor:
+            yield executor
+
+
+def map_parallel(
+    fn, items, num_workers=None, use_processes=False, max_in_flight=None
+):
+    """
+    Applies ``fn`` to each item in a thread or process pool, yielding the
+    results in order.
+
+    At most ``max_in_flight`` tasks are pending at any time, so arbitrarily
+    long inputs can be streamed without reading everything at once. When
+    ``use_processes`` is True, ``fn`` must be picklable, see
+    :func:`spawn_process_pool`.
+    """
+    if use_processes:
+        num_workers = fou.recommend_process_pool_workers(num_workers)
+    else:
+        num_workers = fou.recommend_thread_pool_workers(num_workers)
+
+    if num_workers <= 1:
+        for item in items:
+            yield fn(item)
+
+        return
+
+    if max_in_flight is None:
+        max_in_flight = 4 * num_workers
+
+    if use_processes:
+        pool = spawn_process_pool(num_workers)
+    else:
+        pool = ThreadPoolExecutor(max_workers=num_workers)
+
+    with pool as executor:
+        pending = deque()
+        for item in items:
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+
+            pending.append(executor.submit(fn, item))
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def replace_field_values(
+    sample_collection, field_name, values, ftype, batch_size=None
+):
+    """
+    Sets ``field_name`` to the given ``{id: value}`` values in batches,
+    clearing the field on any other samples in the collection that have it
+    set from a previous run.
+    """
+    if batch_size is None:
+        batch_size = DEFAULT_BATCH_SIZE
+
+    values = dict(values)
+
+    if field_name in sample_collection.get_field_schema():
+        prev_ids = sample_collection.exists(field_name).values("id")
+        for _id in prev_ids:
+            values.setdefault(_id, None)
+    else:
+        sample_collection._dataset.add_sample_field(field_name, ftype)
+
+    for batch in iter_batches(values.items(), batch_size):
+        sample_collection.set_values(field_name, dict(batch), key_field="id")
+
+
+KEEP_POLICIES = {
+    "first": "The first sample in each group",
+    "filepath": "The sample with the lexicographically smallest filepath",
+    "largest_file": "The sample with the largest file",
+    "highest_resolution": "The sample with the most pixels",
+}
+
+
+def _get_keep_keys(sample_collection, keep):
+    if keep == "first":
+        return None
+
+    if keep == "filepath":
+        return sample_collection.values("filepath")
+
+    if keep not in KEEP_POLICIES:
+        raise ValueError(
+            "Unsupported keep policy '%s'. Supported values are %s"
+            % (keep, tuple(KEEP_POLICIES.keys()))
+        )
+
+    sample_collection.compute_metadata()
+
+    if keep == "largest_file":
+        sizes = sample_collection.values("metadata.size_bytes")
+        return [-(s or 0) for s in sizes]
+
+    widths, heights = sample_collection.values(
+        ["metadata.width", "metadata.height"]
+    )
+    return [-(w or 0) * (h or 0) for w, h in zip(widths, heights)]
+
+
+def select_duplicates(sample_collection, group_field, keep="first"):
+    """
+    Chooses one sample to keep from each group of samples that share a value
+    of ``group_field``, according to the given keep policy.
+
+    Returns a ``(keep_ids, remove_ids)`` tuple.
+    """
+    ids, group_ids = sample_collection.values(["id", group_field])
+    keys = _get_keep_keys(sample_collection, keep)
+
+    keepers = {}
+    for idx, group_id in enumerate(group_ids):
+        key = (keys[idx] if keys is not None else 0, idx)
+        if group_id not in keepers or key < keepers[group_id]:
+            keepers[group_id] = key
+
+    keep_inds = set(key[1] for key in keepers.values())
+    keep_ids = [ids[idx] for idx in sorted(keep_inds)]
+    remove_ids = [_id for idx, _id in enumerate(ids) if idx not in keep_inds]
+
+    return keep_ids, remove_ids
+
+
+def delete_samples(dataset, sample_ids, batch_size=None, progress=None):
+    """
+    Deletes the given samples from the dataset in batches.
+
+    Each batch is committed before the next one starts, so an interrupted
+    deletion can be resumed by recomputing the samples that remain. If
+    provided, ``progress(num_deleted, num_total)`` is called after each batch.
+    """
+    if batch_size is None:
+        batch_size = DEFAULT_BATCH_SIZE
+
+    num_total = len(sample_ids)
+    num_deleted = 0
+    for batch_ids in iter_batches(sample_ids, batch_size):
+        dataset.delete_samples(batch_ids)
+        num_deleted += len(batch_ids)
+        if progress is not None:
+            progress(num_deleted, num_total)
@@ -0,0 +1,382 @@
+import os
+
+import numpy as np
+
+from hash_cache import get_default_cache_path
+from union_find import UnionFind, get_component_ids
+
+DEFAULT_SWEEP_BATCH_SIZE = 65536
+DEFAULT_EMBEDDING_BLOCK_SIZE = 4096
+EMBEDDING_METRICS = ("cosine", "euclidean")
+
+
+def get_edge_cache_dir():
+    """
+    Returns the directory in which cached duplicate edges are stored, next to
+    the persistent file hash cache.
+    """
+    return os.path.join(os.path.dirname(get_default_cache_path()), "edges")
+
+
+def get_edges_path(dataset, name):
+    """
+    Returns the path of the cached edges with the given name for the dataset.
+    """
+    return os.path.join(get_edge_cache_dir(), str(dataset._doc.id), name)
+
+
+class DuplicateEdges(object):
+    """
+    All neighbor pairs of a collection within ``max_distance`` of each other,
+    stored as compact arrays sorted by distance.
+
+    Because the pairs are sorted, the duplicate groups for any threshold up to
+    ``max_distance`` can be computed from a prefix of the arrays without
+    querying the neighbors again. Pairs at the same distance are sorted by
+    their node indices, so that pairs are merged in the same order however
+    they were found.
+
+    Args:
+        ids: the IDs of the nodes
+        inds1: an array of the first node index of each pair
+        inds2: an array of the second node index of each pair
+        dists: an array of the distance of each pair
+        max_distance: the distance up to which the pairs are complete
+        key (None): an optional string identifying the data from which the
+            pairs were computed
+    """
+
+    def __init__(self, ids, inds1, inds2, dists, max_distance, key=None):
+        inds1, inds2 = np.asarray(inds1), np.asarray(inds2)
+        order = np.lexsort((inds2, inds1, dists))
+        ind_dtype = np.int32 if len(ids) < 2**31 else np.int64
+
+        self.ids = np.asarray(ids, dtype=str)
+        self.inds1 = inds1[order].astype(ind_dtype)
+        self.inds2 = inds2[order].astype(ind_dtype)
+        self.dists = np.asarray(dists)[order]
+        self.max_distance = max_distance
+        self.key = key
+
+    def __len__(self):
+        return len(self.dists)
+
+    @classmethod
+    def from_pairs(cls, ids, pairs, max_distance, key=None):
+        """
+        Creates an instance from an iterable of ``(inds1, inds2, dists)``
+        batches of pairs.
+        """
+        inds1, inds2, dists = [], [], []
+        for i, j, d in pairs:
+            keep = d <= max_distance
+            inds1.append(np.asarray(i)[keep])
+            inds2.append(np.asarray(j)[keep])
+            dists.append(np.asarray(d)[keep])
+
+        if not dists:
+            empty = np.zeros(0, dtype=np.int64)
+            return cls(ids, empty, empty, np.zeros(0), max_distance, key=key)
+
+        return cls(
+            ids,
+            np.concatenate(inds1),
+            np.concatenate(inds2),
+            np.concatenate(dists),
+            max_distance,
+            key=key,
+        )
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads the edges saved at the given path.
+        """
+        with np.load(path) as d:
+            edges = cls.__new__(cls)
+            edges.ids = d["ids"]
+            edges.inds1 = d["inds1"]
+            edges.inds2 = d["inds2"]
+            edges.dists = d["dists"]
+            edges.max_distance = d["max_distance"].item()
+            edges.key = (d["key"].item() if "key" in d else "") or None
+
+        return edges
+
+    @classmethod
+    def load_if_valid(cls, path, ids, max_distance, key=None):
+        """
+        Loads the edges saved at the given path if they exist, were computed
+        for exactly the given IDs and ``key`` and cover ``max_distance``, and
+        returns None otherwise.
+        """
+        if not os.path.isfile(path):
+            return None
+
+        edges = cls.load(path)
+        if (
+            edges.key != key
+            or edges.max_distance < max_distance
+            or not np.array_equal(edges.ids, np.asarray(ids, dtype=str))
+        ):
+            return None
+
+        return edges
+
+    def save(self, path):
+        """
+        Saves the edges to the given path.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                ids=self.ids,
+                inds1=self.inds1,
+                inds2=self.inds2,
+                dists=self.dists,
+                max_distance=np.array(self.max_distance),
+                key=np.array(self.key or ""),
+            )
+
+    def union_find(self, threshold, max_diameter=None, metric=None):
+        """
+        Returns a :class:`union_find.UnionFind` containing the pairs within
+        ``threshold`` of each other.
+        """
+        end = np.searchsorted(self.dists, threshold, side="right")
+        union_find = UnionFind(
+            len(self.ids), max_diameter=max_diameter, metric=metric
+        )
+        union_find.union_pairs(
+            self.inds1[:end], self.inds2[:end], dists=self.dists[:end]
+        )
+        return union_find
+
+    def group_ids(self, threshold, max_diameter=None, metric=None):
+        """
+        Returns a dict mapping the ID of every node that has a neighbor within
+        ``threshold`` to the ID of its group.
+        """
+        union_find = self.union_find(
+            threshold, max_diameter=max_diameter, metric=metric
+        )
+        return get_component_ids(self.ids, union_find)
+
+    def sweep(self, thresholds=None, fractions=None, batch_size=None):
+        """
+        Describes the duplicates at each of the given thresholds, and the
+        smallest threshold at which at least each of the given fractions of
+        the nodes are duplicates, in a single pass over the sorted pairs.
+
+        Returns a list of ``{"threshold", "fraction", "num_dups",
+        "num_groups", "num_images_with_dups"}`` dicts, thresholds first. The
+        threshold of a fraction that is not reached within ``max_distance``
+        is None.
+        """
+        if batch_size is None:
+            batch_size = DEFAULT_SWEEP_BATCH_SIZE
+
+        num_nodes = len(self.ids)
+        union_find = UnionFind(num_nodes)
+
+        thresholds = sorted(thresholds or [])
+        targets = []
+        for fraction in sorted(fractions or []):
+            num_keep = int(round(min(max(0, 1.0 - fraction), 1) * num_nodes))
+            targets.append((fraction, num_nodes - num_keep))
+
+        def _record(threshold, fraction=None):
+            return {
+                "threshold": threshold,
+                "fraction": fraction,
+                "num_dups": union_find.num_dups,
+                "num_groups": union_find.num_groups,
+                "num_images_with_dups": union_find.num_grouped,
+            }
+
+        threshold_results, fraction_results = [], []
+        for start in range(0, len(self.dists), batch_size):
+            if len(threshold_results) == len(thresholds) and len(
+                fraction_results
+            ) == len(targets):
+                break
+
+            inds1 = self.inds1[start : start + batch_size]
+            inds2 = self.inds2[start : start + batch_size]
+            dists = self.dists[start : start + batch_size]
+
+            ## pairs within a component cannot change any count
+            keep = union_find.find_many(inds1) != union_find.find_many(inds2)
+            for i, j, d in zip(
+                inds1[keep].tolist(),
+                inds2[keep].tolist(),
+                dists[keep].tolist(),
+            ):
+                while len(threshold_results) < len(thresholds):
+                    threshold = thresholds[len(threshold_results)]
+                    if d <= threshold:
+                        break
+
+                    threshold_results.append(_record(threshold))
+
+                if not union_find.union(i, j):
+                    continue
+
+                while len(fraction_results) < len(targets):
+                    fraction, num_dups = targets[len(fraction_results)]
+                    if union_find.num_dups < num_dups:
+                        break
+
+                    fraction_results.append(_record(d, fraction=fraction))
+
+        for threshold in thresholds[len(threshold_results) :]:
+            threshold_results.append(_record(threshold))
+
+        for fraction, _ in targets[len(fraction_results) :]:
+            fraction_results.append(_record(None, fraction=fraction))
+
+        return threshold_results + fraction_results
+
+
+def _load_embedding_block(embeddings, start, end, metric, scales, mean):
+    block = np.array(embeddings[start:end], dtype=np.float32)
+    if scales is not None:
+        block *= scales[start:end, None]
+
+    if mean is not None:
+        block -= mean
+
+    if metric == "cosine":
+        norms = np.linalg.norm(block, axis=1, keepdims=True)
+        block /= np.maximum(norms, 1e-12)
+
+    return block
+
+
+def _get_block_distances(rows, row_sq_norms, cols, metric):
+    dots = rows @ cols.T
+    if metric == "cosine":
+        return 1.0 - dots
+
+    col_sq_norms = (cols**2).sum(axis=1)
+    dists = row_sq_norms[:, None] + col_sq_norms[None, :] - 2 * dots
+    return np.sqrt(np.maximum(dists, 0))
+
+
+def _validate_metric(metric):
+    if metric not in EMBEDDING_METRICS:
+        raise ValueError("Unsupported metric '%s'" % metric)
+
+
+def iter_embedding_pairs(
+    embeddings,
+    max_distance,
+    metric="cosine",
+    batch_size=None,
+    scales=None,
+    mean=None,
+    start=0,
+    end=None,
+):
+    """
+    Yields ``(inds1, inds2, dists)`` arrays of all pairs of the given
+    embeddings within ``max_distance`` of each other, with ``inds1 < inds2``.
+
+    If ``start`` or ``end`` is provided, only the pairs whose first embedding
+    is in ``[start, end)`` are yielded, so that disjoint row ranges can be
+    searched independently.
+
+    Distances are computed between one block of ``batch_size`` rows and one
+    block of columns at a time, and only these blocks are converted to
+    ``float32``, so ``embeddings`` may be a memory-mapped array that does not
+    fit in memory.
+
+    Args:
+        embeddings: a ``num_embeddings x num_dims`` array-like
+        max_distance: the maximum distance of the pairs to yield
+        metric ("cosine"): the distance metric, "cosine" or "euclidean"
+        batch_size (None): the number of embeddings per block
+        scales (None): optional per-row scales by which quantized embeddings
+            are multiplied
+        mean (None): an optional vector to subtract from every embedding
+        start (0): the first row whose pairs to yield
+        end (None): the row after the last row whose pairs to yield
+    """
+    _validate_metric(metric)
+
+    if batch_size is None:
+        batch_size = DEFAULT_EMBEDDING_BLOCK_SIZE
+
+    num_embeddings = len(embeddings)
+    if end is None:
+        end = num_embeddings
+
+    args = (metric, scales, mean)
+
+    for row_start in range(start, end, batch_size):
+        row_end = min(row_start + batch_size, end)
+        rows = _load_embedding_block(embeddings, row_start, row_end, *args)
+        row_sq_norms = (rows**2).sum(axis=1)
+
+        for col_start in range(row_start, num_embeddings, batch_size):
+            col_end = min(col_start + batch_size, num_embeddings)
+            if col_start == row_start and col_end == row_end:
+                cols = rows
+            else:
+                cols = _load_embedding_block(
+                    embeddings, col_start, col_end, *args
+                )
+
+            dists = _get_block_distances(rows, row_sq_norms, cols, metric)
+            inds1, inds2 = np.nonzero(dists <= max_distance)
+            if col_start == row_start:
+                keep = inds2 > inds1
+                inds1, inds2 = inds1[keep], inds2[keep]
+
+            yield inds1 + row_start, inds2 + col_start, dists[inds1, inds2]
+
+
+def get_nearest_neighbor_distances(
+    embeddings, metric="cosine", batch_size=None, scales=None, mean=None
+):
+    """
+    Returns an array containing the distance from each of the given
+    embeddings to its nearest other embedding, or ``inf`` if there is none.
+
+    Distances are computed one block at a time as in
+    :func:`iter_embedding_pairs`, but no pairs are kept.
+    """
+    _validate_metric(metric)
+
+    if batch_size is None:
+        batch_size = DEFAULT_EMBEDDING_BLOCK_SIZE
+
+    num_embeddings = len(embeddings)
+    nn_dists = np.full(num_embeddings, np.inf)
+    args = (metric, scales, mean)
+
+    for row_start in range(0, num_embeddings, batch_size):
+        row_end = min(row_start + batch_size, num_embeddings)
+        rows = _load_embedding_block(embeddings, row_start, row_end, *args)
+        row_sq_norms = (rows**2).sum(axis=1)
+        row_inds = np.arange(row_end - row_start)
+
+        for col_start in range(0, num_embeddings, batch_size):
+            col_end = min(col_start + batch_size, num_embeddings)
+            if col_start == row_start:
+                cols = rows
+            else:
+                cols = _load_embedding_block(
+                    embeddings, col_start, col_end, *args
+                )
+
+            dists = _get_block_distances(rows, row_sq_norms, cols, metric)
+            if col_start == row_start:
+                dists[row_inds, row_inds] = np.inf
+
+            nn_dists[row_start:row_end] = np.minimum(
+                nn_dists[row_start:row_end], dists.min(axis=1)
+            )
+
+    return nn_dists
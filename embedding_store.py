@@ -0,0 +1,181 @@
+import os
+import shutil
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from dedup_utils import DEFAULT_BATCH_SIZE, iter_batches
+from duplicate_edges import iter_embedding_pairs
+from hash_cache import get_default_cache_path
+
+EMBEDDING_DTYPES = ("float32", "float16", "int8")
+
+
+def get_embedding_store_path(dataset, name):
+    """
+    Returns the directory of the embedding store with the given name for the
+    dataset.
+    """
+    return os.path.join(
+        os.path.dirname(get_default_cache_path()),
+        "embeddings",
+        str(dataset._doc.id),
+        name,
+    )
+
+
+class EmbeddingStore(object):
+    """
+    Memory-mapped, optionally quantized embeddings on disk.
+
+    ``float16`` halves the size of the embeddings. ``int8`` quarters it by
+    storing each embedding as integers in ``[-127, 127]`` with a per-row
+    scale.
+
+    Args:
+        path: the directory containing the store
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.embeddings = np.load(
+            os.path.join(path, "embeddings.npy"), mmap_mode="r"
+        )
+        self.mean = np.load(os.path.join(path, "mean.npy"))
+
+        scales_path = os.path.join(path, "scales.npy")
+        if os.path.isfile(scales_path):
+            self.scales = np.load(scales_path, mmap_mode="r")
+        else:
+            self.scales = None
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    @classmethod
+    def build(cls, path, batches, num_embeddings, dtype="float32"):
+        """
+        Writes the embeddings in the given iterable of ``num_rows x num_dims``
+        batches to ``path`` one batch at a time and returns the store.
+        """
+        if dtype not in EMBEDDING_DTYPES:
+            raise ValueError(
+                "Unsupported dtype '%s'. Supported values are %s"
+                % (dtype, EMBEDDING_DTYPES)
+            )
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+
+        embeddings = scales = total = None
+        start = 0
+        for batch in batches:
+            batch = np.asarray(batch, dtype=np.float32)
+            if embeddings is None:
+                shape = (num_embeddings, batch.shape[1])
+                embeddings = open_memmap(
+                    os.path.join(path, "embeddings.npy"),
+                    mode="w+",
+                    dtype=dtype,
+                    shape=shape,
+                )
+                if dtype == "int8":
+                    scales = open_memmap(
+                        os.path.join(path, "scales.npy"),
+                        mode="w+",
+                        dtype=np.float32,
+                        shape=(num_embeddings,),
+                    )
+
+                total = np.zeros(batch.shape[1], dtype=np.float64)
+
+            end = start + len(batch)
+            total += batch.sum(axis=0)
+            if dtype == "int8":
+                row_scales = np.abs(batch).max(axis=1) / 127.0
+                row_scales[row_scales == 0] = 1.0
+                embeddings[start:end] = np.round(batch / row_scales[:, None])
+                scales[start:end] = row_scales
+            else:
+                embeddings[start:end] = batch
+
+            start = end
+
+        if embeddings is None:
+            raise ValueError("There are no embeddings to store")
+
+        embeddings.flush()
+        if scales is not None:
+            scales.flush()
+
+        np.save(os.path.join(path, "mean.npy"), total / max(start, 1))
+        del embeddings, scales
+
+        return cls(path)
+
+    def delete(self):
+        """
+        Deletes the store from disk.
+        """
+        del self.embeddings, self.scales
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def iter_pairs(
+        self,
+        max_distance,
+        metric="cosine",
+        center=False,
+        batch_size=None,
+        start=0,
+        end=None,
+    ):
+        """
+        Yields ``(inds1, inds2, dists)`` arrays of all pairs of embeddings
+        within ``max_distance`` of each other, reading one block of
+        embeddings at a time.
+
+        If ``center`` is True, the mean embedding is subtracted from every
+        embedding before computing distances. If ``start`` or ``end`` is
+        provided, only the pairs whose first embedding is in ``[start, end)``
+        are yielded.
+        """
+        return iter_embedding_pairs(
+            self.embeddings,
+            max_distance,
+            metric=metric,
+            batch_size=batch_size,
+            scales=self.scales,
+            mean=self.mean.astype(np.float32) if center else None,
+            start=start,
+            end=end,
+        )
+
+
+def build_embedding_store(
+    sample_collection, embeddings_field, dtype="float32", batch_size=None
+):
+    """
+    Writes the embeddings in the given field of the collection to a temporary
+    :class:`EmbeddingStore`, reading them from the database in batches.
+
+    Returns ``(ids, store)``, where ``ids`` are the IDs of the samples whose
+    embeddings were stored, sorted so that contiguous rows of the store are
+    contiguous ranges of IDs.
+    """
+    if batch_size is None:
+        batch_size = DEFAULT_BATCH_SIZE
+
+    sample_collection = sample_collection.exists(embeddings_field)
+    ids = sorted(sample_collection.values("id"))
+
+    def _iter_batches():
+        for batch_ids in iter_batches(ids, batch_size):
+            view = sample_collection.select(batch_ids, ordered=True)
+            yield np.stack(view.values(embeddings_field))
+
+    path = get_embedding_store_path(
+        sample_collection._dataset, "%s-%s" % (embeddings_field, dtype)
+    )
+    store = EmbeddingStore.build(path, _iter_batches(), len(ids), dtype=dtype)
+
+    return ids, store
@@ -1,91 +1,1100 @@
-from collections import Counter
+from collections import Counter, defaultdict
+from functools import partial
+import os
 
 import fiftyone as fo
-import fiftyone.core.utils as fou
 from fiftyone import ViewField as F
 
+from dedup_metrics import StageMetrics
+from dedup_utils import (
+    DEFAULT_BATCH_SIZE,
+    delete_samples,
+    get_ids_and_filepaths,
+    is_whole_dataset,
+    iter_batches,
+    load_scoped_view,
+    map_parallel,
+    replace_field_values,
+    select_duplicates,
+)
+from file_hashes import (
+    ChunkHasher,
+    get_filehash_field_type,
+    hash_chunks,
+    hash_file,
+    parse_filehash,
+)
+from group_index import (
+    build_group_index,
+    delete_group_index,
+    load_group_index,
+)
+from hash_cache import FileHashCache, get_file_identity
+from media_reader import is_url, map_prefetched
+from pixel_hashes import (
+    PIXELHASH_FIELD,
+    compute_pixel_hashes,
+    prepare_pixelhash_field,
+)
+from sharding import iter_sharded
 
-def get_filepath(sample):
-    return (
-        sample.local_path if hasattr(sample, "local_path") else sample.filepath
+DEFAULT_HASH_METHOD = "md5"
+COUNT_FIELD = "filehash_count"
+HASH_FIELDS = ("filehash", PIXELHASH_FIELD)
+GROUP_INDEX_NAME = "exact"
+DEFAULT_PAGE_SIZE = 100
+FINGERPRINT_FIELDS = ("filehash_size", "filehash_mtime")
+RULED_OUT_FIELD = "filehash_ruled_out"
+PARTIAL_HASH_SIZE = 4096
+
+
+def _get_file_stat(filepath):
+    stat = os.stat(filepath)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _compute_filehash(filepath, method=DEFAULT_HASH_METHOD):
+    size, mtime = _get_file_stat(filepath)
+    return hash_file(filepath, method=method), size, mtime
+
+
+def _compute_filehash_and_bytes_read(filepath, method=DEFAULT_HASH_METHOD):
+    filehash, size, mtime = _compute_filehash(filepath, method=method)
+    return filehash, size, mtime, size
+
+
+def _get_file_stat_if_local(filepath):
+    if is_url(filepath):
+        return None, None
+
+    return _get_file_stat(filepath)
+
+
+def _hash_files(
+    filepaths,
+    method=DEFAULT_HASH_METHOD,
+    prefetch=False,
+    max_in_flight=None,
+    **kwargs,
+):
+    if not prefetch:
+        return map_parallel(
+            partial(hash_file, method=method), filepaths, **kwargs
+        )
+
+    results = map_prefetched(
+        partial(ChunkHasher, method),
+        filepaths,
+        max_in_flight=max_in_flight,
+    )
+    return (filehash for filehash, _ in results)
+
+
+def _iter_prefetched_filehashes(
+    filepaths, method=DEFAULT_HASH_METHOD, max_in_flight=None, **kwargs
+):
+    ## file stats are fetched concurrently with the reads rather than
+    ## after them, since each one is a round-trip on network storage
+    stats = map_parallel(_get_file_stat_if_local, filepaths, **kwargs)
+    results = map_prefetched(
+        partial(ChunkHasher, method),
+        filepaths,
+        max_in_flight=max_in_flight,
+    )
+    for (size, mtime), (filehash, num_bytes) in zip(stats, results):
+        if size is None:
+            size = num_bytes
+
+        yield filehash, size, mtime, num_bytes
+
+
+def get_filehash_method(sample_collection):
+    """
+    Returns the method with which the ``filehash`` field of the collection
+    was computed, or None if the collection has no ``filehash`` field or its
+    method was not recorded.
+    """
+    field = sample_collection.get_field("filehash")
+    if field is None:
+        return None
+
+    return (field.info or {}).get("method", None)
+
+
+def _prepare_filehash_field(sample_collection, method):
+    dataset = sample_collection._dataset
+
+    ## hashes computed with a different method cannot be compared, so they
+    ## are discarded and recomputed. This includes hashes whose method was not
+    ## recorded, which older versions of this plugin computed with Python's
+    ## per-process salted ``hash()``
+    if (
+        dataset.has_sample_field("filehash")
+        and get_filehash_method(dataset) != method
+    ):
+        dataset.delete_sample_fields(
+            [
+                f
+                for f in ("filehash", *FINGERPRINT_FIELDS, RULED_OUT_FIELD)
+                if dataset.has_sample_field(f)
+            ]
+        )
+
+    if not dataset.has_sample_field("filehash"):
+        dataset.add_sample_field(
+            "filehash",
+            get_filehash_field_type(method),
+            info={"method": method},
+        )
+
+
+def _iter_uncached_filehashes(
+    filepaths,
+    method=DEFAULT_HASH_METHOD,
+    prefetch=False,
+    max_in_flight=None,
+    **kwargs,
+):
+    if prefetch:
+        return _iter_prefetched_filehashes(
+            filepaths, method=method, max_in_flight=max_in_flight, **kwargs
+        )
+
+    return map_parallel(
+        partial(_compute_filehash_and_bytes_read, method=method),
+        filepaths,
+        **kwargs,
+    )
+
+
+def _iter_cached_filehashes(
+    filepaths,
+    cache,
+    method=DEFAULT_HASH_METHOD,
+    prefetch=False,
+    max_in_flight=None,
+    **kwargs,
+):
+    identities = list(map_parallel(get_file_identity, filepaths, **kwargs))
+    filehashes = [
+        parse_filehash(fh, method)
+        for fh in cache.get_many(filepaths, identities, method)
+    ]
+
+    miss_inds = [i for i, fh in enumerate(filehashes) if fh is None]
+    miss_filepaths = [filepaths[i] for i in miss_inds]
+    miss_filehashes = list(
+        _hash_files(
+            miss_filepaths,
+            method=method,
+            prefetch=prefetch,
+            max_in_flight=max_in_flight,
+            **kwargs,
+        )
+    )
+    bytes_read = [0] * len(filepaths)
+    for i, filehash in zip(miss_inds, miss_filehashes):
+        filehashes[i] = filehash
+        bytes_read[i] = identities[i][0]
+
+    cache.put_many(
+        miss_filepaths,
+        [identities[i] for i in miss_inds],
+        miss_filehashes,
+        method,
+    )
+
+    for filehash, (size, mtime, _), num_bytes in zip(
+        filehashes, identities, bytes_read
+    ):
+        yield filehash, size, mtime, num_bytes
+
+
+def _iter_filehashes(
+    filepaths,
+    method=DEFAULT_HASH_METHOD,
+    cache=None,
+    batch_size=None,
+    **kwargs,
+):
+    if cache is None:
+        yield from _iter_uncached_filehashes(
+            filepaths, method=method, **kwargs
+        )
+        return
+
+    for batch in iter_batches(filepaths, batch_size):
+        ## URLs have no filesystem identity against which cached hashes could
+        ## be validated, so they are always hashed
+        url_inds = [i for i, f in enumerate(batch) if is_url(f)]
+        local_inds = [i for i, f in enumerate(batch) if not is_url(f)]
+
+        results = [None] * len(batch)
+        for inds, iter_fn in (
+            (url_inds, _iter_uncached_filehashes),
+            (local_inds, partial(_iter_cached_filehashes, cache=cache)),
+        ):
+            if inds:
+                _results = iter_fn(
+                    [batch[i] for i in inds], method=method, **kwargs
+                )
+                for i, result in zip(inds, _results):
+                    results[i] = result
+
+        yield from results
+
+
+def _get_stale_indices(
+    sample_collection,
+    filepaths,
+    hash_ruled_out=False,
+    num_workers=None,
+    use_processes=False,
+):
+    schema = sample_collection.get_field_schema()
+    if any(f not in schema for f in ("filehash", *FINGERPRINT_FIELDS)):
+        return list(range(len(filepaths)))
+
+    filehashes, sizes, mtimes = sample_collection.values(
+        ["filehash", *FINGERPRINT_FIELDS]
+    )
+    if RULED_OUT_FIELD in schema:
+        ruled_out = sample_collection.values(RULED_OUT_FIELD)
+    else:
+        ruled_out = [None] * len(filepaths)
+
+    stats = list(
+        map_parallel(
+            _get_file_stat_if_local,
+            filepaths,
+            num_workers=num_workers,
+            use_processes=use_processes,
+        )
+    )
+    size_counts = Counter(size for size, _ in stats)
+
+    stale_inds = []
+    for idx, (filehash, size, mtime, stage, stat) in enumerate(
+        zip(filehashes, sizes, mtimes, ruled_out, stats)
+    ):
+        if (size, mtime) != stat:
+            stale_inds.append(idx)
+        elif filehash is None and (
+            stage is None or hash_ruled_out or size_counts[size] > 1
+        ):
+            ## files that staged hashing ruled out only need a hash once
+            ## another file of the same size appears, unless every file
+            ## needs one
+            stale_inds.append(idx)
+
+    return stale_inds
+
+
+def compute_filehashes(
+    sample_collection,
+    num_workers=None,
+    batch_size=None,
+    use_processes=False,
+    incremental=False,
+    use_cache=False,
+    cache_path=None,
+    method=DEFAULT_HASH_METHOD,
+    prefetch=False,
+    max_in_flight=None,
+    hash_ruled_out=False,
+):
+    """
+    Hashes the media of the samples in the collection in a worker pool and
+    writes the results to the ``filehash`` field in batches.
+
+    The size and modification time of each file are stored alongside its hash
+    so that, when ``incremental`` is True, only samples that have no hash or
+    whose file has changed since it was hashed are processed. Samples that
+    :func:`compute_filehashes_staged` ruled out are only hashed once another
+    file of the same size appears, unless ``hash_ruled_out`` is True, as is
+    needed when every sample must have a hash.
+
+    When ``use_cache`` is True, the persistent
+    :class:`hash_cache.FileHashCache` at ``cache_path`` is consulted before
+    reading each file, so files that were already hashed for another dataset
+    are not read again. HTTP(S) URLs are never cached, since they have no
+    filesystem identity by which changes could be detected.
+
+    The hash ``method`` is recorded on the ``filehash`` field. If the existing
+    hashes of the dataset were computed with a different method, they are
+    discarded, since hashes of different methods cannot be compared.
+
+    When ``prefetch`` is True, files are read by a
+    :class:`media_reader.AsyncMediaReader` that keeps up to ``max_in_flight``
+    reads in flight and streams them into the hasher, which hides the latency
+    of network storage and HTTP(S) URLs. URLs cannot be checked for changes,
+    so ``incremental`` always rehashes them.
+
+    Returns a dict containing the number of hashed samples and the number of
+    bytes that were read.
+    """
+    if batch_size is None:
+        batch_size = DEFAULT_BATCH_SIZE
+
+    _prepare_filehash_field(sample_collection, method)
+    ids, filepaths = get_ids_and_filepaths(sample_collection)
+
+    if incremental:
+        inds = _get_stale_indices(
+            sample_collection,
+            filepaths,
+            hash_ruled_out=hash_ruled_out,
+            num_workers=num_workers,
+            use_processes=use_processes,
+        )
+        ids = [ids[i] for i in inds]
+        filepaths = [filepaths[i] for i in inds]
+
+    cache = FileHashCache(path=cache_path) if use_cache else None
+    total_bytes_read = 0
+
+    try:
+        results = _iter_filehashes(
+            filepaths,
+            method=method,
+            cache=cache,
+            batch_size=batch_size,
+            num_workers=num_workers,
+            prefetch=prefetch,
+            max_in_flight=max_in_flight,
+            use_processes=use_processes,
+        )
+
+        for batch in iter_batches(zip(ids, results), batch_size):
+            total_bytes_read += _set_filehash_values(sample_collection, batch)
+    finally:
+        if cache is not None:
+            cache.close()
+
+    return {"num_hashed": len(ids), "bytes_read": total_bytes_read}
+
+
+def _set_filehash_values(sample_collection, batch):
+    batch_ids, batch_results = zip(*batch)
+    *batch_values, batch_bytes_read = zip(*batch_results)
+    for field, values in zip(("filehash", *FINGERPRINT_FIELDS), batch_values):
+        sample_collection.set_values(
+            field, dict(zip(batch_ids, values)), key_field="id"
+        )
+
+    return sum(batch_bytes_read)
+
+
+def compute_filehashes_sharded(
+    sample_collection,
+    num_shards=None,
+    num_workers=None,
+    batch_size=None,
+    method=DEFAULT_HASH_METHOD,
+):
+    """
+    Hashes the media of the samples in the collection in shards of contiguous
+    ID ranges, each processed by a worker process, and writes the results to
+    the ``filehash`` field as the shards complete.
+
+    The hashes of the shards are merged into a single hash table as they are
+    written, so the duplicate groups are found without reading the hashes
+    back from the database. Each group's IDs are sorted, so the groups do not
+    depend on the number of shards or workers.
+
+    Returns a ``(dup_groups, stats)`` tuple, where ``dup_groups`` is in the
+    format returned by :func:`get_duplicate_filehash_groups` and ``stats``
+    contains the number of hashed samples and the number of bytes read.
+    """
+    if batch_size is None:
+        batch_size = DEFAULT_BATCH_SIZE
+
+    _prepare_filehash_field(sample_collection, method)
+    ids, filepaths = get_ids_and_filepaths(sample_collection)
+    results = iter_sharded(
+        partial(_compute_filehash_and_bytes_read, method=method),
+        ids,
+        filepaths,
+        num_shards=num_shards,
+        num_workers=num_workers,
+    )
+
+    table = defaultdict(list)
+    total_bytes_read = 0
+    for batch in iter_batches(results, batch_size):
+        total_bytes_read += _set_filehash_values(sample_collection, batch)
+        for _id, (filehash, *_) in batch:
+            table[filehash].append(_id)
+
+    dup_groups = [
+        {"filehash": filehash, "count": len(group), "ids": sorted(group)}
+        for filehash, group in sorted(table.items())
+        if len(group) > 1
+    ]
+    stats = {"num_hashed": len(ids), "bytes_read": total_bytes_read}
+
+    return dup_groups, stats
+
+
+def _compute_partial_filehash(filepath, method=DEFAULT_HASH_METHOD):
+    with open(filepath, "rb") as f:
+        head = f.read(PARTIAL_HASH_SIZE)
+        f.seek(-PARTIAL_HASH_SIZE, os.SEEK_END)
+        tail = f.read(PARTIAL_HASH_SIZE)
+
+    return hash_chunks([head, tail], method=method)
+
+
+def _get_file_stats(filepaths, inds, stats, **kwargs):
+    missing_inds = [i for i in inds if stats[i] is None]
+    missing_stats = map_parallel(
+        _get_file_stat, [filepaths[i] for i in missing_inds], **kwargs
+    )
+    for i, stat in zip(missing_inds, missing_stats):
+        stats[i] = stat
+
+
+def _get_file_sizes(sample_collection, filepaths, **kwargs):
+    sizes = [None] * len(filepaths)
+    schema = sample_collection.get_field_schema()
+    if "metadata" in schema:
+        sizes = sample_collection.values("metadata.size_bytes")
+
+    ## files whose size is not in their metadata are stat-ed, and their stats
+    ## are kept for their fingerprints
+    stats = [None] * len(filepaths)
+    _get_file_stats(
+        filepaths,
+        [i for i, size in enumerate(sizes) if size is None],
+        stats,
+        **kwargs,
+    )
+    sizes = [
+        stat[0] if stat is not None else size
+        for size, stat in zip(sizes, stats)
+    ]
+
+    return sizes, stats
+
+
+def _get_colliding_indices(keys, inds):
+    counts = Counter(keys[i] for i in inds)
+    return [i for i in inds if counts[keys[i]] > 1]
+
+
+def _validate_local_filepaths(filepaths):
+    ## staged hashing needs the size of each file and seeks within it
+    url = next((f for f in filepaths if is_url(f)), None)
+    if url is not None:
+        raise ValueError(
+            "Staged hashing requires local media, but found the URL '%s'. "
+            "Hash every sample instead" % url
+        )
+
+
+def compute_filehashes_staged(
+    sample_collection,
+    num_workers=None,
+    batch_size=None,
+    use_processes=False,
+    method=DEFAULT_HASH_METHOD,
+):
+    """
+    Computes the ``filehash`` of only those samples that could be exact
+    duplicates, in three stages:
+
+    1.  Files are grouped by size, using ``metadata.size_bytes`` when
+        available. Files with a unique size cannot have duplicates
+    2.  Files whose size collides are hashed on their first and last
+        ``PARTIAL_HASH_SIZE`` bytes
+    3.  Files whose size and partial hash both collide are fully hashed
+
+    The media must be local, since the stages need the size of each file and
+    seek within it.
+
+    Samples that are ruled out before the last stage have their ``filehash``
+    cleared, and the stage that ruled them out is stored in the
+    ``filehash_ruled_out`` field alongside their file size and modification
+    time, so that later incremental runs and runs on new samples only hash
+    them once another file of the same size appears. Returns a dict
+    describing the number of bytes read and the number of bytes that each
+    stage avoided reading.
+    """
+    if batch_size is None:
+        batch_size = DEFAULT_BATCH_SIZE
+
+    kwargs = dict(num_workers=num_workers, use_processes=use_processes)
+
+    ids, filepaths = get_ids_and_filepaths(sample_collection)
+    _validate_local_filepaths(filepaths)
+    _prepare_filehash_field(sample_collection, method)
+
+    ### stage 1: file sizes
+    sizes, stats = _get_file_sizes(sample_collection, filepaths, **kwargs)
+    all_inds = range(len(ids))
+    size_inds = _get_colliding_indices(sizes, all_inds)
+    bytes_avoided_by_size = sum(sizes[i] for i in all_inds) - sum(
+        sizes[i] for i in size_inds
+    )
+
+    ### stage 2: partial hashes of large files
+    small_inds = [i for i in size_inds if sizes[i] <= 2 * PARTIAL_HASH_SIZE]
+    large_inds = [i for i in size_inds if sizes[i] > 2 * PARTIAL_HASH_SIZE]
+    partial_hashes = dict(
+        zip(
+            large_inds,
+            map_parallel(
+                partial(_compute_partial_filehash, method=method),
+                [filepaths[i] for i in large_inds],
+                **kwargs,
+            ),
+        )
     )
+    partial_keys = {i: (sizes[i], h) for i, h in partial_hashes.items()}
+    partial_inds = _get_colliding_indices(partial_keys, large_inds)
+    partial_bytes_read = 2 * PARTIAL_HASH_SIZE * len(large_inds)
+    bytes_avoided_by_partial_hash = sum(
+        sizes[i] - 2 * PARTIAL_HASH_SIZE for i in large_inds
+    ) - sum(sizes[i] - 2 * PARTIAL_HASH_SIZE for i in partial_inds)
+
+    ### stage 3: full hashes
+    full_inds = sorted(small_inds + partial_inds)
+    results = map_parallel(
+        partial(_compute_filehash, method=method),
+        [filepaths[i] for i in full_inds],
+        **kwargs,
+    )
+
+    filehashes, fingerprints = {}, {}
+    for i, (filehash, size, mtime) in zip(full_inds, results):
+        filehashes[ids[i]] = filehash
+        fingerprints[ids[i]] = (size, mtime)
+
+    full_set, large_set = set(full_inds), set(large_inds)
+    ruled_out_inds = [i for i in all_inds if i not in full_set]
+    ruled_out = {
+        ids[i]: "partial_hash" if i in large_set else "size"
+        for i in ruled_out_inds
+    }
+    _get_file_stats(filepaths, ruled_out_inds, stats, **kwargs)
+    for i in ruled_out_inds:
+        fingerprints[ids[i]] = stats[i]
+
+    for batch in iter_batches(fingerprints.items(), batch_size):
+        batch_ids, batch_fingerprints = zip(*batch)
+        for field, values in zip(FINGERPRINT_FIELDS, zip(*batch_fingerprints)):
+            sample_collection.set_values(
+                field, dict(zip(batch_ids, values)), key_field="id"
+            )
+
+    replace_field_values(
+        sample_collection,
+        "filehash",
+        filehashes,
+        get_filehash_field_type(method),
+        batch_size=batch_size,
+    )
+    replace_field_values(
+        sample_collection,
+        RULED_OUT_FIELD,
+        ruled_out,
+        fo.StringField,
+        batch_size=batch_size,
+    )
+
+    full_bytes_read = sum(sizes[i] for i in full_inds)
+
+    return {
+        "num_fully_hashed": len(full_inds),
+        "bytes_read": partial_bytes_read + full_bytes_read,
+        "bytes_avoided_by_size": bytes_avoided_by_size,
+        "bytes_avoided_by_partial_hash": bytes_avoided_by_partial_hash,
+    }
+
 
+def get_duplicate_filehash_groups(sample_collection, hash_field="filehash"):
+    """
+    Returns a list of ``{"filehash", "count", "ids"}`` dicts describing each
+    group of samples in the collection that share a value of ``hash_field``,
+    which is stored under the ``filehash`` key.
 
-def compute_filehashes(sample_collection):
-    for sample in sample_collection.iter_samples(autosave=True):
-        filepath = get_filepath(sample)
-        sample["filehash"] = str(fou.compute_filehash(filepath))
+    The grouping is performed by a single aggregation in the database, so
+    only the duplicate groups are returned to Python.
+    """
+    pipeline = [
+        {"$match": {hash_field: {"$ne": None}}},
+        {
+            "$group": {
+                "_id": "$" + hash_field,
+                "count": {"$sum": 1},
+                "ids": {"$push": "$_id"},
+            }
+        },
+        {"$match": {"count": {"$gt": 1}}},
+    ]
 
+    return [
+        {
+            "filehash": d["_id"],
+            "count": d["count"],
+            "ids": [str(_id) for _id in d["ids"]],
+        }
+        for d in sample_collection._aggregate(pipeline=pipeline)
+    ]
 
-def _need_to_compute_filehashes(sample_collection):
-    return (
-        True
-        if "filehash" not in sample_collection.get_field_schema()
-        else False
+
+def _set_filehash_counts(
+    sample_collection, dup_groups, hash_field="filehash", batch_size=None
+):
+    counts = {}
+    for group in dup_groups:
+        for _id in group["ids"]:
+            counts[_id] = group["count"]
+
+    replace_field_values(
+        sample_collection,
+        COUNT_FIELD,
+        counts,
+        fo.IntField,
+        batch_size=batch_size,
     )
+    _set_count_hash_field(sample_collection, hash_field)
+
+
+def _set_count_hash_field(sample_collection, hash_field):
+    field = sample_collection._dataset.get_field(COUNT_FIELD)
+    if (field.info or {}).get("hash_field", None) != hash_field:
+        field.info = dict(field.info or {}, hash_field=hash_field)
+        field.save()
 
 
-def find_exact_duplicates(sample_collection):
-    if _need_to_compute_filehashes(sample_collection):
-        compute_filehashes(sample_collection)
+def get_exact_duplicates_hash_field(sample_collection):
+    """
+    Returns the hash field, one of ``HASH_FIELDS``, by which the current
+    exact duplicates of the collection's dataset were found.
+    """
+    field = sample_collection._dataset.get_field(COUNT_FIELD)
+    if field is None:
+        return "filehash"
 
-    filehash_counts = Counter(sample.filehash for sample in sample_collection)
-    dup_filehashes = [k for k, v in filehash_counts.items() if v > 1]
+    return (field.info or {}).get("hash_field", "filehash")
+
+
+def _validate_hash_field(hash_field):
+    if hash_field not in HASH_FIELDS:
+        raise ValueError(
+            "Unsupported hash field '%s'. Supported values are %s"
+            % (hash_field, HASH_FIELDS)
+        )
 
-    exact_dup_view = sample_collection.match(
-        F("filehash").is_in(dup_filehashes)
-    ).sort_by("filehash")
+
+def _need_to_compute_filehashes(sample_collection, method):
+    return get_filehash_method(sample_collection) != method
+
+
+def _save_exact_duplicates_view(sample_collection, hash_field="filehash"):
+    exact_dup_view = sample_collection.exists(COUNT_FIELD).sort_by(hash_field)
     ### save the view
     dataset = sample_collection._dataset
     dataset.save_view("exact_dup_view", exact_dup_view, overwrite=True)
 
-    num_images_with_exact_dups = len(exact_dup_view)
-    num_dups = num_images_with_exact_dups - len(dup_filehashes)
+
+def _validate_sharded_options(**options):
+    unsupported = [name for name, value in options.items() if value]
+    if unsupported:
+        raise ValueError(
+            "Sharded hashing does not support %s" % ", ".join(unsupported)
+        )
+
+
+def find_exact_duplicates(
+    sample_collection,
+    num_workers=None,
+    batch_size=None,
+    use_processes=False,
+    incremental=False,
+    use_cache=False,
+    cache_path=None,
+    staged=False,
+    sharded=False,
+    num_shards=None,
+    method=DEFAULT_HASH_METHOD,
+    hash_field="filehash",
+    pixel_size=None,
+    prefetch=False,
+    max_in_flight=None,
+    metrics=None,
+):
+    _validate_hash_field(hash_field)
+
+    if metrics is None:
+        metrics = StageMetrics()
+
+    stats = {}
+    dup_groups = None
+    with metrics.stage("hashing", num_items=0, bytes_read=0) as record:
+        if hash_field == PIXELHASH_FIELD:
+            record["num_items"] = compute_pixel_hashes(
+                sample_collection,
+                method=method,
+                size=pixel_size,
+                num_workers=num_workers,
+                batch_size=batch_size,
+                use_processes=use_processes,
+                sharded=sharded,
+                num_shards=num_shards,
+            )
+            record["bytes_read"] = None
+        elif sharded:
+            _validate_sharded_options(
+                incremental=incremental,
+                use_cache=use_cache,
+                staged=staged,
+                prefetch=prefetch,
+            )
+            dup_groups, results = compute_filehashes_sharded(
+                sample_collection,
+                num_shards=num_shards,
+                num_workers=num_workers,
+                batch_size=batch_size,
+                method=method,
+            )
+            record["num_items"] = results["num_hashed"]
+            record["bytes_read"] = results["bytes_read"]
+        elif staged:
+            stats = compute_filehashes_staged(
+                sample_collection,
+                num_workers=num_workers,
+                batch_size=batch_size,
+                use_processes=use_processes,
+                method=method,
+            )
+            record["num_items"] = stats["num_fully_hashed"]
+            record["bytes_read"] = stats["bytes_read"]
+        elif incremental or _need_to_compute_filehashes(
+            sample_collection, method
+        ):
+            results = compute_filehashes(
+                sample_collection,
+                num_workers=num_workers,
+                batch_size=batch_size,
+                use_processes=use_processes,
+                incremental=incremental,
+                use_cache=use_cache,
+                cache_path=cache_path,
+                method=method,
+                prefetch=prefetch,
+                max_in_flight=max_in_flight,
+            )
+            record["num_items"] = results["num_hashed"]
+            record["bytes_read"] = results["bytes_read"]
+
+    with metrics.stage("grouping") as record:
+        if dup_groups is None:
+            dup_groups = get_duplicate_filehash_groups(
+                sample_collection, hash_field=hash_field
+            )
+
+        record["num_items"] = len(dup_groups)
+
+    num_images_with_exact_dups = sum(g["count"] for g in dup_groups)
+    num_dups = num_images_with_exact_dups - len(dup_groups)
+
+    with metrics.stage("labeling", num_items=num_images_with_exact_dups):
+        _set_filehash_counts(
+            sample_collection,
+            dup_groups,
+            hash_field=hash_field,
+            batch_size=batch_size,
+        )
+
+    with metrics.stage("saving_views"):
+        _save_exact_duplicates_view(sample_collection, hash_field=hash_field)
+        build_group_index(
+            sample_collection._dataset,
+            GROUP_INDEX_NAME,
+            COUNT_FIELD,
+            [_id for g in dup_groups for _id in g["ids"]],
+            [g["filehash"] for g in dup_groups for _ in g["ids"]],
+            dists=[0 for g in dup_groups for _ in g["ids"]],
+        )
 
     response = {
         "num_images_with_exact_dups": num_images_with_exact_dups,
         "num_dups": num_dups,
     }
+    response.update(stats)
+    response["stages"] = metrics.to_list()
 
     return response
 
 
-def get_exact_duplicate_groups(sample_collection):
+def _get_colliding_ruled_out_ids(sample_collection, ids, batch_size):
     dataset = sample_collection._dataset
-    exact_dup_view = dataset.load_saved_view("exact_dup_view")
-    exact_dup_groups_view = exact_dup_view.group_by("filehash")
+    if not dataset.has_sample_field(RULED_OUT_FIELD):
+        return []
+
+    sizes = set()
+    for batch_ids in iter_batches(ids, batch_size):
+        sizes.update(dataset.select(batch_ids).values(FINGERPRINT_FIELDS[0]))
+
+    sizes.discard(None)
+
+    dataset.create_index(FINGERPRINT_FIELDS[0])
+    ruled_out_view = sample_collection.exists("filehash", False).exists(
+        RULED_OUT_FIELD
+    )
+
+    ruled_out_ids = []
+    for batch_sizes in iter_batches(sorted(sizes), batch_size):
+        view = ruled_out_view.match(
+            F(FINGERPRINT_FIELDS[0]).is_in(batch_sizes)
+        )
+        ruled_out_ids.extend(view.values("id"))
+
+    return ruled_out_ids
+
+
+def add_new_exact_duplicates(
+    sample_collection,
+    num_workers=None,
+    batch_size=None,
+    use_processes=False,
+    use_cache=False,
+    cache_path=None,
+    method=DEFAULT_HASH_METHOD,
+    hash_field="filehash",
+    pixel_size=None,
+    prefetch=False,
+    max_in_flight=None,
+    metrics=None,
+):
+    """
+    Updates the exact duplicates of the collection in place after new samples
+    have been added to it.
+
+    Only samples without a hash are hashed, and the existing samples that
+    share a hash with them are looked up via a database index on the
+    ``hash_field`` field, so the cost of an update scales with the number of
+    new samples rather than with the size of the dataset. Samples that
+    :func:`compute_filehashes_staged` ruled out are only hashed if their
+    size matches that of a new sample. If the existing
+    hashes were computed with a different ``method``, every sample is
+    rehashed.
+    """
+    _validate_hash_field(hash_field)
+
+    if metrics is None:
+        metrics = StageMetrics()
+
+    if batch_size is None:
+        batch_size = DEFAULT_BATCH_SIZE
+
+    dataset = sample_collection._dataset
+    if dataset.has_sample_field(COUNT_FIELD) and (
+        get_exact_duplicates_hash_field(dataset) != hash_field
+    ):
+        raise ValueError(
+            "The existing exact duplicates were found by '%s', so they "
+            "cannot be updated by '%s'. Find all exact duplicates by '%s' "
+            "first"
+            % (
+                get_exact_duplicates_hash_field(dataset),
+                hash_field,
+                hash_field,
+            )
+        )
+
+    if hash_field == PIXELHASH_FIELD:
+        prepare_pixelhash_field(sample_collection, method, pixel_size)
+    else:
+        _prepare_filehash_field(sample_collection, method)
+
+    new_view = sample_collection.exists(hash_field, False)
+    if hash_field == "filehash" and dataset.has_sample_field(RULED_OUT_FIELD):
+        ## samples that staged hashing ruled out are not new
+        new_view = new_view.exists(RULED_OUT_FIELD, False)
+
+    new_ids = new_view.values("id")
+
+    with metrics.stage("hashing") as record:
+        kwargs = dict(
+            num_workers=num_workers,
+            batch_size=batch_size,
+            use_processes=use_processes,
+            method=method,
+        )
+        if hash_field == PIXELHASH_FIELD:
+            record["num_items"] = compute_pixel_hashes(
+                new_view, size=pixel_size, **kwargs
+            )
+        else:
+            kwargs.update(
+                use_cache=use_cache,
+                cache_path=cache_path,
+                prefetch=prefetch,
+                max_in_flight=max_in_flight,
+            )
+            results = compute_filehashes(new_view, **kwargs)
+            record["num_items"] = results["num_hashed"]
+            record["bytes_read"] = results["bytes_read"]
+
+            ## samples that staged hashing ruled out may now have a
+            ## duplicate among the new samples if their sizes match
+            ruled_out_ids = _get_colliding_ruled_out_ids(
+                sample_collection, new_ids, batch_size
+            )
+            if ruled_out_ids:
+                results = compute_filehashes(
+                    sample_collection.select(ruled_out_ids), **kwargs
+                )
+                record["num_items"] += results["num_hashed"]
+                record["bytes_read"] += results["bytes_read"]
+
+    with metrics.stage("grouping") as record:
+        dataset.create_index(hash_field)
+
+        new_hashes = set()
+        for batch_ids in iter_batches(new_ids, batch_size):
+            new_hashes.update(dataset.select(batch_ids).values(hash_field))
+
+        new_hashes.discard(None)
+
+        dup_groups = []
+        for batch_hashes in iter_batches(sorted(new_hashes), batch_size):
+            view = sample_collection.match(F(hash_field).is_in(batch_hashes))
+            dup_groups.extend(
+                get_duplicate_filehash_groups(view, hash_field=hash_field)
+            )
+
+        record["num_items"] = len(dup_groups)
+
+    with metrics.stage("labeling") as record:
+        counts = {}
+        for group in dup_groups:
+            for _id in group["ids"]:
+                counts[_id] = group["count"]
+
+        if COUNT_FIELD not in sample_collection.get_field_schema():
+            dataset.add_sample_field(COUNT_FIELD, fo.IntField)
+
+        _set_count_hash_field(sample_collection, hash_field)
+        for batch in iter_batches(counts.items(), batch_size):
+            sample_collection.set_values(
+                COUNT_FIELD, dict(batch), key_field="id"
+            )
+
+        record["num_items"] = len(counts)
+
+    with metrics.stage("saving_views"):
+        _save_exact_duplicates_view(sample_collection, hash_field=hash_field)
+        delete_group_index(dataset, GROUP_INDEX_NAME, field=COUNT_FIELD)
+
+    return {
+        "num_new_samples": len(new_ids),
+        "num_new_dups": len(set(new_ids) & set(counts.keys())),
+        "num_updated_groups": len(dup_groups),
+        "stages": metrics.to_list(),
+    }
+
+
+def get_exact_duplicate_groups(sample_collection):
+    exact_dup_view = load_scoped_view(sample_collection, "exact_dup_view")
+    hash_field = get_exact_duplicates_hash_field(sample_collection)
+    exact_dup_groups_view = exact_dup_view.group_by(hash_field)
     return exact_dup_groups_view
 
 
-def remove_all_exact_duplicates(sample_collection):
+def get_exact_duplicate_groups_page(
+    sample_collection, page=0, page_size=DEFAULT_PAGE_SIZE, sort_by="size"
+):
+    """
+    Returns a view containing the exact duplicate groups on the given
+    zero-based page, largest first, along with the number of pages.
+
+    Groups are served from the group index written when the duplicates were
+    found, so the cost of a page does not depend on the number of groups.
+    When the collection is a view, only its members of the groups are shown,
+    and groups with fewer than two members in the view are omitted.
+    """
+    dataset = sample_collection._dataset
+    hash_field = get_exact_duplicates_hash_field(dataset)
+    index = load_group_index(
+        dataset.load_saved_view("exact_dup_view"),
+        GROUP_INDEX_NAME,
+        hash_field,
+        marker_field=COUNT_FIELD,
+    )
+    if not is_whole_dataset(sample_collection):
+        view = load_scoped_view(sample_collection, "exact_dup_view")
+        index = index.restrict(view.values("id"))
+
+    _, ids = index.get_page(page, page_size, sort_by=sort_by)
+    view = dataset.select(ids, ordered=True).group_by(hash_field)
+    return view, index.num_pages(page_size)
+
+
+def remove_all_exact_duplicates(
+    sample_collection, batch_size=None, progress=None
+):
+    """
+    Deletes every sample of the collection that has an exact duplicate.
+
+    Only samples in the collection are deleted. The saved view is kept when
+    the collection is a view, so that the duplicates outside of it can still
+    be removed later.
+    """
     dataset = sample_collection._dataset
 
     if "exact_dup_view" not in dataset.list_saved_views():
         find_exact_duplicates(sample_collection)
 
-    exact_dup_view = dataset.load_saved_view("exact_dup_view")
-    dataset.delete_samples(exact_dup_view.values("id"))
+    exact_dup_view = load_scoped_view(sample_collection, "exact_dup_view")
+    delete_samples(
+        dataset,
+        exact_dup_view.values("id"),
+        batch_size=batch_size,
+        progress=progress,
+    )
 
     ## remove the saved view
-    dataset.delete_saved_view("exact_dup_view")
+    if is_whole_dataset(sample_collection):
+        dataset.delete_saved_view("exact_dup_view")
 
+    delete_group_index(dataset, GROUP_INDEX_NAME, field=COUNT_FIELD)
 
-def deduplicate_exact_duplicates(sample_collection):
+
+def deduplicate_exact_duplicates(
+    sample_collection, keep="first", batch_size=None, progress=None
+):
+    """
+    Deletes all but one sample of each group of exact duplicates in the
+    collection, chosen according to the ``keep`` policy.
+
+    Groups are restricted to the samples in the collection, so a sample is
+    kept from each group even if it has duplicates outside of it.
+    """
     dataset = sample_collection._dataset
 
     if "exact_dup_view" not in dataset.list_saved_views():
         find_exact_duplicates(sample_collection)
 
-    exact_dup_view = dataset.load_saved_view("exact_dup_view")
+    exact_dup_view = load_scoped_view(sample_collection, "exact_dup_view")
+
+    keep_ids, remove_ids = select_duplicates(
+        exact_dup_view, get_exact_duplicates_hash_field(dataset), keep=keep
+    )
+    delete_samples(
+        dataset, remove_ids, batch_size=batch_size, progress=progress
+    )
 
-    remove_sample_ids = []
-    for fh in exact_dup_view.values("filehash"):
-        hash_view = exact_dup_view.match(F("filehash") == fh)
-        ## keep the first sample in each group
-        keep_sample_id = hash_view.first().id
-        remove_sample_ids.extend(
-            [sample.id for sample in hash_view if sample.id != keep_sample_id]
+    ## the kept samples no longer have duplicates
+    for batch_ids in iter_batches(keep_ids, DEFAULT_BATCH_SIZE):
+        dataset.set_values(
+            COUNT_FIELD, {_id: None for _id in batch_ids}, key_field="id"
         )
-    dataset.delete_samples(remove_sample_ids)
 
-    dataset.delete_saved_view("exact_dup_view")
+    if is_whole_dataset(sample_collection):
+        dataset.delete_saved_view("exact_dup_view")
+
+    delete_group_index(dataset, GROUP_INDEX_NAME, field=COUNT_FIELD)
@@ -0,0 +1,169 @@
+import hashlib
+
+import fiftyone as fo
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+FILEHASH_METHODS = {
+    "md5": "MD5",
+    "blake2b": "BLAKE2b (64-bit)",
+    "xxh3": "xxHash3 (64-bit)",
+    "xxh64": "xxHash64",
+    "blake3": "BLAKE3 (64-bit)",
+}
+
+# methods whose digests are truncated to 64 bits and stored as integers
+_INTEGER_METHODS = ("blake2b", "xxh3", "xxh64", "blake3")
+
+
+def _is_available(method):
+    if method in ("xxh3", "xxh64"):
+        return xxhash is not None
+
+    if method == "blake3":
+        return blake3 is not None
+
+    return method in FILEHASH_METHODS
+
+
+def get_available_filehash_methods():
+    """
+    Returns the file hash methods that can be used in this environment.
+
+    ``xxh3`` and ``xxh64`` require the ``xxhash`` package, and ``blake3``
+    requires the ``blake3`` package.
+    """
+    return [m for m in FILEHASH_METHODS if _is_available(m)]
+
+
+def _validate_method(method):
+    if method not in FILEHASH_METHODS:
+        raise ValueError(
+            "Unsupported file hash method '%s'. Supported values are %s"
+            % (method, tuple(FILEHASH_METHODS))
+        )
+
+    if not _is_available(method):
+        package = "blake3" if method == "blake3" else "xxhash"
+        raise ImportError(
+            "The '%s' file hash method requires the '%s' package. Install "
+            "it via `pip install %s`" % (method, package, package)
+        )
+
+
+def _new_hasher(method):
+    if method == "xxh3":
+        return xxhash.xxh3_64()
+
+    if method == "xxh64":
+        return xxhash.xxh64()
+
+    if method == "blake3":
+        return blake3.blake3()
+
+    if method == "blake2b":
+        return hashlib.blake2b(digest_size=8)
+
+    return hashlib.new(method)
+
+
+def is_integer_method(method):
+    """
+    Returns whether hashes computed with the given method are stored as
+    signed 64-bit integers rather than hex strings.
+    """
+    return method in _INTEGER_METHODS
+
+
+def get_filehash_field_type(method):
+    """
+    Returns the field type in which hashes computed with the given method are
+    stored.
+    """
+    return fo.IntField if is_integer_method(method) else fo.StringField
+
+
+def parse_filehash(value, method):
+    """
+    Converts a hash that was serialized as a string, for example by the
+    persistent hash cache, back to the type of the given method.
+    """
+    if value is None or not is_integer_method(method):
+        return value
+
+    return int(value)
+
+
+class ChunkHasher(object):
+    """
+    Incrementally hashes byte strings with the given method, so that files
+    can be hashed as their contents arrive.
+
+    Args:
+        method ("md5"): the hash method
+    """
+
+    def __init__(self, method="md5"):
+        _validate_method(method)
+        self.method = method
+        self._hasher = _new_hasher(method)
+
+    def update(self, chunk):
+        self._hasher.update(chunk)
+
+    def result(self):
+        """
+        Returns a signed 64-bit integer for methods in which
+        :func:`is_integer_method` is True, and a hex string otherwise.
+        """
+        digest = self._hasher.digest()
+        if is_integer_method(self.method):
+            return int.from_bytes(digest[:8], "big", signed=True)
+
+        return digest.hex()
+
+
+def hash_chunks(chunks, method="md5"):
+    """
+    Hashes the given iterable of byte strings with the given method.
+
+    Returns a signed 64-bit integer for methods in which
+    :func:`is_integer_method` is True, and a hex string otherwise.
+    """
+    hasher = ChunkHasher(method)
+    for chunk in chunks:
+        hasher.update(chunk)
+
+    return hasher.result()
+
+
+def iter_file_chunks(filepath, chunk_size=None):
+    """
+    Yields the contents of the given file in chunks of ``chunk_size`` bytes.
+    """
+    if chunk_size is None:
+        chunk_size = DEFAULT_CHUNK_SIZE
+
+    with open(filepath, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+
+            yield chunk
+
+
+def hash_file(filepath, method="md5", chunk_size=None):
+    """
+    Hashes the contents of the given file with the given method.
+    """
+    return hash_chunks(iter_file_chunks(filepath, chunk_size), method=method)
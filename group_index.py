@@ -0,0 +1,268 @@
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+
+from hash_cache import get_default_cache_path
+
+SORT_BY_CHOICES = ("size", "max_distance")
+METADATA_FILENAME = "metadata.json"
+GROUP_INDEX_INFO_KEY = "group_index"
+_ARRAYS = (
+    "keys",
+    "sizes",
+    "max_dists",
+    "offsets",
+    "member_ids",
+    "size_order",
+    "max_distance_order",
+)
+
+
+def get_group_index_path(dataset, name):
+    """
+    Returns the directory of the group index with the given name for the
+    dataset.
+    """
+    return os.path.join(
+        os.path.dirname(get_default_cache_path()),
+        "groups",
+        str(dataset._doc.id),
+        name,
+    )
+
+
+def _get_index_info(dataset, field):
+    field = dataset.get_field(field)
+    if field is None:
+        return None
+
+    return (field.info or {}).get(GROUP_INDEX_INFO_KEY, None)
+
+
+def _set_index_info(dataset, field, index_info):
+    field = dataset.get_field(field)
+    if field is None:
+        return
+
+    info = dict(field.info or {})
+    if index_info is None:
+        if GROUP_INDEX_INFO_KEY not in info:
+            return
+
+        info.pop(GROUP_INDEX_INFO_KEY)
+    else:
+        info[GROUP_INDEX_INFO_KEY] = index_info
+
+    field.info = info
+    field.save()
+
+
+def delete_group_index(dataset, name, field=None):
+    """
+    Deletes the group index with the given name for the dataset, if any.
+
+    If ``field`` is provided, the run key of the index is also removed from
+    its info, so that the indexes of this run on other machines are rebuilt
+    too.
+    """
+    shutil.rmtree(get_group_index_path(dataset, name), ignore_errors=True)
+    if field is not None:
+        _set_index_info(dataset, field, None)
+
+
+def _get_arrays(keys, sizes, max_dists, member_ids):
+    arrays = {
+        "keys": keys,
+        "sizes": sizes,
+        "max_dists": max_dists,
+        "offsets": np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64),
+        "member_ids": member_ids,
+        "size_order": np.argsort(-sizes, kind="stable"),
+    }
+
+    ## groups without a known distance are served last
+    arrays["max_distance_order"] = np.argsort(
+        -np.nan_to_num(max_dists, nan=-np.inf), kind="stable"
+    )
+
+    return arrays
+
+
+class GroupIndex(object):
+    """
+    Compact, memory-mapped index of the duplicate groups of a dataset.
+
+    The members of each group are stored contiguously, and the orderings of
+    the groups by size and by maximum distance are precomputed, so that
+    serving any page of groups only reads that page's entries.
+
+    Args:
+        path: the directory containing the index
+    """
+
+    def __init__(self, path):
+        self.path = path
+        for name in _ARRAYS:
+            array = np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+            setattr(self, name, array)
+
+        metadata_path = os.path.join(path, METADATA_FILENAME)
+        if os.path.isfile(metadata_path):
+            with open(metadata_path) as f:
+                self.key = json.load(f).get("key", None)
+        else:
+            self.key = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def build(cls, path, ids, keys, dists=None, key=None):
+        """
+        Writes an index of the groups defined by the given sample IDs and
+        their group keys to ``path`` and returns it.
+
+        Args:
+            path: the directory in which to write the index
+            ids: an iterable of sample IDs
+            keys: an iterable of the group key of each sample
+            dists (None): an optional iterable of the maximum distance within
+                each sample's group
+            key (None): an optional string identifying the run that wrote
+                the index
+        """
+        ids = np.asarray(list(ids), dtype=str)
+        keys = np.asarray(list(keys), dtype=str)
+        if dists is None:
+            dists = np.full(len(ids), np.nan)
+        else:
+            dists = np.asarray(list(dists), dtype=np.float64)
+
+        order = np.argsort(keys, kind="stable")
+        group_keys, starts, sizes = np.unique(
+            keys[order], return_index=True, return_counts=True
+        )
+        arrays = _get_arrays(
+            group_keys, sizes, dists[order][starts], ids[order]
+        )
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        for name in _ARRAYS:
+            np.save(os.path.join(path, name + ".npy"), arrays[name])
+
+        with open(os.path.join(path, METADATA_FILENAME), "w") as f:
+            json.dump({"key": key}, f)
+
+        return cls(path)
+
+    def restrict(self, sample_ids):
+        """
+        Returns an in-memory index of the groups restricted to the members
+        with the given sample IDs, omitting the groups that have fewer than
+        two of them.
+        """
+        member_ids = np.asarray(self.member_ids)
+        keep = np.isin(member_ids, np.asarray(list(sample_ids), dtype=str))
+        sizes = np.zeros(len(self), dtype=np.int64)
+        if len(self):
+            sizes = np.add.reduceat(keep.astype(np.int64), self.offsets[:-1])
+
+        groups = sizes >= 2
+        keep &= np.repeat(groups, self.sizes)
+        arrays = _get_arrays(
+            np.asarray(self.keys)[groups],
+            sizes[groups],
+            np.asarray(self.max_dists)[groups],
+            member_ids[keep],
+        )
+
+        index = self.__class__.__new__(self.__class__)
+        index.path = None
+        index.key = None
+        for name in _ARRAYS:
+            setattr(index, name, arrays[name])
+
+        return index
+
+    def num_pages(self, page_size):
+        """
+        Returns the number of pages of ``page_size`` groups.
+        """
+        return -(-len(self) // page_size)
+
+    def get_page(self, page, page_size, sort_by="size"):
+        """
+        Returns the ``(keys, ids)`` of the groups on the given zero-based page
+        and the IDs of their members, in order.
+        """
+        if sort_by not in SORT_BY_CHOICES:
+            raise ValueError(
+                "Unsupported sort_by '%s'. Supported values are %s"
+                % (sort_by, SORT_BY_CHOICES)
+            )
+
+        order = getattr(self, sort_by + "_order")
+        inds = order[page * page_size : (page + 1) * page_size]
+
+        keys, ids = [], []
+        for ind in inds.tolist():
+            keys.append(str(self.keys[ind]))
+            start, end = self.offsets[ind], self.offsets[ind + 1]
+            ids.extend(self.member_ids[start:end].tolist())
+
+        return keys, ids
+
+
+def build_group_index(dataset, name, field, ids, keys, dists=None):
+    """
+    Builds the group index with the given name for the dataset from the given
+    sample IDs and group keys, as in :meth:`GroupIndex.build`.
+
+    A new run key and the number of indexed samples are recorded in the info
+    of ``field``, which must exist for every indexed sample, so that
+    :func:`load_group_index` can detect when the groups have changed since.
+    """
+    key = uuid.uuid4().hex
+    index = GroupIndex.build(
+        get_group_index_path(dataset, name), ids, keys, dists=dists, key=key
+    )
+    _set_index_info(
+        dataset, field, {"key": key, "num_samples": len(index.member_ids)}
+    )
+    return index
+
+
+def load_group_index(sample_collection, name, field, marker_field=None):
+    """
+    Loads the group index with the given name for the collection's dataset,
+    building it from the values of ``field`` in the collection if it does not
+    exist.
+
+    Only samples for which ``marker_field`` (``field`` by default) exists are
+    indexed. An existing index is rebuilt if its run key differs from the one
+    recorded in the info of ``marker_field``, which happens when the groups
+    were found again on another machine, or if the number of samples with
+    ``marker_field`` changed since it was built.
+    """
+    if marker_field is None:
+        marker_field = field
+
+    dataset = sample_collection._dataset
+    view = sample_collection.exists(marker_field)
+    path = get_group_index_path(dataset, name)
+    info = _get_index_info(dataset, marker_field)
+    if (
+        info is not None
+        and os.path.isfile(os.path.join(path, METADATA_FILENAME))
+        and info["num_samples"] == view.count()
+    ):
+        index = GroupIndex(path)
+        if index.key == info["key"]:
+            return index
+
+    ids, keys = view.values(["id", field])
+    return build_group_index(dataset, name, marker_field, ids, keys)
@@ -0,0 +1,510 @@
+from itertools import combinations
+import json
+from math import comb
+import os
+import shutil
+
+import numpy as np
+
+HASH_BITS = 64
+MAX_NUM_CHUNKS = 16
+DEFAULT_QUERY_BATCH_SIZE = 1 << 20
+MAX_TABLE_BITS = 24
+METADATA_FILENAME = "metadata.json"
+
+_POPCOUNT_TABLE = np.array(
+    [bin(i).count("1") for i in range(256)], dtype=np.uint8
+)
+
+
+def popcount(values):
+    """
+    Returns the number of set bits in each element of a ``uint64`` array.
+    """
+    values = np.ascontiguousarray(values, dtype=np.uint64)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+
+    bytes_ = values.view(np.uint8).reshape(values.shape + (8,))
+    return _POPCOUNT_TABLE[bytes_].sum(axis=-1, dtype=np.uint8)
+
+
+def _chunk_widths(num_chunks):
+    base, extra = divmod(HASH_BITS, num_chunks)
+    return [base + 1 if c < extra else base for c in range(num_chunks)]
+
+
+def _num_masks(width, radius):
+    return sum(comb(width, k) for k in range(radius + 1))
+
+
+def _choose_num_chunks(num_values, max_distance):
+    # estimated work per query: the number of flip masks probed in each
+    # chunk times the expected number of candidates each probe returns
+    best_cost, best_num_chunks = None, 1
+    for num_chunks in range(1, MAX_NUM_CHUNKS + 1):
+        radius = max_distance // num_chunks
+        cost = 0
+        for width in _chunk_widths(num_chunks):
+            cost += _num_masks(width, radius) * (1 + num_values / 2.0**width)
+
+        if best_cost is None or cost < best_cost:
+            best_cost, best_num_chunks = cost, num_chunks
+
+    return best_num_chunks
+
+
+def _flip_masks(width, radius):
+    masks = []
+    for k in range(radius + 1):
+        for bits in combinations(range(width), k):
+            masks.append(sum(1 << b for b in bits))
+
+    return np.array(masks, dtype=np.uint64)
+
+
+def _expand_ranges(queries, lo, hi):
+    counts = hi - lo
+    total = int(counts.sum())
+    starts = np.cumsum(counts) - counts
+    rows = np.repeat(queries, counts)
+    cols = np.repeat(lo, counts) + (
+        np.arange(total) - np.repeat(starts, counts)
+    )
+    return rows, cols
+
+
+def _probe(table, width, targets):
+    if width <= MAX_TABLE_BITS:
+        targets = targets.astype(np.int64)
+        return table[targets], table[targets + 1]
+
+    lo = np.searchsorted(table, targets, side="left")
+    hi = np.searchsorted(table, targets, side="right")
+    return lo, hi
+
+
+class HammingIndex(object):
+    """
+    Multi-index hashing index for finding all pairs of 64-bit hashes within a
+    Hamming radius.
+
+    The hashes are split into ``num_chunks`` substrings. By the pigeonhole
+    principle, two hashes within distance ``max_distance`` differ in at most
+    ``max_distance // num_chunks`` bits of at least one substring, so
+    candidates are found by probing sorted substring tables with a small set
+    of flip masks, and then verified with a vectorized popcount.
+
+    Identical hashes are collapsed before searching, so that large groups of
+    exact duplicates do not produce a quadratic number of pairs.
+
+    Args:
+        hashes: a ``uint64`` array of hashes
+        max_distance: the maximum Hamming distance of the pairs to find
+        num_chunks (None): an optional number of substrings to use. By
+            default, this is chosen based on the number of hashes
+    """
+
+    def __init__(self, hashes, max_distance, num_chunks=None):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        values, first_inds, inverse = np.unique(
+            hashes, return_index=True, return_inverse=True
+        )
+
+        if num_chunks is None:
+            num_chunks = _choose_num_chunks(len(values), max_distance)
+
+        self.hashes = hashes
+        self.max_distance = max_distance
+        self.num_chunks = num_chunks
+        self._values = values
+        self._first_inds = first_inds
+        self._inverse = inverse.ravel()
+
+        self._chunks = []
+        shift = 0
+        for width in _chunk_widths(num_chunks):
+            keys = (values >> np.uint64(shift)) & np.uint64((1 << width) - 1)
+            order = np.argsort(keys, kind="stable")
+            if width <= MAX_TABLE_BITS:
+                ## bucket offsets, so that probes are direct lookups
+                counts = np.bincount(
+                    keys.astype(np.int64), minlength=1 << width
+                )
+                table = np.concatenate([[0], np.cumsum(counts)])
+            else:
+                table = keys[order]
+
+            self._chunks.append((shift, width, keys, order, table))
+            shift += width
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def save(self, path):
+        """
+        Writes the index, including its substring tables, to the directory
+        ``path``, so that it can be loaded by :meth:`load` without rebuilding
+        the tables.
+        """
+        arrays = {
+            "hashes": self.hashes,
+            "values": self._values,
+            "first_inds": self._first_inds,
+            "inverse": self._inverse,
+        }
+        for c, (_, _, keys, order, table) in enumerate(self._chunks):
+            arrays["keys%d" % c] = keys
+            arrays["order%d" % c] = order
+            arrays["table%d" % c] = table
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        for name, array in arrays.items():
+            np.save(os.path.join(path, name + ".npy"), array)
+
+        metadata = {
+            "max_distance": self.max_distance,
+            "num_chunks": self.num_chunks,
+        }
+        with open(os.path.join(path, METADATA_FILENAME), "w") as f:
+            json.dump(metadata, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Loads the index saved in the directory ``path``, memory-mapping its
+        arrays by default.
+        """
+        mmap_mode = "r" if mmap else None
+
+        def _load(name):
+            return np.load(
+                os.path.join(path, name + ".npy"), mmap_mode=mmap_mode
+            )
+
+        with open(os.path.join(path, METADATA_FILENAME)) as f:
+            metadata = json.load(f)
+
+        index = cls.__new__(cls)
+        index.hashes = _load("hashes")
+        index.max_distance = metadata["max_distance"]
+        index.num_chunks = metadata["num_chunks"]
+        index._values = _load("values")
+        index._first_inds = _load("first_inds")
+        index._inverse = _load("inverse")
+
+        index._chunks = []
+        shift = 0
+        for c, width in enumerate(_chunk_widths(index.num_chunks)):
+            chunk = (_load("keys%d" % c), _load("order%d" % c))
+            index._chunks.append((shift, width, *chunk, _load("table%d" % c)))
+            shift += width
+
+        return index
+
+    def _chunk_distances(self, inds1, inds2, shift, width):
+        diff = self._values[inds1] ^ self._values[inds2]
+        diff = (diff >> np.uint64(shift)) & np.uint64((1 << width) - 1)
+        return popcount(diff)
+
+    def _iter_value_pairs(self, batch_size):
+        num_values = len(self._values)
+        radius = self.max_distance // self.num_chunks
+
+        for c, (shift, width, keys, order, table) in enumerate(self._chunks):
+            masks = _flip_masks(width, radius)
+            for start in range(0, num_values, batch_size):
+                queries = np.arange(start, min(start + batch_size, num_values))
+                query_keys = keys[queries]
+                for mask in masks:
+                    lo, hi = _probe(table, width, query_keys ^ mask)
+                    inds1, cols = _expand_ranges(queries, lo, hi)
+                    inds2 = order[cols]
+
+                    keep = inds1 < inds2
+                    inds1, inds2 = inds1[keep], inds2[keep]
+
+                    ## skip pairs that an earlier chunk already reported
+                    for prev_shift, prev_width, _, _, _ in self._chunks[:c]:
+                        prev_dists = self._chunk_distances(
+                            inds1, inds2, prev_shift, prev_width
+                        )
+                        keep = prev_dists > radius
+                        inds1, inds2 = inds1[keep], inds2[keep]
+
+                    dists = popcount(self._values[inds1] ^ self._values[inds2])
+                    keep = dists <= self.max_distance
+                    if keep.any():
+                        yield inds1[keep], inds2[keep], dists[keep]
+
+    def iter_pairs(self, batch_size=None):
+        """
+        Yields ``(inds1, inds2, dists)`` arrays of hash index pairs within
+        ``max_distance`` of each other, with ``inds1 < inds2``.
+
+        Every pair of distinct hash values within the radius is reported once,
+        between the first occurrences of each value. Every other occurrence
+        of a value is linked to its first occurrence with distance 0.
+        """
+        if batch_size is None:
+            batch_size = DEFAULT_QUERY_BATCH_SIZE
+
+        ## link repeated hashes to their first occurrence
+        inds = np.arange(len(self.hashes))
+        firsts = self._first_inds[self._inverse]
+        repeated = inds != firsts
+        if repeated.any():
+            yield (
+                firsts[repeated],
+                inds[repeated],
+                np.zeros(int(repeated.sum()), dtype=np.uint8),
+            )
+
+        for inds1, inds2, dists in self._iter_value_pairs(batch_size):
+            inds1 = self._first_inds[inds1]
+            inds2 = self._first_inds[inds2]
+            swap = inds1 > inds2
+            inds1, inds2 = np.where(swap, inds2, inds1), np.where(
+                swap, inds1, inds2
+            )
+            yield inds1, inds2, dists
+
+    def query(self, queries, batch_size=None, max_distance=None):
+        """
+        Returns ``(query_inds, inds, dists)`` arrays of all pairs of the given
+        ``uint64`` query hashes and indexed hashes within ``max_distance`` of
+        each other, which defaults to, and cannot exceed, the
+        ``max_distance`` of the index.
+
+        Indexed hashes are reported by the first occurrence of their value.
+        """
+        if batch_size is None:
+            batch_size = DEFAULT_QUERY_BATCH_SIZE
+
+        if max_distance is None:
+            max_distance = self.max_distance
+        elif max_distance > self.max_distance:
+            raise ValueError(
+                "Cannot query distance %d from an index built for distance %d"
+                % (max_distance, self.max_distance)
+            )
+
+        queries = np.asarray(queries, dtype=np.uint64)
+        radius = self.max_distance // self.num_chunks
+
+        empty = np.zeros(0, dtype=np.int64)
+        rows, cols = [empty], [empty]
+        for shift, width, _, order, table in self._chunks:
+            masks = _flip_masks(width, radius)
+            query_keys = (queries >> np.uint64(shift)) & np.uint64(
+                (1 << width) - 1
+            )
+            for start in range(0, len(queries), batch_size):
+                inds = np.arange(start, min(start + batch_size, len(queries)))
+                for mask in masks:
+                    lo, hi = _probe(table, width, query_keys[inds] ^ mask)
+                    query_inds, value_cols = _expand_ranges(inds, lo, hi)
+                    value_inds = order[value_cols]
+                    dists = popcount(
+                        queries[query_inds] ^ self._values[value_inds]
+                    )
+                    keep = dists <= max_distance
+                    rows.append(query_inds[keep])
+                    cols.append(value_inds[keep])
+
+        ## a pair may be found in several chunks
+        keys = np.unique(
+            np.concatenate(rows) * len(self._values) + np.concatenate(cols)
+        )
+        query_inds, value_inds = np.divmod(keys, len(self._values))
+        dists = popcount(queries[query_inds] ^ self._values[value_inds])
+        return query_inds, self._first_inds[value_inds], dists
+
+    def find_shard_pairs(self, inds, batch_size=None):
+        """
+        Returns ``(inds1, inds2, dists)`` arrays of the pairs yielded by
+        :meth:`iter_pairs` that belong to the given hash indices.
+
+        A pair of distinct values belongs to the first occurrence of its
+        smaller index, and a repeated hash's link to its first occurrence
+        belongs to the repeated hash, so that the pairs of disjoint sets of
+        indices can be searched independently, without any being reported
+        twice.
+        """
+        inds = np.asarray(inds, dtype=np.int64)
+        firsts = self._first_inds[self._inverse[inds]]
+        repeated = inds != firsts
+
+        queries = inds[~repeated]
+        query_inds, inds2, dists = self.query(
+            self.hashes[queries], batch_size=batch_size
+        )
+        inds1 = queries[query_inds]
+        keep = inds1 < inds2
+
+        return (
+            np.concatenate([firsts[repeated], inds1[keep]]),
+            np.concatenate([inds[repeated], inds2[keep]]),
+            np.concatenate(
+                [np.zeros(int(repeated.sum()), dtype=np.uint8), dists[keep]]
+            ),
+        )
+
+    def find_pairs(self, batch_size=None):
+        """
+        Returns ``(inds1, inds2, dists)`` arrays containing all pairs yielded
+        by :meth:`iter_pairs`.
+        """
+        inds1, inds2, dists = [], [], []
+        for i, j, d in self.iter_pairs(batch_size=batch_size):
+            inds1.append(i)
+            inds2.append(j)
+            dists.append(d)
+
+        if not inds1:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, np.zeros(0, dtype=np.uint8)
+
+        return (
+            np.concatenate(inds1),
+            np.concatenate(inds2),
+            np.concatenate(dists),
+        )
+
+
+class HammingIndexStore(object):
+    """
+    Persistent Hamming index of hashes identified by IDs, to which hashes
+    can be added without rebuilding the whole index.
+
+    The hashes are stored in segments, each a saved :class:`HammingIndex`.
+    Added hashes form a new segment, which is merged with the most recent
+    segments while they are no more than twice its size, so that each hash
+    is reindexed a logarithmic number of times and a query only probes a
+    logarithmic number of segments.
+
+    Args:
+        path: the directory containing the store
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, METADATA_FILENAME)) as f:
+            self.metadata = json.load(f)
+
+        self.path = path
+        self._segments = []
+        for segment in self.metadata["segments"]:
+            segment_path = os.path.join(path, segment["name"])
+            self._segments.append(
+                (
+                    np.load(
+                        os.path.join(segment_path, "ids.npy"), mmap_mode="r"
+                    ),
+                    HammingIndex.load(segment_path),
+                )
+            )
+
+    def __len__(self):
+        return sum(s["size"] for s in self.metadata["segments"])
+
+    @property
+    def max_distance(self):
+        return self.metadata["max_distance"]
+
+    @classmethod
+    def create(cls, path, max_distance, ids=None, hashes=None):
+        """
+        Creates a store in ``path`` for queries up to ``max_distance``,
+        optionally containing the given hashes, and returns it.
+        """
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        metadata = {"max_distance": max_distance, "segments": [], "count": 0}
+        _write_metadata(path, metadata)
+
+        store = cls(path)
+        if ids is not None and len(ids) > 0:
+            store.add(ids, hashes)
+
+        return store
+
+    def query(self, hashes, max_distance=None):
+        """
+        Returns ``(query_inds, ids, dists)`` arrays of all pairs of the given
+        ``uint64`` query hashes and stored hashes within ``max_distance`` of
+        each other. Stored hashes with the same value as an earlier stored
+        hash of their segment are not reported.
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        query_inds, ids, dists = [], [], []
+        for segment_ids, index in self._segments:
+            q, inds, d = index.query(hashes, max_distance=max_distance)
+            query_inds.append(q)
+            ids.append(np.asarray(segment_ids[inds]))
+            dists.append(d)
+
+        if not query_inds:
+            return (
+                np.zeros(0, dtype=np.int64),
+                np.zeros(0, dtype=str),
+                np.zeros(0, dtype=np.uint8),
+            )
+
+        return (
+            np.concatenate(query_inds),
+            np.concatenate(ids),
+            np.concatenate(dists),
+        )
+
+    def add(self, ids, hashes):
+        """
+        Adds the given hashes, identified by the given IDs, to the store.
+        """
+        ids = np.asarray(ids, dtype=str)
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        if len(ids) == 0:
+            return
+
+        segments = list(self.metadata["segments"])
+        merged_ids, merged_hashes = [ids], [hashes]
+        while segments and segments[-1]["size"] <= 2 * sum(
+            map(len, merged_ids)
+        ):
+            segment_ids, index = self._segments.pop()
+            merged_ids.insert(0, np.asarray(segment_ids))
+            merged_hashes.insert(0, np.asarray(index.hashes))
+            segments.pop()
+
+        ids = np.concatenate(merged_ids)
+        hashes = np.concatenate(merged_hashes)
+        name = "segment%d" % self.metadata["count"]
+        segment_path = os.path.join(self.path, name)
+        index = HammingIndex(hashes, self.max_distance)
+        index.save(segment_path)
+        np.save(os.path.join(segment_path, "ids.npy"), ids)
+
+        prev_names = [s["name"] for s in self.metadata["segments"]]
+        segments.append({"name": name, "size": len(ids)})
+        self.metadata = dict(
+            self.metadata, segments=segments, count=self.metadata["count"] + 1
+        )
+        _write_metadata(self.path, self.metadata)
+        self._segments.append((ids, index))
+
+        ## merged segments are only deleted once the metadata no longer
+        ## refers to them
+        names = set(s["name"] for s in segments)
+        for prev_name in prev_names:
+            if prev_name not in names:
+                shutil.rmtree(
+                    os.path.join(self.path, prev_name), ignore_errors=True
+                )
+
+
+def _write_metadata(path, metadata):
+    tmp_path = os.path.join(path, METADATA_FILENAME + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(metadata, f)
+
+    os.replace(tmp_path, os.path.join(path, METADATA_FILENAME))
@@ -0,0 +1,184 @@
+import os
+import sqlite3
+import time
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.expanduser("~"), ".fiftyone", "dedup", "filehash_cache.db"
+)
+DEFAULT_MAX_ENTRIES = 5000000
+
+
+def get_default_cache_path():
+    """
+    Returns the path to the persistent file hash cache, which can be
+    customized via the ``FIFTYONE_DEDUP_CACHE_PATH`` environment variable.
+    """
+    return os.environ.get("FIFTYONE_DEDUP_CACHE_PATH", DEFAULT_CACHE_PATH)
+
+
+def get_file_identity(filepath):
+    """
+    Returns the ``(size, mtime, inode)`` of the given file.
+    """
+    stat = os.stat(filepath)
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+class FileHashCache(object):
+    """
+    Persistent SQLite cache of file hashes keyed by filesystem identity.
+
+    An entry is only returned when the path, size, modification time and
+    inode of the file all match the values recorded when it was hashed, so
+    modified or replaced files are always rehashed. When the cache grows
+    beyond ``max_entries``, the least recently used entries are evicted.
+
+    Args:
+        path (None): the path to the cache database. By default,
+            :func:`get_default_cache_path` is used
+        max_entries (None): the maximum number of entries to keep
+    """
+
+    def __init__(self, path=None, max_entries=None):
+        if path is None:
+            path = get_default_cache_path()
+
+        if max_entries is None:
+            max_entries = DEFAULT_MAX_ENTRIES
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self.path = path
+        self.max_entries = max_entries
+        self._conn = sqlite3.connect(path, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS filehashes ("
+            "path TEXT NOT NULL, "
+            "method TEXT NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "mtime INTEGER NOT NULL, "
+            "inode INTEGER NOT NULL, "
+            "filehash TEXT NOT NULL, "
+            "last_used REAL NOT NULL, "
+            "PRIMARY KEY (path, method))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS last_used_idx "
+            "ON filehashes (last_used)"
+        )
+        self._conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self._conn.execute(
+            "SELECT COUNT(*) FROM filehashes"
+        ).fetchone()[0]
+
+    def close(self):
+        self._conn.close()
+
+    def get_many(self, filepaths, identities, method):
+        """
+        Returns a list containing the cached hash of each file, or None if the
+        file is not in the cache or has changed since it was hashed.
+        """
+        results = []
+        hits = []
+        for filepath, (size, mtime, inode) in zip(filepaths, identities):
+            row = self._conn.execute(
+                "SELECT filehash FROM filehashes WHERE path = ? "
+                "AND method = ? AND size = ? AND mtime = ? AND inode = ?",
+                (filepath, method, size, mtime, inode),
+            ).fetchone()
+            if row is None:
+                results.append(None)
+            else:
+                results.append(row[0])
+                hits.append((filepath, method))
+
+        if hits:
+            now = time.time()
+            self._conn.executemany(
+                "UPDATE filehashes SET last_used = ? "
+                "WHERE path = ? AND method = ?",
+                [(now, filepath, method) for filepath, method in hits],
+            )
+            self._conn.commit()
+
+        return results
+
+    def put_many(self, filepaths, identities, filehashes, method):
+        """
+        Adds the given file hashes to the cache, evicting the least recently
+        used entries if necessary.
+        """
+        now = time.time()
+        rows = [
+            (filepath, method, size, mtime, inode, str(filehash), now)
+            for filepath, (size, mtime, inode), filehash in zip(
+                filepaths, identities, filehashes
+            )
+        ]
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO filehashes "
+            "(path, method, size, mtime, inode, filehash, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        self._conn.commit()
+        self.evict()
+
+    def evict(self):
+        """
+        Evicts the least recently used entries until at most ``max_entries``
+        remain.
+
+        Returns the number of evicted entries.
+        """
+        num_excess = len(self) - self.max_entries
+        if num_excess <= 0:
+            return 0
+
+        self._conn.execute(
+            "DELETE FROM filehashes WHERE rowid IN (SELECT rowid FROM "
+            "filehashes ORDER BY last_used LIMIT ?)",
+            (num_excess,),
+        )
+        self._conn.commit()
+        return num_excess
+
+    def prune(self, batch_size=10000):
+        """
+        Removes entries whose files no longer exist or have changed since they
+        were hashed, and evicts entries beyond ``max_entries``.
+
+        Returns the number of removed entries.
+        """
+        stale = []
+        cursor = self._conn.execute(
+            "SELECT rowid, path, size, mtime, inode FROM filehashes"
+        )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+
+            for rowid, filepath, size, mtime, inode in rows:
+                try:
+                    identity = get_file_identity(filepath)
+                except OSError:
+                    identity = None
+
+                if identity != (size, mtime, inode):
+                    stale.append((rowid,))
+
+        self._conn.executemany("DELETE FROM filehashes WHERE rowid = ?", stale)
+        self._conn.commit()
+
+        return len(stale) + self.evict()
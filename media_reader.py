@@ -0,0 +1,173 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import threading
+import urllib.request
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+DEFAULT_MAX_IN_FLIGHT = 64
+DEFAULT_READ_SIZE = 256 * 1024
+
+
+def is_url(path):
+    """
+    Returns whether the given path is an HTTP(S) URL.
+    """
+    return path.startswith(("http://", "https://"))
+
+
+class AsyncMediaReader(object):
+    """
+    Reads media on an asyncio event loop in a background thread, keeping up
+    to ``max_in_flight`` reads in flight, and streams the contents of each
+    file into a consumer as they arrive, so whole files are never buffered.
+
+    HTTP(S) URLs are read via a single ``aiohttp`` session that reuses its
+    connections across reads when ``aiohttp`` is installed, and via
+    ``urllib`` otherwise. Other paths, including those on network
+    filesystems, are read in a thread pool.
+
+    Args:
+        max_in_flight (None): the maximum number of concurrent reads
+        chunk_size (None): the number of bytes to read at a time
+    """
+
+    def __init__(self, max_in_flight=None, chunk_size=None):
+        if max_in_flight is None:
+            max_in_flight = DEFAULT_MAX_IN_FLIGHT
+
+        if chunk_size is None:
+            chunk_size = DEFAULT_READ_SIZE
+
+        self.max_in_flight = max(max_in_flight, 1)
+        self.chunk_size = chunk_size
+
+        self._loop = None
+        self._thread = None
+        self._executor = None
+        self._session = None
+
+    def __enter__(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        asyncio.run_coroutine_threadsafe(self._close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._executor.shutdown()
+
+    def map(self, consumer_cls, filepaths):
+        """
+        Reads the given files and yields a ``(result, num_bytes)`` tuple for
+        each of them, in order.
+
+        A consumer is created for each file by calling ``consumer_cls()``.
+        The chunks of the file are passed to its ``update(chunk)`` method in
+        order, and its ``result()`` method is called after the last chunk.
+        Both are called in worker threads, so hashing and decoding do not
+        block the reads of other files.
+        """
+        pending = deque()
+        try:
+            for filepath in filepaths:
+                if len(pending) >= self.max_in_flight:
+                    yield pending.popleft().result()
+
+                coro = self._read(filepath, consumer_cls())
+                pending.append(
+                    asyncio.run_coroutine_threadsafe(coro, self._loop)
+                )
+
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    async def _close(self):
+        ## reads that were abandoned must release their files and
+        ## connections before the loop stops
+        tasks = asyncio.all_tasks() - {asyncio.current_task()}
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _run(self, fn, *args):
+        return self._loop.run_in_executor(self._executor, fn, *args)
+
+    async def _read(self, filepath, consumer):
+        if not is_url(filepath):
+            chunks = self._iter_blocking_chunks(partial(open, filepath, "rb"))
+        elif aiohttp is not None:
+            chunks = self._iter_http_chunks(filepath)
+        else:
+            chunks = self._iter_blocking_chunks(
+                partial(urllib.request.urlopen, filepath)
+            )
+
+        num_bytes = 0
+        try:
+            async for chunk in chunks:
+                await self._run(consumer.update, chunk)
+                num_bytes += len(chunk)
+        finally:
+            await chunks.aclose()
+
+        return await self._run(consumer.result), num_bytes
+
+    async def _iter_blocking_chunks(self, open_fn):
+        f = await self._run(open_fn)
+        try:
+            while True:
+                chunk = await self._run(f.read, self.chunk_size)
+                if not chunk:
+                    return
+
+                yield chunk
+        finally:
+            await self._run(f.close)
+
+    async def _get_session(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_in_flight)
+            self._session = aiohttp.ClientSession(connector=connector)
+
+        return self._session
+
+    async def _iter_http_chunks(self, url):
+        session = await self._get_session()
+        async with session.get(url) as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(self.chunk_size):
+                yield chunk
+
+
+def map_prefetched(
+    consumer_cls, filepaths, max_in_flight=None, chunk_size=None
+):
+    """
+    Streams the given files into consumers created by ``consumer_cls()``
+    with an :class:`AsyncMediaReader`, yielding a ``(result, num_bytes)``
+    tuple for each file, in order.
+    """
+    with AsyncMediaReader(
+        max_in_flight=max_in_flight, chunk_size=chunk_size
+    ) as reader:
+        yield from reader.map(consumer_cls, filepaths)
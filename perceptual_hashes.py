@@ -0,0 +1,178 @@
+from functools import partial
+import io
+
+import numpy as np
+from PIL import Image
+
+import fiftyone as fo
+
+from dedup_utils import (
+    DEFAULT_BATCH_SIZE,
+    get_ids_and_filepaths,
+    iter_batches,
+    map_parallel,
+)
+from media_reader import map_prefetched
+from sharding import iter_sharded
+
+HASH_SIZE = 8
+PHASH_METHODS = ("phash", "dhash", "ahash")
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    return np.cos(np.pi * (2 * x + 1) * k / (2 * n))
+
+
+_PHASH_SIZE = 4 * HASH_SIZE
+_DCT = _dct_matrix(_PHASH_SIZE)
+
+
+def _load_grayscale(filepath, size):
+    with Image.open(filepath) as img:
+        ## lets JPEG decoders produce a reduced-size image directly
+        img.draft("L", (2 * size[0], 2 * size[1]))
+        img = img.convert("L").resize(size, Image.Resampling.BILINEAR)
+        return np.asarray(img, dtype=np.float32)
+
+
+def _ahash_bits(filepath):
+    pixels = _load_grayscale(filepath, (HASH_SIZE, HASH_SIZE))
+    return pixels > pixels.mean()
+
+
+def _dhash_bits(filepath):
+    pixels = _load_grayscale(filepath, (HASH_SIZE + 1, HASH_SIZE))
+    return pixels[:, 1:] > pixels[:, :-1]
+
+
+def _phash_bits(filepath):
+    pixels = _load_grayscale(filepath, (_PHASH_SIZE, _PHASH_SIZE))
+    dct = _DCT @ pixels @ _DCT.T
+    lowfreq = dct[:HASH_SIZE, :HASH_SIZE]
+    return lowfreq > np.median(lowfreq)
+
+
+_HASH_FCNS = {
+    "phash": _phash_bits,
+    "dhash": _dhash_bits,
+    "ahash": _ahash_bits,
+}
+
+
+def to_signed(value):
+    """
+    Converts an unsigned 64-bit hash into the signed 64-bit integer that is
+    stored in the database.
+    """
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def to_unsigned_array(values):
+    """
+    Converts a list of stored signed 64-bit hashes to a ``uint64`` array.
+    """
+    return np.asarray(values, dtype=np.int64).view(np.uint64)
+
+
+def compute_image_hash(filepath, method="phash"):
+    """
+    Computes the 64-bit perceptual hash of the given image as a signed
+    integer.
+    """
+    bits = _HASH_FCNS[method](filepath)
+    value = int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+    return to_signed(value)
+
+
+class _ImageHasher(object):
+    def __init__(self, method):
+        self.method = method
+
+    def __call__(self, filepath):
+        return compute_image_hash(filepath, method=self.method)
+
+
+class _StreamedImageHasher(object):
+    def __init__(self, method):
+        self.method = method
+        self._buffer = io.BytesIO()
+
+    def update(self, chunk):
+        ## images can only be decoded once all of their bytes have arrived
+        self._buffer.write(chunk)
+
+    def result(self):
+        self._buffer.seek(0)
+        return compute_image_hash(self._buffer, method=self.method)
+
+
+def compute_perceptual_hashes(
+    sample_collection,
+    method="phash",
+    num_workers=None,
+    batch_size=None,
+    use_processes=False,
+    sharded=False,
+    num_shards=None,
+    prefetch=False,
+    max_in_flight=None,
+):
+    """
+    Computes perceptual hashes for the samples in the collection that do not
+    have one yet and stores them in an integer field named after ``method``.
+
+    If ``sharded`` is True, the samples are hashed in shards of contiguous ID
+    ranges, each processed by a worker process. If ``prefetch`` is True
+    instead, images are read by a :class:`media_reader.AsyncMediaReader` that
+    keeps up to ``max_in_flight`` reads in flight.
+
+    Returns the number of hashed samples.
+    """
+    if method not in PHASH_METHODS:
+        raise ValueError(
+            "Unsupported perceptual hash method '%s'. Supported values are %s"
+            % (method, PHASH_METHODS)
+        )
+
+    if sharded and prefetch:
+        raise ValueError("Sharded hashing does not support prefetching")
+
+    if batch_size is None:
+        batch_size = DEFAULT_BATCH_SIZE
+
+    if method in sample_collection.get_field_schema():
+        sample_collection = sample_collection.exists(method, False)
+    else:
+        sample_collection._dataset.add_sample_field(method, fo.IntField)
+
+    ids, filepaths = get_ids_and_filepaths(sample_collection)
+    if sharded:
+        results = iter_sharded(
+            _ImageHasher(method),
+            ids,
+            filepaths,
+            num_shards=num_shards,
+            num_workers=num_workers,
+        )
+    elif prefetch:
+        results = map_prefetched(
+            partial(_StreamedImageHasher, method),
+            filepaths,
+            max_in_flight=max_in_flight,
+        )
+        results = zip(ids, (phash for phash, _ in results))
+    else:
+        hashes = map_parallel(
+            _ImageHasher(method),
+            filepaths,
+            num_workers=num_workers,
+            use_processes=use_processes,
+        )
+        results = zip(ids, hashes)
+
+    for batch in iter_batches(results, batch_size):
+        sample_collection.set_values(method, dict(batch), key_field="id")
+
+    return len(ids)
@@ -0,0 +1,143 @@
+from PIL import Image
+
+from dedup_utils import (
+    DEFAULT_BATCH_SIZE,
+    get_ids_and_filepaths,
+    iter_batches,
+    map_parallel,
+)
+from file_hashes import get_filehash_field_type, hash_chunks
+from sharding import iter_sharded
+
+PIXELHASH_FIELD = "pixelhash"
+DEFAULT_PIXELHASH_METHOD = "md5"
+
+
+def _normalize_mode(img):
+    if "A" not in img.getbands() and "transparency" not in img.info:
+        return img.convert("RGB")
+
+    ## an alpha channel that is fully opaque carries no information
+    img = img.convert("RGBA")
+    if img.getchannel("A").getextrema() == (255, 255):
+        return img.convert("RGB")
+
+    return img
+
+
+def _load_pixels(filepath, size=None):
+    with Image.open(filepath) as img:
+        width, height = img.size
+        if size is not None:
+            scale = min(size / max(width, height), 1)
+            target = (
+                max(int(round(scale * width)), 1),
+                max(int(round(scale * height)), 1),
+            )
+
+            ## lets JPEG decoders produce a reduced-size image directly
+            img.draft(img.mode, target)
+
+        img = _normalize_mode(img)
+        if size is not None and img.size != target:
+            img = img.resize(target, Image.Resampling.BOX)
+
+        header = ("%s %dx%d" % (img.mode, width, height)).encode()
+        return header, img.tobytes()
+
+
+def compute_pixel_hash(filepath, method=DEFAULT_PIXELHASH_METHOD, size=None):
+    """
+    Hashes the decoded pixels of the given image, so that images that only
+    differ in their metadata or in their lossless encoding have the same
+    hash.
+
+    Pixels are converted to RGB, or RGBA if the image has transparency, before
+    hashing. If ``size`` is provided, the image is first downscaled so that
+    its largest side is at most ``size`` pixels, which JPEGs support directly
+    while decoding.
+    """
+    return hash_chunks(_load_pixels(filepath, size=size), method=method)
+
+
+class _PixelHasher(object):
+    def __init__(self, method, size):
+        self.method = method
+        self.size = size
+
+    def __call__(self, filepath):
+        return compute_pixel_hash(filepath, method=self.method, size=self.size)
+
+
+def prepare_pixelhash_field(sample_collection, method, size):
+    """
+    Ensures that the dataset has a ``pixelhash`` field for hashes computed
+    with the given settings, discarding any existing hashes that were
+    computed with different settings.
+    """
+    dataset = sample_collection._dataset
+    settings = {"method": method, "size": size}
+
+    field = dataset.get_field(PIXELHASH_FIELD)
+    if field is not None and (field.info or {}) != settings:
+        ## hashes computed with different settings cannot be compared
+        dataset.delete_sample_field(PIXELHASH_FIELD)
+        field = None
+
+    if field is None:
+        dataset.add_sample_field(
+            PIXELHASH_FIELD, get_filehash_field_type(method), info=settings
+        )
+
+
+def compute_pixel_hashes(
+    sample_collection,
+    method=DEFAULT_PIXELHASH_METHOD,
+    size=None,
+    num_workers=None,
+    batch_size=None,
+    use_processes=False,
+    sharded=False,
+    num_shards=None,
+):
+    """
+    Computes the pixel hash of the samples in the collection that do not have
+    one yet and stores them in the ``pixelhash`` field.
+
+    The hash method and ``size`` are recorded on the field. If the existing
+    pixel hashes were computed with different settings, they are discarded
+    and every sample is hashed again.
+
+    Returns the number of hashed samples.
+    """
+    if batch_size is None:
+        batch_size = DEFAULT_BATCH_SIZE
+
+    prepare_pixelhash_field(sample_collection, method, size)
+    sample_collection = sample_collection.exists(PIXELHASH_FIELD, False)
+
+    ids, filepaths = get_ids_and_filepaths(sample_collection)
+    hasher = _PixelHasher(method, size)
+    if sharded:
+        results = iter_sharded(
+            hasher,
+            ids,
+            filepaths,
+            num_shards=num_shards,
+            num_workers=num_workers,
+        )
+    else:
+        hashes = map_parallel(
+            hasher,
+            filepaths,
+            num_workers=num_workers,
+            use_processes=use_processes,
+        )
+        results = zip(ids, hashes)
+
+    for batch in iter_batches(results, batch_size):
+        sample_collection.set_values(
+            PIXELHASH_FIELD, dict(batch), key_field="id"
+        )
+
+    return len(ids)
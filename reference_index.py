@@ -0,0 +1,325 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from dedup_utils import DEFAULT_BATCH_SIZE, iter_batches
+from exact_dups import DEFAULT_HASH_METHOD, compute_filehashes
+from hamming_index import HammingIndex
+from perceptual_hashes import compute_perceptual_hashes, to_unsigned_array
+
+METADATA_FILENAME = "metadata.json"
+PHASH_INDEX_DIRNAME = "phash_index"
+DEFAULT_REFERENCE_TAG = "duplicate_of_reference"
+DEFAULT_PHASH_MAX_DISTANCE = 10
+
+
+def _filehash_keys(filehashes):
+    # splits each hash into two uint64 words, so that they can be stored in
+    # compact, sortable arrays regardless of the hash's original format
+    digests = []
+    for filehash in filehashes:
+        if isinstance(filehash, int):
+            digests.append(bytes(8) + filehash.to_bytes(8, "big", signed=True))
+            continue
+
+        filehash = str(filehash)
+        try:
+            digest = bytes.fromhex(filehash)
+        except ValueError:
+            digest = b""
+
+        if len(digest) != 16:
+            digest = hashlib.md5(filehash.encode()).digest()
+
+        digests.append(digest)
+
+    words = np.frombuffer(b"".join(digests), dtype=">u8").reshape(-1, 2)
+    return words[:, 0].astype(np.uint64), words[:, 1].astype(np.uint64)
+
+
+class ReferenceHashIndex(object):
+    """
+    Persistent, memory-mapped index of the file hashes (and optionally the
+    perceptual hashes) of a reference dataset.
+
+    File hashes are stored as sorted arrays of 128-bit keys, so checking
+    whether a hash is in the index is a binary search, and loading the index
+    only maps the arrays into memory. Perceptual hashes are stored with the
+    substring tables of a :class:`hamming_index.HammingIndex`, so that
+    near-duplicates within the index's ``phash_max_distance`` are found
+    without rebuilding them.
+
+    Args:
+        index_dir: the directory containing the index
+        mmap (True): whether to memory-map the arrays rather than reading them
+            into memory
+    """
+
+    def __init__(self, index_dir, mmap=True):
+        mmap_mode = "r" if mmap else None
+
+        with open(os.path.join(index_dir, METADATA_FILENAME)) as f:
+            self.metadata = json.load(f)
+
+        self.index_dir = index_dir
+        self._hi = np.load(
+            os.path.join(index_dir, "filehash_hi.npy"), mmap_mode=mmap_mode
+        )
+        self._lo = np.load(
+            os.path.join(index_dir, "filehash_lo.npy"), mmap_mode=mmap_mode
+        )
+
+        self.filehash_method = self.metadata.get(
+            "filehash_method", DEFAULT_HASH_METHOD
+        )
+        self.phash_method = self.metadata.get("phash_method", None)
+        self.phash_max_distance = self.metadata.get("phash_max_distance", 0)
+        self._phash_index = None
+        if self.phash_method is not None:
+            self._phashes = np.load(
+                os.path.join(index_dir, "phash.npy"), mmap_mode=mmap_mode
+            )
+            if self.phash_max_distance > 0:
+                self._phash_index = HammingIndex.load(
+                    os.path.join(index_dir, PHASH_INDEX_DIRNAME), mmap=mmap
+                )
+        else:
+            self._phashes = None
+
+    def __len__(self):
+        return len(self._hi)
+
+    @classmethod
+    def build(
+        cls,
+        index_dir,
+        filehashes,
+        phashes=None,
+        metadata=None,
+        phash_max_distance=DEFAULT_PHASH_MAX_DISTANCE,
+    ):
+        """
+        Writes an index of the given hashes to ``index_dir`` and returns it.
+
+        Args:
+            index_dir: the directory in which to write the index
+            filehashes: an iterable of file hashes
+            phashes (None): an optional iterable of signed 64-bit perceptual
+                hashes
+            metadata (None): an optional dict of metadata to store with the
+                index. Must contain a ``phash_method`` when ``phashes`` are
+                provided
+            phash_max_distance (DEFAULT_PHASH_MAX_DISTANCE): the largest
+                Hamming distance for which the substring tables of the
+                perceptual hashes are built
+        """
+        metadata = dict(metadata or {})
+        os.makedirs(index_dir, exist_ok=True)
+
+        hi, lo = _filehash_keys([h for h in filehashes if h is not None])
+        order = np.lexsort((lo, hi))
+        np.save(os.path.join(index_dir, "filehash_hi.npy"), hi[order])
+        np.save(os.path.join(index_dir, "filehash_lo.npy"), lo[order])
+        metadata["num_filehashes"] = len(order)
+
+        if phashes is not None:
+            phashes = np.unique(
+                to_unsigned_array([h for h in phashes if h is not None])
+            )
+            np.save(os.path.join(index_dir, "phash.npy"), phashes)
+            metadata["num_phashes"] = len(phashes)
+
+            if phash_max_distance > 0 and len(phashes) > 0:
+                HammingIndex(phashes, phash_max_distance).save(
+                    os.path.join(index_dir, PHASH_INDEX_DIRNAME)
+                )
+                metadata["phash_max_distance"] = phash_max_distance
+        else:
+            metadata.pop("phash_method", None)
+
+        with open(os.path.join(index_dir, METADATA_FILENAME), "w") as f:
+            json.dump(metadata, f, indent=4)
+
+        return cls(index_dir)
+
+    def contains_filehashes(self, filehashes):
+        """
+        Returns a boolean array indicating whether each of the given file
+        hashes is in the index.
+        """
+        filehashes = list(filehashes)
+        found = np.zeros(len(filehashes), dtype=bool)
+        valid = [i for i, h in enumerate(filehashes) if h is not None]
+        if not valid or len(self) == 0:
+            return found
+
+        hi, lo = _filehash_keys([filehashes[i] for i in valid])
+        left = np.searchsorted(self._hi, hi, side="left")
+        right = np.searchsorted(self._hi, hi, side="right")
+
+        ## the high words almost never collide, so runs are tiny
+        for i, l, r, key in zip(valid, left, right, lo):
+            if r > l:
+                found[i] = key in self._lo[l:r]
+
+        return found
+
+    def contains_phashes(self, phashes, max_distance=0):
+        """
+        Returns a boolean array indicating whether each of the given signed
+        perceptual hashes is within ``max_distance`` bits of a hash in the
+        index.
+
+        The saved substring tables are used when ``max_distance`` is at most
+        the index's ``phash_max_distance``. Otherwise, they are rebuilt in
+        memory for ``max_distance``.
+        """
+        if self._phashes is None:
+            raise ValueError("This index does not contain perceptual hashes")
+
+        phashes = list(phashes)
+        found = np.zeros(len(phashes), dtype=bool)
+        valid = [i for i, h in enumerate(phashes) if h is not None]
+        if not valid or len(self._phashes) == 0:
+            return found
+
+        queries = to_unsigned_array([phashes[i] for i in valid])
+
+        if max_distance == 0:
+            inds = np.searchsorted(self._phashes, queries)
+            inds = np.minimum(inds, len(self._phashes) - 1)
+            found[valid] = self._phashes[inds] == queries
+            return found
+
+        if max_distance <= self.phash_max_distance:
+            index = self._phash_index
+        else:
+            index = HammingIndex(self._phashes, max_distance)
+
+        query_inds, _, _ = index.query(queries, max_distance=max_distance)
+        found[np.asarray(valid)[query_inds]] = True
+        return found
+
+
+def build_reference_index(
+    sample_collection,
+    index_dir,
+    phash_method=None,
+    num_workers=None,
+    batch_size=None,
+    use_processes=False,
+    filehash_method=DEFAULT_HASH_METHOD,
+    phash_max_distance=DEFAULT_PHASH_MAX_DISTANCE,
+):
+    """
+    Builds a :class:`ReferenceHashIndex` of the samples in the collection in
+    ``index_dir``, computing any missing hashes first.
+
+    When ``phash_method`` is provided, the substring tables of the
+    perceptual hashes are built for checks up to ``phash_max_distance`` bits.
+
+    The file hash method is recorded in the index, so that datasets checked
+    against it are hashed with the same method.
+    """
+    kwargs = dict(
+        num_workers=num_workers,
+        batch_size=batch_size,
+        use_processes=use_processes,
+    )
+
+    ## samples that staged hashing ruled out have no hash, but every sample
+    ## must be in the index
+    compute_filehashes(
+        sample_collection,
+        incremental=True,
+        method=filehash_method,
+        hash_ruled_out=True,
+        **kwargs,
+    )
+    filehashes = sample_collection.values("filehash")
+
+    phashes = None
+    if phash_method is not None:
+        compute_perceptual_hashes(
+            sample_collection, method=phash_method, **kwargs
+        )
+        phashes = sample_collection.values(phash_method)
+
+    metadata = {
+        "dataset": sample_collection._dataset.name,
+        "num_samples": len(filehashes),
+        "filehash_method": filehash_method,
+        "phash_method": phash_method,
+    }
+    index = ReferenceHashIndex.build(
+        index_dir,
+        filehashes,
+        phashes=phashes,
+        metadata=metadata,
+        phash_max_distance=phash_max_distance,
+    )
+
+    return {"num_filehashes": len(index)}
+
+
+def check_against_reference_index(
+    sample_collection,
+    index_dir,
+    tag=DEFAULT_REFERENCE_TAG,
+    phash_threshold=None,
+    num_workers=None,
+    batch_size=None,
+    use_processes=False,
+):
+    """
+    Tags the samples in the collection whose file hash is in the reference
+    index at ``index_dir`` with ``tag``.
+
+    If ``phash_threshold`` is provided and the index contains perceptual
+    hashes, samples whose perceptual hash is within ``phash_threshold`` bits
+    of a reference hash are also tagged.
+
+    The samples are hashed with the file hash method of the index. Hashes
+    that were computed with another method are discarded.
+    """
+    if batch_size is None:
+        batch_size = DEFAULT_BATCH_SIZE
+
+    kwargs = dict(
+        num_workers=num_workers,
+        batch_size=batch_size,
+        use_processes=use_processes,
+    )
+
+    index = ReferenceHashIndex(index_dir)
+
+    ## every sample must be checked, including those that staged hashing
+    ## ruled out
+    compute_filehashes(
+        sample_collection,
+        incremental=True,
+        method=index.filehash_method,
+        hash_ruled_out=True,
+        **kwargs,
+    )
+    ids, filehashes = sample_collection.values(["id", "filehash"])
+    found = index.contains_filehashes(filehashes)
+    num_exact_matches = int(found.sum())
+
+    if phash_threshold is not None and index.phash_method is not None:
+        compute_perceptual_hashes(
+            sample_collection, method=index.phash_method, **kwargs
+        )
+        phashes = sample_collection.values(index.phash_method)
+        found |= index.contains_phashes(phashes, max_distance=phash_threshold)
+
+    match_ids = [_id for _id, f in zip(ids, found) if f]
+    for batch_ids in iter_batches(match_ids, batch_size):
+        sample_collection.select(batch_ids).tag_samples(tag)
+
+    return {
+        "num_exact_matches": num_exact_matches,
+        "num_matches": len(match_ids),
+    }
@@ -0,0 +1,101 @@
+import math
+
+import numpy as np
+
+import fiftyone.core.utils as fou
+
+from dedup_utils import spawn_process_pool
+
+DEFAULT_SHARDS_PER_WORKER = 4
+
+
+def get_num_shards(num_shards=None, num_workers=None):
+    """
+    Returns the number of shards to use, which is ``num_shards`` if provided
+    and otherwise ``DEFAULT_SHARDS_PER_WORKER`` shards per worker, so that
+    shards that finish at different times still keep every worker busy.
+    """
+    if num_shards is not None:
+        return max(num_shards, 1)
+
+    num_workers = fou.recommend_process_pool_workers(num_workers)
+    return DEFAULT_SHARDS_PER_WORKER * num_workers
+
+
+def partition_ids(ids, num_shards):
+    """
+    Partitions the given IDs into at most ``num_shards`` contiguous ranges of
+    IDs of roughly equal size.
+
+    Returns a list of arrays of indices into ``ids``, each sorted by ID.
+    """
+    order = np.argsort(np.asarray(ids, dtype=str), kind="stable")
+    return [inds for inds in np.array_split(order, num_shards) if len(inds)]
+
+
+def partition_pair_rows(num_rows, num_shards):
+    """
+    Partitions the rows of an all-pairs computation, in which each row is
+    compared with every later row, into at most ``num_shards`` contiguous
+    ``(start, end)`` ranges containing roughly equal numbers of pairs.
+    """
+    ## the number of pairs in the first r rows is r * (n - (r - 1) / 2)
+    b = num_rows + 0.5
+    total = num_rows * (num_rows + 1) / 2
+
+    bounds = [0]
+    for k in range(1, num_shards):
+        target = k * total / num_shards
+        bounds.append(int(round(b - math.sqrt(max(b * b - 2 * target, 0)))))
+
+    bounds.append(num_rows)
+    return [(s, e) for s, e in zip(bounds[:-1], bounds[1:]) if e > s]
+
+
+class _ShardMapper(object):
+    def __init__(self, fn):
+        self.fn = fn
+
+    def __call__(self, items):
+        return [self.fn(item) for item in items]
+
+
+def map_shards(fn, shards, num_workers=None):
+    """
+    Applies ``fn`` to each shard in a pool of worker processes, yielding the
+    results in shard order.
+
+    ``fn`` must be picklable by reference from a module in this directory,
+    see :func:`dedup_utils.spawn_process_pool`.
+    """
+    num_workers = fou.recommend_process_pool_workers(num_workers)
+    if num_workers <= 1:
+        for shard in shards:
+            yield fn(shard)
+
+        return
+
+    with spawn_process_pool(num_workers) as executor:
+        futures = [executor.submit(fn, shard) for shard in shards]
+        for future in futures:
+            yield future.result()
+
+
+def iter_sharded(fn, ids, items, num_shards=None, num_workers=None):
+    """
+    Partitions the items into shards of contiguous ID ranges and applies
+    ``fn`` to each item in worker processes, one shard per task.
+
+    Yields ``(id, result)`` tuples in ID order.
+    """
+    num_shards = get_num_shards(num_shards, num_workers=num_workers)
+    shards = partition_ids(ids, num_shards)
+    results = map_shards(
+        _ShardMapper(fn),
+        [[items[i] for i in inds] for inds in shards],
+        num_workers=num_workers,
+    )
+
+    for inds, shard_results in zip(shards, results):
+        for i, result in zip(inds.tolist(), shard_results):
+            yield ids[i], result
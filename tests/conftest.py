@@ -0,0 +1,6 @@
+import os
+import sys
+
+## the plugin's modules are imported by name, as fiftyone does when it loads
+## the plugin
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from approx_dups import _iter_perceptual_shard_pairs, _union_pairs
+from duplicate_edges import DuplicateEdges
+from hamming_index import HammingIndex
+from union_find import get_component_ids
+
+
+def _random_hashes(num_hashes, seed=0):
+    ## clusters of hashes that differ in a few bits, with exact repeats
+    rng = np.random.default_rng(seed)
+    centers = rng.integers(0, 2**64, size=num_hashes // 10, dtype=np.uint64)
+    hashes = centers[rng.integers(0, len(centers), size=num_hashes)]
+    for i in range(num_hashes):
+        for bit in rng.choice(64, size=rng.integers(0, 5), replace=False):
+            hashes[i] ^= np.uint64(1 << int(bit))
+
+    return hashes.view(np.int64).tolist()
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("max_diameter", [None, 4])
+def test_perceptual_groups_do_not_depend_on_path(seed, max_diameter):
+    hashes = _random_hashes(300, seed=seed)
+    ids = ["%04d" % i for i in np.random.default_rng(seed).permutation(300)]
+    threshold = 6
+
+    index = HammingIndex(np.array(hashes).view(np.uint64), threshold)
+    fresh = _union_pairs(len(ids), index.iter_pairs(), max_diameter, {})
+
+    edges = DuplicateEdges.from_pairs(ids, index.iter_pairs(), threshold)
+    cached = edges.union_find(threshold, max_diameter=max_diameter)
+
+    shard_pairs = _iter_perceptual_shard_pairs(
+        ids, hashes, threshold, num_shards=7, num_workers=1
+    )
+    sharded = _union_pairs(len(ids), shard_pairs, max_diameter, {})
+
+    expected = get_component_ids(ids, fresh)
+    assert len(set(expected.values())) > 1
+    assert get_component_ids(ids, cached) == expected
+    assert get_component_ids(ids, sharded) == expected
@@ -0,0 +1,176 @@
+import numpy as np
+import pytest
+
+from duplicate_edges import (
+    DuplicateEdges,
+    get_nearest_neighbor_distances,
+    iter_embedding_pairs,
+)
+from union_find import UnionFind
+
+
+def _brute_force_distances(embeddings, metric):
+    embeddings = np.asarray(embeddings, dtype=np.float64)
+    if metric == "cosine":
+        normed = embeddings / np.linalg.norm(embeddings, axis=1)[:, None]
+        return 1.0 - normed @ normed.T
+
+    diffs = embeddings[:, None, :] - embeddings[None, :, :]
+    return np.sqrt((diffs**2).sum(axis=-1))
+
+
+def _clustered_embeddings(num_clusters=20, cluster_size=5, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(num_clusters, 16))
+    noise = 0.05 * rng.normal(size=(num_clusters, cluster_size, 16))
+    embeddings = (centers[:, None, :] + noise).reshape(-1, 16)
+    return embeddings[rng.permutation(len(embeddings))].astype(np.float32)
+
+
+def _collect(pairs):
+    results = {}
+    for inds1, inds2, dists in pairs:
+        for i, j, d in zip(inds1.tolist(), inds2.tolist(), dists.tolist()):
+            assert (i, j) not in results
+            results[(i, j)] = d
+
+    return results
+
+
+@pytest.mark.parametrize(
+    "metric,max_distance", [("cosine", 0.01), ("euclidean", 0.4)]
+)
+@pytest.mark.parametrize("batch_size", [7, 32, 1000])
+def test_embedding_pairs(metric, max_distance, batch_size):
+    embeddings = _clustered_embeddings()
+    dists = _brute_force_distances(embeddings, metric)
+
+    ## pairs near the threshold may be on either side of it due to rounding
+    margin = 1e-4
+    results = _collect(
+        iter_embedding_pairs(
+            embeddings, max_distance, metric=metric, batch_size=batch_size
+        )
+    )
+    for (i, j), d in results.items():
+        assert i < j
+        assert d == pytest.approx(dists[i, j], abs=margin)
+
+    inds1, inds2 = np.nonzero(dists <= max_distance - margin)
+    for i, j in zip(inds1.tolist(), inds2.tolist()):
+        if i < j:
+            assert (i, j) in results
+
+    assert len(results) > 0
+
+
+def test_embedding_pairs_row_ranges():
+    embeddings = _clustered_embeddings()
+    expected = _collect(iter_embedding_pairs(embeddings, 0.01, batch_size=16))
+
+    results = {}
+    for start, end in [(0, 13), (13, 60), (60, len(embeddings))]:
+        results.update(
+            _collect(
+                iter_embedding_pairs(
+                    embeddings, 0.01, batch_size=16, start=start, end=end
+                )
+            )
+        )
+
+    assert results.keys() == expected.keys()
+
+
+@pytest.mark.parametrize("metric", ["cosine", "euclidean"])
+@pytest.mark.parametrize("batch_size", [7, 1000])
+def test_nearest_neighbor_distances(metric, batch_size):
+    embeddings = _clustered_embeddings()
+    dists = _brute_force_distances(embeddings, metric)
+    np.fill_diagonal(dists, np.inf)
+
+    nn_dists = get_nearest_neighbor_distances(
+        embeddings, metric=metric, batch_size=batch_size
+    )
+    assert nn_dists == pytest.approx(dists.min(axis=1), abs=1e-4)
+
+    single = get_nearest_neighbor_distances(embeddings[:1], metric=metric)
+    assert single.tolist() == [np.inf]
+
+
+def _random_edges(num_nodes=200, num_pairs=300, seed=0):
+    rng = np.random.default_rng(seed)
+    inds1 = rng.integers(0, num_nodes, size=num_pairs)
+    inds2 = rng.integers(0, num_nodes, size=num_pairs)
+    dists = rng.integers(0, 20, size=num_pairs)
+    ids = ["%04d" % i for i in range(num_nodes)]
+    return DuplicateEdges(ids, inds1, inds2, dists, 20)
+
+
+def _counts(edges, threshold):
+    keep = edges.dists <= threshold
+    union_find = UnionFind(len(edges.ids))
+    union_find.union_pairs(
+        edges.inds1[keep], edges.inds2[keep], dists=edges.dists[keep]
+    )
+    return (
+        union_find.num_dups,
+        union_find.num_groups,
+        union_find.num_grouped,
+    )
+
+
+def test_sweep_thresholds():
+    edges = _random_edges()
+    thresholds = [0, 3, 7, 12, 25]
+    results = edges.sweep(thresholds=thresholds, batch_size=16)
+
+    assert [r["threshold"] for r in results] == thresholds
+    for r in results:
+        expected = _counts(edges, r["threshold"])
+        assert (
+            r["num_dups"],
+            r["num_groups"],
+            r["num_images_with_dups"],
+        ) == expected
+
+
+def test_sweep_fractions():
+    edges = _random_edges()
+    num_nodes = len(edges.ids)
+    fractions = [0.1, 0.3, 0.5, 0.99]
+    results = edges.sweep(fractions=fractions, batch_size=16)
+
+    for r in results:
+        target = num_nodes - int(round((1 - r["fraction"]) * num_nodes))
+        if r["threshold"] is None:
+            assert _counts(edges, edges.max_distance)[0] < target
+            continue
+
+        ## the smallest threshold that reaches the fraction
+        assert _counts(edges, r["threshold"])[0] >= target
+        assert _counts(edges, r["threshold"] - 1)[0] < target
+
+
+def test_save_load(tmp_path):
+    edges = _random_edges()
+    path = str(tmp_path / "edges.npz")
+    edges.save(path)
+
+    loaded = DuplicateEdges.load_if_valid(path, edges.ids, 10)
+    assert np.array_equal(loaded.inds1, edges.inds1)
+    assert np.array_equal(loaded.dists, edges.dists)
+    assert DuplicateEdges.load_if_valid(path, edges.ids, 30) is None
+    assert DuplicateEdges.load_if_valid(path, edges.ids[:-1], 10) is None
+
+
+def test_save_load_key(tmp_path):
+    edges = _random_edges()
+    edges.key = "run-1"
+    path = str(tmp_path / "edges.npz")
+    edges.save(path)
+
+    assert DuplicateEdges.load_if_valid(path, edges.ids, 10, key="run-1")
+    assert DuplicateEdges.load_if_valid(path, edges.ids, 10) is None
+    assert (
+        DuplicateEdges.load_if_valid(path, edges.ids, 10, key="run-2") is None
+    )
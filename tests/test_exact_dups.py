@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+from exact_dups import (
+    FINGERPRINT_FIELDS,
+    RULED_OUT_FIELD,
+    _get_file_stat,
+    _get_stale_indices,
+    _validate_local_filepaths,
+)
+
+
+class _StagedCollection(object):
+    ## the fields that staged hashing writes, for files of the given sizes
+
+    def __init__(self, filepaths):
+        stats = [_get_file_stat(f) for f in filepaths]
+        sizes = [size for size, _ in stats]
+        ruled_out = [sizes.count(size) == 1 for size in sizes]
+        self._values = {
+            "filehash": [None if r else "hash" for r in ruled_out],
+            FINGERPRINT_FIELDS[0]: sizes,
+            FINGERPRINT_FIELDS[1]: [mtime for _, mtime in stats],
+            RULED_OUT_FIELD: ["size" if r else None for r in ruled_out],
+        }
+
+    def get_field_schema(self):
+        return dict.fromkeys(self._values)
+
+    def values(self, fields):
+        if isinstance(fields, str):
+            return self._values[fields]
+
+        return [self._values[f] for f in fields]
+
+
+def _write_files(tmp_path, sizes):
+    filepaths = []
+    for i, size in enumerate(sizes):
+        filepath = os.path.join(str(tmp_path), "%d.bin" % i)
+        with open(filepath, "wb") as f:
+            f.write(b"x" * size)
+
+        filepaths.append(filepath)
+
+    return filepaths
+
+
+def test_stale_indices_ruled_out(tmp_path):
+    filepaths = _write_files(tmp_path, [10, 20, 20, 30])
+    collection = _StagedCollection(filepaths)
+
+    assert _get_stale_indices(collection, filepaths) == []
+    assert _get_stale_indices(collection, filepaths, hash_ruled_out=True) == [
+        0,
+        3,
+    ]
+
+    ## a new file of the same size as a ruled out file
+    new_dir = tmp_path / "new"
+    new_dir.mkdir()
+    filepaths += _write_files(new_dir, [30])
+    collection._values["filehash"].append(None)
+    collection._values[FINGERPRINT_FIELDS[0]].append(None)
+    collection._values[FINGERPRINT_FIELDS[1]].append(None)
+    collection._values[RULED_OUT_FIELD].append(None)
+    assert _get_stale_indices(collection, filepaths) == [3, 4]
+
+
+def test_staged_rejects_urls(tmp_path):
+    filepaths = _write_files(tmp_path, [10])
+    _validate_local_filepaths(filepaths)
+
+    with pytest.raises(ValueError):
+        _validate_local_filepaths(filepaths + ["https://host/a.jpg"])
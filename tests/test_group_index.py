@@ -0,0 +1,42 @@
+import numpy as np
+
+from group_index import GroupIndex
+
+
+def _build(tmp_path):
+    ids = ["a", "b", "c", "d", "e", "f", "g"]
+    keys = ["x", "x", "x", "y", "y", "z", "z"]
+    dists = [0.1, 0.1, 0.1, 0.3, 0.3, 0.2, 0.2]
+    return GroupIndex.build(str(tmp_path / "index"), ids, keys, dists=dists)
+
+
+def test_get_page(tmp_path):
+    index = _build(tmp_path)
+
+    assert index.num_pages(2) == 2
+    assert index.get_page(0, 1) == (["x"], ["a", "b", "c"])
+    assert index.get_page(0, 3, sort_by="max_distance")[0] == ["y", "z", "x"]
+
+
+def test_restrict(tmp_path):
+    index = _build(tmp_path).restrict(["a", "c", "d", "f", "g"])
+
+    assert len(index) == 2
+    assert index.get_page(0, 10) == (["x", "z"], ["a", "c", "f", "g"])
+    assert index.get_page(0, 10, sort_by="max_distance")[0] == ["z", "x"]
+    np.testing.assert_array_equal(index.sizes, [2, 2])
+
+
+def test_restrict_empty(tmp_path):
+    index = _build(tmp_path).restrict([])
+
+    assert len(index) == 0
+    assert index.get_page(0, 10) == ([], [])
+
+
+def test_key(tmp_path):
+    ids, keys = ["a", "b"], ["x", "x"]
+    index = GroupIndex.build(str(tmp_path / "index"), ids, keys, key="run")
+
+    assert GroupIndex(str(tmp_path / "index")).key == "run"
+    assert index.restrict(ids).key is None
@@ -0,0 +1,158 @@
+from itertools import combinations
+import os
+
+import numpy as np
+import pytest
+
+from hamming_index import HammingIndex, HammingIndexStore, popcount
+
+
+def _random_hashes(num_hashes, num_near, num_repeats, seed=0):
+    rng = np.random.default_rng(seed)
+    hashes = rng.integers(0, 2**64, size=num_hashes, dtype=np.uint64)
+
+    ## near duplicates that differ in a few bits, and exact repeats
+    near = hashes[rng.integers(0, num_hashes, size=num_near)].copy()
+    for i in range(num_near):
+        for bit in rng.choice(64, size=rng.integers(1, 10), replace=False):
+            near[i] ^= np.uint64(1 << int(bit))
+
+    repeats = hashes[rng.integers(0, num_hashes, size=num_repeats)]
+    return np.concatenate([hashes, near, repeats])
+
+
+def _distance(a, b):
+    return bin(int(a) ^ int(b)).count("1")
+
+
+def _brute_force_pairs(hashes, max_distance):
+    firsts = {}
+    for i, h in enumerate(hashes.tolist()):
+        firsts.setdefault(h, i)
+
+    pairs = set()
+    for i, h in enumerate(hashes.tolist()):
+        if firsts[h] != i:
+            pairs.add((firsts[h], i, 0))
+
+    for h1, h2 in combinations(sorted(firsts), 2):
+        dist = _distance(h1, h2)
+        if dist <= max_distance:
+            i, j = sorted((firsts[h1], firsts[h2]))
+            pairs.add((i, j, dist))
+
+    return pairs
+
+
+def _brute_force_query(hashes, queries, max_distance):
+    firsts = {}
+    for i, h in enumerate(hashes.tolist()):
+        firsts.setdefault(h, i)
+
+    expected = set()
+    for q, query in enumerate(queries.tolist()):
+        for h, i in firsts.items():
+            dist = _distance(query, h)
+            if dist <= max_distance:
+                expected.add((q, i, dist))
+
+    return expected
+
+
+def test_popcount():
+    values = _random_hashes(100, 0, 0)
+    expected = [bin(int(v)).count("1") for v in values]
+    assert popcount(values).tolist() == expected
+
+
+@pytest.mark.parametrize(
+    "max_distance,num_chunks",
+    [(0, None), (3, None), (8, None), (12, None), (2, 1), (7, 4), (12, 8)],
+)
+def test_find_pairs(max_distance, num_chunks):
+    hashes = _random_hashes(300, 100, 30)
+    index = HammingIndex(hashes, max_distance, num_chunks=num_chunks)
+
+    inds1, inds2, dists = index.find_pairs(batch_size=64)
+    pairs = list(zip(inds1.tolist(), inds2.tolist(), dists.tolist()))
+
+    assert len(pairs) == len(set(pairs))
+    assert set(pairs) == _brute_force_pairs(hashes, max_distance)
+
+
+@pytest.mark.parametrize("max_distance", [0, 5, 12])
+def test_find_shard_pairs(tmp_path, max_distance):
+    hashes = _random_hashes(300, 100, 30)
+    HammingIndex(hashes, max_distance).save(str(tmp_path / "index"))
+    index = HammingIndex.load(str(tmp_path / "index"))
+
+    rng = np.random.default_rng(0)
+    shards = np.array_split(rng.permutation(len(hashes)), 7)
+
+    pairs = []
+    for inds in shards:
+        inds1, inds2, dists = index.find_shard_pairs(inds, batch_size=32)
+        assert (inds1 < inds2).all()
+        pairs.extend(zip(inds1.tolist(), inds2.tolist(), dists.tolist()))
+
+    assert len(pairs) == len(set(pairs))
+    assert set(pairs) == _brute_force_pairs(hashes, max_distance)
+
+
+@pytest.mark.parametrize("max_distance", [0, 5, 10])
+def test_query(max_distance):
+    hashes = _random_hashes(300, 100, 30)
+    queries = _random_hashes(50, 50, 10, seed=1)
+    index = HammingIndex(hashes, max_distance)
+
+    query_inds, inds, dists = index.query(queries, batch_size=16)
+    results = set(zip(query_inds.tolist(), inds.tolist(), dists.tolist()))
+    assert results == _brute_force_query(hashes, queries, max_distance)
+
+
+def test_save_load(tmp_path):
+    hashes = _random_hashes(300, 100, 30)
+    queries = _random_hashes(50, 50, 10, seed=1)
+    index = HammingIndex(hashes, 10)
+    index.save(str(tmp_path / "index"))
+    loaded = HammingIndex.load(str(tmp_path / "index"))
+
+    pairs = loaded.find_pairs(batch_size=64)
+    expected = index.find_pairs(batch_size=64)
+    for a, b in zip(pairs, expected):
+        assert np.array_equal(a, b)
+
+    query_inds, inds, dists = loaded.query(queries, max_distance=4)
+    results = set(zip(query_inds.tolist(), inds.tolist(), dists.tolist()))
+    assert results == _brute_force_query(hashes, queries, 4)
+
+    with pytest.raises(ValueError):
+        loaded.query(queries, max_distance=11)
+
+
+def test_store(tmp_path):
+    hashes = _random_hashes(300, 100, 0)
+    assert len(np.unique(hashes)) == len(hashes)
+    ids = np.array(["id%d" % i for i in range(len(hashes))])
+    queries = _random_hashes(50, 50, 10, seed=1)
+
+    path = str(tmp_path / "store")
+    store = HammingIndexStore.create(path, 8, ids=ids[:20], hashes=hashes[:20])
+    for start, end in [(20, 27), (27, 150), (150, 153), (153, 400)]:
+        HammingIndexStore(path).add(ids[start:end], hashes[start:end])
+
+    store = HammingIndexStore(path)
+    assert len(store) == len(hashes)
+    assert len(store.metadata["segments"]) <= 3
+    assert sorted(os.listdir(path)) == sorted(
+        ["metadata.json"] + [s["name"] for s in store.metadata["segments"]]
+    )
+
+    query_inds, result_ids, dists = store.query(queries, max_distance=6)
+    results = set(
+        zip(query_inds.tolist(), result_ids.tolist(), dists.tolist())
+    )
+    expected = set(
+        (q, ids[i], d) for q, i, d in _brute_force_query(hashes, queries, 6)
+    )
+    assert results == expected
@@ -0,0 +1,85 @@
+from functools import partial
+import http.server
+import os
+import threading
+import urllib.error
+
+import numpy as np
+import pytest
+
+from file_hashes import ChunkHasher, hash_file
+from media_reader import aiohttp, is_url, map_prefetched
+
+if aiohttp is not None:
+    _HTTP_ERRORS = (urllib.error.HTTPError, aiohttp.ClientResponseError)
+else:
+    _HTTP_ERRORS = (urllib.error.HTTPError,)
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def media_server(tmp_path):
+    ## a local stand-in for an object store that serves ``tmp_path``
+    handler = partial(_QuietHandler, directory=str(tmp_path))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield "http://127.0.0.1:%d" % server.server_address[1]
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def _write_files(tmp_path, sizes):
+    rng = np.random.default_rng(0)
+    filenames = []
+    for i, size in enumerate(sizes):
+        filename = "%d.bin" % i
+        with open(os.path.join(str(tmp_path), filename), "wb") as f:
+            f.write(rng.bytes(size))
+
+        filenames.append(filename)
+
+    return filenames
+
+
+def test_is_url():
+    assert is_url("http://host/a.jpg")
+    assert is_url("https://host/a.jpg")
+    assert not is_url("/data/a.jpg")
+
+
+def test_map_prefetched_http(tmp_path, media_server):
+    filenames = _write_files(tmp_path, [0, 1, 1000, 5000, 70000])
+    local_paths = [os.path.join(str(tmp_path), f) for f in filenames]
+    urls = ["%s/%s" % (media_server, f) for f in filenames]
+
+    ## mixes URLs and local paths, with several chunks per file
+    filepaths = [
+        url if i % 2 else path
+        for i, (url, path) in enumerate(zip(urls, local_paths))
+    ]
+    results = list(
+        map_prefetched(
+            ChunkHasher, filepaths, max_in_flight=3, chunk_size=1024
+        )
+    )
+
+    assert [h for h, _ in results] == [hash_file(p) for p in local_paths]
+    assert [n for _, n in results] == [os.path.getsize(p) for p in local_paths]
+
+
+def test_map_prefetched_http_error(tmp_path, media_server):
+    filenames = _write_files(tmp_path, [100])
+    urls = ["%s/%s" % (media_server, filenames[0]), media_server + "/missing"]
+
+    results = map_prefetched(ChunkHasher, urls, max_in_flight=2)
+    assert next(results)[0] == hash_file(os.path.join(str(tmp_path), "0.bin"))
+    with pytest.raises(_HTTP_ERRORS):
+        next(results)
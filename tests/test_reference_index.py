@@ -0,0 +1,39 @@
+import numpy as np
+
+from reference_index import ReferenceHashIndex
+
+
+def _distance(a, b):
+    return bin((int(a) ^ int(b)) & (2**64 - 1)).count("1")
+
+
+def _random_phashes(num_hashes, seed=0):
+    rng = np.random.default_rng(seed)
+    hashes = rng.integers(-(2**63), 2**63, size=num_hashes, dtype=np.int64)
+    return hashes.tolist()
+
+
+def test_contains_phashes(tmp_path):
+    phashes = _random_phashes(200)
+    queries = [h ^ 0b111 for h in phashes[:20]] + _random_phashes(20, seed=1)
+    queries.append(None)
+
+    index_dir = str(tmp_path / "index")
+    ReferenceHashIndex.build(
+        index_dir,
+        [],
+        phashes=phashes,
+        metadata={"phash_method": "phash"},
+        phash_max_distance=6,
+    )
+    index = ReferenceHashIndex(index_dir)
+    assert index.phash_max_distance == 6
+
+    for max_distance in (0, 3, 8):
+        expected = [
+            q is not None
+            and min(_distance(q, h) for h in phashes) <= max_distance
+            for q in queries
+        ]
+        found = index.contains_phashes(queries, max_distance=max_distance)
+        assert found.tolist() == expected
@@ -0,0 +1,138 @@
+from itertools import combinations
+
+import numpy as np
+import pytest
+
+from union_find import (
+    UnionFind,
+    get_component_ids,
+    get_component_max_distances,
+)
+
+
+def _brute_force_components(num_nodes, inds1, inds2):
+    labels = list(range(num_nodes))
+    changed = True
+    while changed:
+        changed = False
+        for i, j in zip(inds1, inds2):
+            label = min(labels[i], labels[j])
+            if labels[i] != label or labels[j] != label:
+                labels[i] = labels[j] = label
+                changed = True
+
+    return labels
+
+
+def _random_edges(num_nodes, num_edges, seed=0):
+    rng = np.random.default_rng(seed)
+    inds1 = rng.integers(0, num_nodes, size=num_edges)
+    inds2 = rng.integers(0, num_nodes, size=num_edges)
+    dists = rng.random(num_edges)
+    return inds1, inds2, dists
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_components(seed):
+    num_nodes = 200
+    inds1, inds2, dists = _random_edges(num_nodes, 150, seed=seed)
+
+    union_find = UnionFind(num_nodes)
+    union_find.union_pairs(inds1, inds2, dists=dists)
+
+    labels = _brute_force_components(num_nodes, inds1, inds2)
+    roots = union_find.components()
+    for i, j in combinations(range(num_nodes), 2):
+        assert (roots[i] == roots[j]) == (labels[i] == labels[j])
+
+    sizes = np.bincount(labels, minlength=num_nodes)
+    grouped = [i for i in range(num_nodes) if sizes[labels[i]] > 1]
+    num_groups = len(set(labels[i] for i in grouped))
+    assert union_find.num_grouped == len(grouped)
+    assert union_find.num_groups == num_groups
+    assert union_find.num_dups == len(grouped) - num_groups
+
+
+def test_component_ids_and_max_distances():
+    ids = ["%03d" % i for i in range(100)][::-1]
+    inds1, inds2, dists = _random_edges(len(ids), 60, seed=1)
+
+    ## pairs are merged in order of distance, so the largest merged
+    ## distance of a component is the smallest threshold that connects it
+    order = np.argsort(dists)
+    inds1, inds2, dists = inds1[order], inds2[order], dists[order]
+
+    union_find = UnionFind(len(ids))
+    union_find.union_pairs(inds1, inds2, dists=dists)
+
+    labels = _brute_force_components(len(ids), inds1, inds2)
+    members = {}
+    for i, label in enumerate(labels):
+        members.setdefault(label, []).append(i)
+
+    expected_ids, expected_dists = {}, {}
+    for label, inds in members.items():
+        if len(inds) < 2:
+            continue
+
+        for end in range(1, len(dists) + 1):
+            prefix = _brute_force_components(
+                len(ids), inds1[:end], inds2[:end]
+            )
+            if len(set(prefix[i] for i in inds)) == 1:
+                break
+
+        for i in inds:
+            expected_ids[ids[i]] = min(ids[j] for j in inds)
+            expected_dists[ids[i]] = dists[end - 1]
+
+    assert get_component_ids(ids, union_find) == expected_ids
+    assert get_component_max_distances(ids, union_find) == pytest.approx(
+        expected_dists
+    )
+
+
+@pytest.mark.parametrize("max_diameter", [0.05, 0.1, 0.3])
+def test_max_diameter(max_diameter):
+    ## points on a line, so that the distance of every pair is known
+    rng = np.random.default_rng(0)
+    points = rng.random(300)
+    inds1, inds2 = np.nonzero(
+        np.abs(points[:, None] - points[None, :]) <= max_diameter
+    )
+    keep = inds1 < inds2
+    inds1, inds2 = inds1[keep], inds2[keep]
+    dists = np.abs(points[inds1] - points[inds2])
+
+    union_find = UnionFind(len(points), max_diameter=max_diameter)
+    union_find.union_pairs(inds1, inds2, dists=dists)
+
+    roots = union_find.components()
+    for root in np.unique(roots):
+        members = points[roots == root]
+        assert members.max() - members.min() <= max_diameter + 1e-12
+
+
+@pytest.mark.parametrize("max_diameter", [0.02, 0.1, 0.5])
+def test_max_diameter_cosine(max_diameter):
+    ## cosine distances do not satisfy the triangle inequality
+    rng = np.random.default_rng(0)
+    angles = np.sort(rng.random(300))
+    points = np.stack([np.cos(angles), np.sin(angles)], axis=1)
+    cos_dists = 1.0 - points @ points.T
+    inds1, inds2 = np.nonzero(cos_dists <= max_diameter)
+    keep = inds1 < inds2
+    inds1, inds2 = inds1[keep], inds2[keep]
+    dists = cos_dists[inds1, inds2]
+    order = np.argsort(dists, kind="stable")
+
+    union_find = UnionFind(
+        len(points), max_diameter=max_diameter, metric="cosine"
+    )
+    union_find.union_pairs(inds1[order], inds2[order], dists=dists[order])
+
+    roots = union_find.components()
+    assert len(np.unique(roots)) < len(points)
+    for root in np.unique(roots):
+        members = np.flatnonzero(roots == root)
+        assert cos_dists[np.ix_(members, members)].max() <= max_diameter
@@ -0,0 +1,218 @@
+import math
+
+import numpy as np
+
+
+class UnionFind(object):
+    """
+    Array-backed disjoint-set forest with path compression and union by rank,
+    for grouping a stream of neighbor pairs into connected components.
+
+    When ``max_diameter`` is provided, two components are only merged if the
+    bound of the resulting component's diameter is at most ``max_diameter``.
+    The bound is the sum of the diameters of the merged components and the
+    distance of the merging pair, so the constraint is conservative.
+
+    The bound only holds for distances that satisfy the triangle inequality,
+    such as Euclidean, Manhattan and Hamming distances. Cosine distances do
+    not, so for the "cosine" metric the bound is computed for the chordal
+    distance ``sqrt(2 * d)`` between the normalized vectors, which does, and
+    compared to ``max_diameter`` in the same units. For other distances, such
+    as dot products, the constraint only limits chaining heuristically.
+
+    Args:
+        num_nodes: the number of nodes
+        max_diameter (None): an optional maximum distance between any two
+            members of a component
+        metric (None): the metric of the distances, such as "cosine"
+    """
+
+    def __init__(self, num_nodes, max_diameter=None, metric=None):
+        self.max_diameter = max_diameter
+        self.metric = metric
+        self.num_groups = 0
+        self.num_grouped = 0
+        self._parent = np.arange(num_nodes, dtype=np.int64)
+        self._rank = np.zeros(num_nodes, dtype=np.uint8)
+        self._size = np.ones(num_nodes, dtype=np.int64)
+        self._max_dist = np.zeros(num_nodes, dtype=np.float64)
+        if max_diameter is not None:
+            self._max_bound = self._to_bound_distance(max_diameter)
+            self._diameter = np.zeros(num_nodes, dtype=np.float64)
+        else:
+            self._diameter = None
+
+    def __len__(self):
+        return len(self._parent)
+
+    def _to_bound_distance(self, dist):
+        if self.metric == "cosine":
+            return math.sqrt(2.0 * max(dist, 0.0))
+
+        return dist
+
+    @property
+    def num_dups(self):
+        """
+        The number of nodes in components with at least two members, minus
+        one representative per component.
+        """
+        return self.num_grouped - self.num_groups
+
+    def find(self, node):
+        """
+        Returns the root of the given node's component.
+        """
+        parent = self._parent
+        root = node
+        while parent[root] != root:
+            root = parent[root]
+
+        while parent[node] != root:
+            parent[node], node = root, parent[node]
+
+        return root
+
+    def find_many(self, nodes):
+        """
+        Returns an array containing the root of each of the given nodes'
+        components.
+        """
+        parent = self._parent
+        nodes = np.asarray(nodes, dtype=np.int64)
+        roots = parent[nodes]
+        while True:
+            grandparents = parent[roots]
+            if np.array_equal(grandparents, roots):
+                break
+
+            roots = grandparents
+
+        parent[nodes] = roots
+        return roots
+
+    def union(self, node1, node2, dist=0):
+        """
+        Merges the components of the given nodes, which are ``dist`` apart.
+
+        Returns True if the components were merged, and False if the nodes
+        were already in the same component or merging them would violate the
+        diameter constraint.
+        """
+        root1, root2 = self.find(node1), self.find(node2)
+        if root1 == root2:
+            return False
+
+        if self._diameter is not None:
+            diameter = (
+                self._diameter[root1]
+                + self._to_bound_distance(dist)
+                + self._diameter[root2]
+            )
+            if diameter > self._max_bound:
+                return False
+
+        rank = self._rank
+        if rank[root1] < rank[root2]:
+            root1, root2 = root2, root1
+
+        self._parent[root2] = root1
+        if rank[root1] == rank[root2]:
+            rank[root1] += 1
+
+        size1, size2 = int(self._size[root1]), int(self._size[root2])
+        self._size[root1] = size1 + size2
+        self.num_groups += 1 - int(size1 > 1) - int(size2 > 1)
+        self.num_grouped += int(size1 == 1) + int(size2 == 1)
+
+        self._max_dist[root1] = max(
+            self._max_dist[root1], self._max_dist[root2], dist
+        )
+        if self._diameter is not None:
+            self._diameter[root1] = diameter
+
+        return True
+
+    def union_pairs(self, inds1, inds2, dists=None):
+        """
+        Merges the components of each pair of nodes in the given arrays.
+
+        Pairs whose nodes are already in the same component are discarded in
+        a vectorized pass, so that only pairs that may merge two components
+        are processed individually.
+
+        Returns the number of merges.
+        """
+        inds1 = np.asarray(inds1, dtype=np.int64)
+        inds2 = np.asarray(inds2, dtype=np.int64)
+        if dists is None:
+            dists = np.zeros(len(inds1))
+
+        keep = self.find_many(inds1) != self.find_many(inds2)
+
+        num_merged = 0
+        for i, j, d in zip(
+            inds1[keep].tolist(),
+            inds2[keep].tolist(),
+            np.asarray(dists)[keep].tolist(),
+        ):
+            num_merged += self.union(i, j, dist=d)
+
+        return num_merged
+
+    def components(self):
+        """
+        Returns an array containing the root of every node's component.
+        """
+        return self.find_many(np.arange(len(self._parent)))
+
+    def max_distances(self):
+        """
+        Returns an array containing, for every node, the largest distance of
+        the pairs that were merged to form its component.
+        """
+        return self._max_dist[self.components()]
+
+
+def get_component_ids(ids, union_find):
+    """
+    Returns a dict mapping the ID of every node in a component with at least
+    two members to the smallest ID in its component.
+
+    Group IDs therefore only depend on the membership of each component, not
+    on the order in which pairs were processed.
+    """
+    ids = np.asarray(ids, dtype=str)
+    roots = union_find.components()
+
+    sizes = np.bincount(roots, minlength=len(roots))
+    grouped = np.flatnonzero(sizes[roots] > 1)
+    if len(grouped) == 0:
+        return {}
+
+    ## the rank of each ID in sorted order, so that minima are integer ops
+    order = np.argsort(ids, kind="stable")
+    id_ranks = np.empty(len(ids), dtype=np.int64)
+    id_ranks[order] = np.arange(len(ids))
+
+    min_ranks = np.full(len(ids), len(ids), dtype=np.int64)
+    np.minimum.at(min_ranks, roots[grouped], id_ranks[grouped])
+    group_ids = ids[order[min_ranks[roots[grouped]]]]
+
+    return dict(zip(ids[grouped].tolist(), group_ids.tolist()))
+
+
+def get_component_max_distances(ids, union_find):
+    """
+    Returns a dict mapping the ID of every node in a component with at least
+    two members to the largest distance of the pairs that were merged to form
+    its component.
+    """
+    ids = np.asarray(ids, dtype=str)
+    roots = union_find.components()
+
+    sizes = np.bincount(roots, minlength=len(roots))
+    grouped = np.flatnonzero(sizes[roots] > 1)
+    max_dists = union_find.max_distances()
+
+    return dict(zip(ids[grouped].tolist(), max_dists[grouped].tolist()))